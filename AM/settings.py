@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'Agences',  # Ajouter cette ligne
 ]
 
@@ -97,6 +98,20 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/ref/settings/#caches
+# Partagé par tous les processus (données de référence, versions des ETags) : le cache
+# mémoire par défaut de Django est propre à chaque processus et y resterait périmé.
+# Table à créer une fois avec « python manage.py createcachetable ».
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'agences_cache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
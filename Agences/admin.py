@@ -1,15 +1,17 @@
-from datetime import timezone  # ← Ça, c'est le timezone de Python stdlib (une classe pour les fuseaux, sans .now())
 from django.utils import timezone as tz  # ← Et là, le bon (Django's), mais aliasé en 'tz'
 from django.contrib import admin
+from django.db.models import F
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import UserChangeForm, UserCreationForm
 from django.http import HttpResponseRedirect, JsonResponse
 from django.urls import path
 from django.shortcuts import render
 from django.contrib import messages
-import pandas as pd
-from .models import User, Agence, TypePrestation, Poste, AppelOffre, AppelOffreCAProdMada, \
-    AppelOffreCARepriseFrance, AppelOffreCAEnvoiMada, AppelOffreCATraitementFrance, AppelOffreCATerrainFrance, \
+from django.core.files.storage import default_storage
+import uuid
+from . import taches
+from .models import User, Agence, TypePrestation, Poste, AppelOffre, AppelOffreEvent, CompteurReference, ProjetPhase, \
+    Tache, AppelOffreCAProdMada, AppelOffreCARepriseFrance, AppelOffreCAEnvoiMada, AppelOffreCATraitementFrance, AppelOffreCATerrainFrance, \
     AppelOffreCAAOGagne, AppelOffreCommercialPerdu, AppelOffreCommercialGagne, AppelOffreCommercialEnCours, \
     AppelOffreCommercialEnAttente
 
@@ -63,7 +65,7 @@ class AppelOffreProdComplement(AppelOffre):
 
 class AppelOffreProdReceptionFranceAdmin(admin.ModelAdmin):
     list_display = ('reference', 'agence', 'nom_affaire', 'date_envoi_mada', 'date_reception_france', 'etape_actuelle')
-    list_filter = ('agence', 'date_envoi_mada')
+    list_filter = ('agence', 'date_envoi_mada', 'etape_prod')
     search_fields = ('reference', 'nom_affaire', 'agence__nom')
     readonly_fields = ('created_at', 'updated_at', 'reference')
 
@@ -77,8 +79,9 @@ class AppelOffreProdReceptionFranceAdmin(admin.ModelAdmin):
         return qs
 
     def etape_actuelle(self, obj):
-        return obj.get_etape_actuelle()
+        return obj.get_etape_prod_display()
     etape_actuelle.short_description = "Étape actuelle"
+    etape_actuelle.admin_order_field = 'etape_prod'
 
     def has_add_permission(self, request):
         return False
@@ -90,7 +93,7 @@ class AppelOffreProdReceptionFranceAdmin(admin.ModelAdmin):
 
 class AppelOffreProdRepriseFranceAdmin(admin.ModelAdmin):
     list_display = ('reference', 'agence', 'nom_affaire', 'date_reception_france', 'date_debut_reprise', 'etape_actuelle')
-    list_filter = ('agence', 'date_reception_france')
+    list_filter = ('agence', 'date_reception_france', 'etape_prod')
     search_fields = ('reference', 'nom_affaire', 'agence__nom')
     readonly_fields = ('created_at', 'updated_at', 'reference')
 
@@ -104,8 +107,9 @@ class AppelOffreProdRepriseFranceAdmin(admin.ModelAdmin):
         return qs
 
     def etape_actuelle(self, obj):
-        return obj.get_etape_actuelle()
+        return obj.get_etape_prod_display()
     etape_actuelle.short_description = "Étape actuelle"
+    etape_actuelle.admin_order_field = 'etape_prod'
 
     def has_add_permission(self, request):
         return False
@@ -117,7 +121,7 @@ class AppelOffreProdRepriseFranceAdmin(admin.ModelAdmin):
 
 class AppelOffreProdEnCoursMadaAdmin(admin.ModelAdmin):
     list_display = ('reference', 'agence', 'nom_affaire', 'date_debut_prod_mada', 'date_fin_prevue_prod_mada', 'etape_actuelle')
-    list_filter = ('agence', 'date_debut_prod_mada')
+    list_filter = ('agence', 'date_debut_prod_mada', 'etape_prod')
     search_fields = ('reference', 'nom_affaire', 'agence__nom')
     readonly_fields = ('created_at', 'updated_at', 'reference')
 
@@ -130,8 +134,9 @@ class AppelOffreProdEnCoursMadaAdmin(admin.ModelAdmin):
         return qs
 
     def etape_actuelle(self, obj):
-        return obj.get_etape_actuelle()
+        return obj.get_etape_prod_display()
     etape_actuelle.short_description = "Étape actuelle"
+    etape_actuelle.admin_order_field = 'etape_prod'
 
     def has_add_permission(self, request):
         return False
@@ -143,7 +148,7 @@ class AppelOffreProdEnCoursMadaAdmin(admin.ModelAdmin):
 
 class AppelOffreProdTermineAdmin(admin.ModelAdmin):
     list_display = ('reference', 'agence', 'nom_affaire', 'date_fin_prod_mada_reelle', 'etape_actuelle')
-    list_filter = ('agence', 'date_fin_prod_mada_reelle')
+    list_filter = ('agence', 'date_fin_prod_mada_reelle', 'etape_prod')
     search_fields = ('reference', 'nom_affaire', 'agence__nom')
     readonly_fields = ('created_at', 'updated_at', 'reference')
 
@@ -156,8 +161,9 @@ class AppelOffreProdTermineAdmin(admin.ModelAdmin):
         return qs
 
     def etape_actuelle(self, obj):
-        return obj.get_etape_actuelle()
+        return obj.get_etape_prod_display()
     etape_actuelle.short_description = "Étape actuelle"
+    etape_actuelle.admin_order_field = 'etape_prod'
 
     def has_add_permission(self, request):
         return False
@@ -168,22 +174,24 @@ class AppelOffreProdTermineAdmin(admin.ModelAdmin):
 
 
 class AppelOffreProdComplementAdmin(admin.ModelAdmin):
-    list_display = ('reference', 'agence', 'nom_affaire', 'date_debut_reprise', 'etape_reprise_france', 'etape_actuelle')
-    list_filter = ('agence', 'date_debut_reprise')
+    list_display = ('reference', 'parent', 'agence', 'nom_affaire', 'date_debut_reprise', 'etape_reprise_france',
+                    'etape_actuelle')
+    list_filter = ('agence', 'date_debut_reprise', 'etape_prod')
     search_fields = ('reference', 'nom_affaire', 'agence__nom')
     readonly_fields = ('created_at', 'updated_at', 'reference')
 
     def get_queryset(self, request):
-        # Compléments (référence contenant "Complément")
+        # Compléments créés par une reprise
         qs = AppelOffre.objects.filter(
             statut='gagne',
-            reference__icontains='Complément'
-        ).select_related('agence', 'commercial', 'responsable_ca')
+            is_complement=True
+        ).select_related('agence', 'commercial', 'responsable_ca', 'parent')
         return qs
 
     def etape_actuelle(self, obj):
-        return obj.get_etape_actuelle()
+        return obj.get_etape_prod_display()
     etape_actuelle.short_description = "Étape actuelle"
+    etape_actuelle.admin_order_field = 'etape_prod'
 
     def has_add_permission(self, request):
         return False
@@ -265,7 +273,7 @@ class AppelOffreCommercialPerduAdmin(admin.ModelAdmin):
 
 class AppelOffreCAAOGagneAdmin(admin.ModelAdmin):
     list_display = ('reference', 'agence', 'commercial', 'responsable_ca', 'date_debut', 'date_fin', 'created_at', 'etape_actuelle')
-    list_filter = ('agence', 'date_debut', 'date_fin')
+    list_filter = ('agence', 'date_debut', 'date_fin', 'etape_ca')
     search_fields = ('reference', 'agence__nom', 'commercial__prenoms')
     readonly_fields = ('created_at', 'updated_at', 'reference')
 
@@ -278,6 +286,7 @@ class AppelOffreCAAOGagneAdmin(admin.ModelAdmin):
         # Utiliser la méthode du modèle pour afficher l'étape actuelle
         return obj.get_etape_actuelle()
     etape_actuelle.short_description = "Étape actuelle"
+    etape_actuelle.admin_order_field = 'etape_ca'
 
     def has_add_permission(self, request):
         return False
@@ -290,7 +299,7 @@ class AppelOffreCAAOGagneAdmin(admin.ModelAdmin):
 class AppelOffreCATerrainFranceAdmin(admin.ModelAdmin):
     list_display = (
     'reference', 'agence', 'nom_affaire', 'date_debut_terrain', 'date_fin_prevue_terrain', 'responsable_prod_terrain', 'etape_actuelle')
-    list_filter = ('agence_terrain', 'date_debut_terrain')
+    list_filter = ('agence_terrain', 'date_debut_terrain', 'etape_ca')
     search_fields = ('reference', 'nom_affaire', 'agence__nom')
     readonly_fields = ('created_at', 'updated_at', 'reference')
 
@@ -306,6 +315,7 @@ class AppelOffreCATerrainFranceAdmin(admin.ModelAdmin):
         # Utiliser la méthode du modèle pour afficher l'étape actuelle
         return obj.get_etape_actuelle()
     etape_actuelle.short_description = "Étape actuelle"
+    etape_actuelle.admin_order_field = 'etape_ca'
 
     def has_add_permission(self, request):
         return False
@@ -319,7 +329,7 @@ class AppelOffreCATraitementFranceAdmin(admin.ModelAdmin):
     list_display = (
     'reference', 'agence', 'nom_affaire_traitement', 'date_debut_traitement', 'date_fin_prevue_traitement',
     'responsable_prod_traitement', 'etape_actuelle')
-    list_filter = ('agence_traitement', 'date_debut_traitement')
+    list_filter = ('agence_traitement', 'date_debut_traitement', 'etape_ca')
     search_fields = ('reference', 'nom_affaire_traitement', 'agence__nom')
     readonly_fields = ('created_at', 'updated_at', 'reference')
 
@@ -335,6 +345,7 @@ class AppelOffreCATraitementFranceAdmin(admin.ModelAdmin):
         # Utiliser la méthode du modèle pour afficher l'étape actuelle
         return obj.get_etape_actuelle()
     etape_actuelle.short_description = "Étape actuelle"
+    etape_actuelle.admin_order_field = 'etape_ca'
 
     def has_add_permission(self, request):
         return False
@@ -346,7 +357,7 @@ class AppelOffreCATraitementFranceAdmin(admin.ModelAdmin):
 
 class AppelOffreCAEnvoiMadaAdmin(admin.ModelAdmin):
     list_display = ('reference', 'agence', 'nom_affaire', 'date_envoi_mada', 'date_livraison_prevue_mada', 'etape_actuelle')
-    list_filter = ('agence', 'date_envoi_mada')
+    list_filter = ('agence', 'date_envoi_mada', 'etape_ca')
     search_fields = ('reference', 'nom_affaire', 'agence__nom')
     readonly_fields = ('created_at', 'updated_at', 'reference')
 
@@ -362,6 +373,7 @@ class AppelOffreCAEnvoiMadaAdmin(admin.ModelAdmin):
         # Utiliser la méthode du modèle pour afficher l'étape actuelle
         return obj.get_etape_actuelle()
     etape_actuelle.short_description = "Étape actuelle"
+    etape_actuelle.admin_order_field = 'etape_ca'
 
     def has_add_permission(self, request):
         return False
@@ -373,7 +385,7 @@ class AppelOffreCAEnvoiMadaAdmin(admin.ModelAdmin):
 
 class AppelOffreCARepriseFranceAdmin(admin.ModelAdmin):
     list_display = ('reference', 'agence', 'nom_affaire', 'date_debut_reprise', 'date_fin_prevue_reprise', 'etape_actuelle')
-    list_filter = ('agence', 'date_debut_reprise')
+    list_filter = ('agence', 'date_debut_reprise', 'etape_ca')
     search_fields = ('reference', 'nom_affaire', 'agence__nom')
     readonly_fields = ('created_at', 'updated_at', 'reference')
 
@@ -389,6 +401,7 @@ class AppelOffreCARepriseFranceAdmin(admin.ModelAdmin):
         # Utiliser la méthode du modèle pour afficher l'étape actuelle
         return obj.get_etape_actuelle()
     etape_actuelle.short_description = "Étape actuelle"
+    etape_actuelle.admin_order_field = 'etape_ca'
 
     def has_add_permission(self, request):
         return False
@@ -400,7 +413,7 @@ class AppelOffreCARepriseFranceAdmin(admin.ModelAdmin):
 
 class AppelOffreCAProdMadaAdmin(admin.ModelAdmin):
     list_display = ('reference', 'agence', 'nom_affaire', 'date_debut_prod_mada', 'date_fin_prevue_prod_mada', 'etape_actuelle')
-    list_filter = ('agence', 'date_debut_prod_mada')
+    list_filter = ('agence', 'date_debut_prod_mada', 'etape_ca')
     search_fields = ('reference', 'nom_affaire', 'agence__nom')
     readonly_fields = ('created_at', 'updated_at', 'reference')
 
@@ -416,6 +429,7 @@ class AppelOffreCAProdMadaAdmin(admin.ModelAdmin):
         # Utiliser la méthode du modèle pour afficher l'étape actuelle
         return obj.get_etape_actuelle()
     etape_actuelle.short_description = "Étape actuelle"
+    etape_actuelle.admin_order_field = 'etape_ca'
 
     def has_add_permission(self, request):
         return False
@@ -427,7 +441,7 @@ class AppelOffreCAProdMadaAdmin(admin.ModelAdmin):
 
 class AppelOffreCATermineAdmin(admin.ModelAdmin):
     list_display = ('reference', 'agence', 'nom_affaire', 'date_fin_prod_mada_reelle', 'etape_actuelle')
-    list_filter = ('agence',)
+    list_filter = ('agence', 'etape_ca')
     search_fields = ('reference', 'nom_affaire', 'agence__nom')
     readonly_fields = ('created_at', 'updated_at', 'reference')
 
@@ -443,6 +457,7 @@ class AppelOffreCATermineAdmin(admin.ModelAdmin):
         # Utiliser la méthode du modèle pour afficher l'étape actuelle
         return obj.get_etape_actuelle()
     etape_actuelle.short_description = "Étape actuelle"
+    etape_actuelle.admin_order_field = 'etape_ca'
 
     def has_add_permission(self, request):
         return False
@@ -590,129 +605,19 @@ class CustomUserAdmin(UserAdmin):
         if request.method == 'POST' and request.FILES.get('excel_file'):
             excel_file = request.FILES['excel_file']
 
-            try:
-                if excel_file.name.endswith('.xlsx'):
-                    df = pd.read_excel(excel_file, header=None)
-                else:
-                    messages.error(request, "Le fichier doit être au format Excel (.xlsx)")
-                    return render(request, 'admin/Agences/user/import_excel.html')
+            if not excel_file.name.endswith('.xlsx'):
+                messages.error(request, "Le fichier doit être au format Excel (.xlsx)")
+                return render(request, 'admin/Agences/user/import_excel.html')
 
-                results = self.process_excel_data(df, request)
-                self.display_import_results(request, results)
-                return HttpResponseRedirect('../')
-
-            except Exception as e:
-                messages.error(request, f"Erreur lors de l'importation : {str(e)}")
+            # L'import tourne dans un worker (manage.py run_workers) : la requête répond tout de suite
+            chemin = default_storage.save(f'imports/{uuid.uuid4().hex}.xlsx', excel_file)
+            tache = taches.planifier('import_utilisateurs', utilisateur=request.user, chemin=chemin)
+            messages.info(request, f"Import lancé en tâche de fond (tâche n°{tache.pk}), "
+                                   f"suivez son avancement dans « Tâches de fond »")
+            return HttpResponseRedirect('../')
 
         return render(request, 'admin/Agences/user/import_excel.html')
 
-    def process_excel_data(self, df, request):
-        results = {
-            'created': 0,
-            'updated': 0,
-            'errors': [],
-            'users_processed': set()
-        }
-
-        start_row = 1 if df.iloc[0, 0] in ['Nom', 'nom', 'NOM'] else 0
-
-        for index, row in df.iterrows():
-            if index < start_row:
-                continue
-
-            try:
-                nom = str(row[0]).strip() if pd.notna(row[0]) else ""
-                prenoms = str(row[1]).strip() if pd.notna(row[1]) else ""
-                pseudo = str(row[2]).strip() if pd.notna(row[2]) else ""
-                email = str(row[3]).strip() if pd.notna(row[3]) else ""
-                type_prestation_nom = str(row[4]).strip() if pd.notna(row[4]) else ""
-                poste_nom = str(row[5]).strip() if pd.notna(row[5]) else ""
-                agence_nom = str(row[6]).strip() if pd.notna(row[6]) else ""
-
-                if not all([prenoms, pseudo, email]):
-                    results['errors'].append(f"Ligne {index + 1}: Champs obligatoires manquants")
-                    continue
-
-                user, created = self.get_or_create_user(email, prenoms, pseudo, nom, request)
-
-                if agence_nom:
-                    agence, _ = Agence.objects.get_or_create(nom=agence_nom)
-                    user.agence = agence
-
-                if poste_nom:
-                    poste = self.get_poste(poste_nom)
-                    if poste:
-                        user.poste = poste
-
-                if type_prestation_nom:
-                    type_prestation, _ = TypePrestation.objects.get_or_create(nom=type_prestation_nom)
-                    user.types_prestation.add(type_prestation)
-
-                user.save()
-
-                if created:
-                    results['created'] += 1
-                else:
-                    results['updated'] += 1
-
-                results['users_processed'].add(email)
-
-            except Exception as e:
-                results['errors'].append(f"Ligne {index + 1}: {str(e)}")
-
-        return results
-
-    def get_or_create_user(self, email, prenoms, pseudo, nom, request):
-        try:
-            user = User.objects.get(email=email)
-            created = False
-        except User.DoesNotExist:
-            user = User.objects.create_user(
-                email=email,
-                prenoms=prenoms,
-                pseudo=pseudo,
-                password='groupeparera*25'
-            )
-            created = True
-
-        user.nom = nom or user.nom
-        user.prenoms = prenoms or user.prenoms
-        user.pseudo = pseudo or user.pseudo
-
-        return user, created
-
-    def get_poste(self, poste_nom):
-        poste_mapping = {
-            'COMMERCIAL': 'COMMERCIAL',
-            'Commercial': 'COMMERCIAL',
-            'commercial': 'COMMERCIAL',
-            'CA': 'CA',
-            'ca': 'CA',
-            'PROD': 'PROD',
-            'Prod': 'PROD',
-            'prod': 'PROD',
-            'Production': 'PROD',
-            'production': 'PROD'
-        }
-
-        poste_code = poste_mapping.get(poste_nom, poste_nom.upper())
-
-        try:
-            return Poste.objects.get(nom=poste_code)
-        except Poste.DoesNotExist:
-            return Poste.objects.create(nom=poste_code)
-
-    def display_import_results(self, request, results):
-        if results['created'] > 0:
-            messages.success(request, f"{results['created']} utilisateur(s) créé(s) avec succès")
-        if results['updated'] > 0:
-            messages.success(request, f"{results['updated']} utilisateur(s) mis à jour avec succès")
-        if results['errors']:
-            for error in results['errors'][:10]:
-                messages.error(request, error)
-            if len(results['errors']) > 10:
-                messages.warning(request, f"... et {len(results['errors']) - 10} autres erreurs")
-
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
         extra_context['show_import_button'] = True
@@ -724,6 +629,54 @@ class CustomUserAdmin(UserAdmin):
 # On utilise admin.site.register une seule fois pour AppelOffre avec la vue principale
 # Les autres vues seront gérées via un ModelAdmin personnalisé avec onglets
 
+@admin.register(Tache)
+class TacheAdmin(admin.ModelAdmin):
+    list_display = ('id', 'nom', 'statut', 'progression_affichee', 'tentatives', 'created_by', 'created_at',
+                    'finished_at')
+    list_filter = ('statut', 'nom')
+    readonly_fields = ('nom', 'arguments', 'statut', 'tentatives', 'max_tentatives', 'progression', 'message',
+                       'resultat', 'erreur', 'executer_apres', 'created_by', 'created_at', 'started_at',
+                       'finished_at')
+    actions = ['relancer']
+
+    def progression_affichee(self, obj):
+        return f"{obj.progression} %" + (f" - {obj.message}" if obj.message else "")
+
+    progression_affichee.short_description = "Progression"
+
+    @admin.action(description="Relancer les tâches sélectionnées")
+    def relancer(self, request, queryset):
+        total = queryset.exclude(statut='en_cours').update(
+            statut='en_attente', tentatives=0, progression=0, executer_apres=tz.now(), finished_at=None
+        )
+        messages.success(request, f"{total} tâche(s) remise(s) en file")
+
+    def has_add_permission(self, request):
+        return False
+
+
+class AppelOffreEventInline(admin.TabularInline):
+    model = AppelOffreEvent
+    fields = ('date', 'type', 'auteur', 'payload')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class ProjetPhaseInline(admin.TabularInline):
+    model = ProjetPhase
+    fields = ('phase', 'date_debut', 'date_fin_prevue', 'date_fin_reelle', 'agence', 'responsable')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 class AppelOffreAdmin(admin.ModelAdmin):
     list_display = (
     'reference', 'agence', 'commercial', 'responsable_ca', 'statut', 'date_debut', 'date_fin', 'created_at')
@@ -733,6 +686,7 @@ class AppelOffreAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at', 'updated_at', 'reference')
     date_hierarchy = 'created_at'
     filter_horizontal = ('prestations',)
+    inlines = [ProjetPhaseInline, AppelOffreEventInline]
 
     fieldsets = (
         ('Informations générales', {
@@ -760,20 +714,7 @@ class AppelOffreAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         if not obj.pk:
             if not obj.reference:
-                current_year = tz.now().year  # ← tz au lieu de timezone
-                last_ao = AppelOffre.objects.filter(
-                    created_at__year=current_year
-                ).order_by('-id').first()
-
-                next_number = 1
-                if last_ao:
-                    try:
-                        last_number = int(last_ao.reference.split('-')[-1])
-                        next_number = last_number + 1
-                    except:
-                        next_number = 1
-
-                obj.reference = f"AO-{current_year}-{str(next_number).zfill(3)}"
+                obj.reference = CompteurReference.prochaine_reference(tz.now().year)
 
         super().save_model(request, obj, form, change)
 
@@ -781,24 +722,36 @@ class AppelOffreAdmin(admin.ModelAdmin):
 # ==================== ACTIONS PERSONNALISÉES ====================
 
 def marquer_comme_gagne(modeladmin, request, queryset):
-    queryset.update(statut='gagne', date_fin_reelle=timezone.now())
-    messages.success(request, f"{queryset.count()} appel(s) d'offre marqué(s) comme gagné(s)")
+    # Sélection figée avant l'update : les filtres de la liste peuvent porter sur le statut
+    appels = AppelOffre.objects.filter(pk__in=list(queryset.values_list('pk', flat=True)))
+    appels.update(statut='gagne', date_fin_reelle=tz.now().date(), version=F('version') + 1, updated_at=tz.now())
+    appels.synchroniser_etapes()  # update() ne passe pas par save()
+    appels.synchroniser_phases()
+    messages.success(request, f"{appels.count()} appel(s) d'offre marqué(s) comme gagné(s)")
 
 
 marquer_comme_gagne.short_description = "Marquer comme gagné"
 
 
 def marquer_comme_perdu(modeladmin, request, queryset):
-    queryset.update(statut='perdu', date_fin_reelle=timezone.now())
-    messages.success(request, f"{queryset.count()} appel(s) d'offre marqué(s) comme perdu(s)")
+    # Sélection figée avant l'update : les filtres de la liste peuvent porter sur le statut
+    appels = AppelOffre.objects.filter(pk__in=list(queryset.values_list('pk', flat=True)))
+    appels.update(statut='perdu', date_fin_reelle=tz.now().date(), version=F('version') + 1, updated_at=tz.now())
+    appels.synchroniser_etapes()  # update() ne passe pas par save()
+    appels.synchroniser_phases()
+    messages.success(request, f"{appels.count()} appel(s) d'offre marqué(s) comme perdu(s)")
 
 
 marquer_comme_perdu.short_description = "Marquer comme perdu"
 
 
 def remettre_en_cours(modeladmin, request, queryset):
-    queryset.update(statut='en_cours', date_fin_reelle=None)
-    messages.success(request, f"{queryset.count()} appel(s) d'offre remis en cours")
+    # Sélection figée avant l'update : les filtres de la liste peuvent porter sur le statut
+    appels = AppelOffre.objects.filter(pk__in=list(queryset.values_list('pk', flat=True)))
+    appels.update(statut='en_cours', date_fin_reelle=None, version=F('version') + 1, updated_at=tz.now())
+    appels.synchroniser_etapes()  # update() ne passe pas par save()
+    appels.synchroniser_phases()
+    messages.success(request, f"{appels.count()} appel(s) d'offre remis en cours")
 
 
 remettre_en_cours.short_description = "Remettre en cours"
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 class AgencesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Agences'
-    verbose_name = 'Gestion des Agences'
\ No newline at end of file
+    verbose_name = 'Gestion des Agences'
+
+    def ready(self):
+        from . import signals  # noqa: F401
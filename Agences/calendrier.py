@@ -0,0 +1,92 @@
+"""Événements du calendrier CA, regroupés par jour.
+
+Un événement est une date marquante d'un projet gagné : début de phase,
+échéance prévue, livraison Mada ou réception en France. Les événements d'un
+mois sont numérotés par jour dans une seule requête SQL (fonctions de
+fenêtrage) : seuls les ``limite`` premiers de chaque jour sont renvoyés, avec
+le nombre total pour afficher « +N ».
+"""
+import calendar
+from datetime import date
+
+from django.db import connection
+from django.db.models import F, Value
+
+from . import workflow
+from .models import Agence, AppelOffre, ProjetPhase
+
+LIMITE_DEFAUT = 3
+LIMITE_MAX = 20
+
+TYPE_CHOICES = [
+    ('debut', 'Début'),
+    ('echeance', 'Échéance prévue'),
+    ('livraison', 'Livraison Mada'),
+    ('reception', 'Réception France'),
+]
+
+
+def _evenements(queryset, type_evenement, champ_date, debut, fin):
+    """Branche de l'union : ``(projet_id, phase, type, jour)`` pour une colonne de dates."""
+    return queryset.filter(**{f'{champ_date}__range': (debut, fin)}).annotate(
+        type=Value(type_evenement), jour=F(champ_date)
+    ).values('projet_id', 'phase', 'type', 'jour').order_by()
+
+
+def evenements_du_mois(annee, mois, limite=LIMITE_DEFAUT, agence_id=None):
+    """Retourne ``{jour: {'evenements': [...], 'autres': n}}`` pour le mois demandé."""
+    debut = date(annee, mois, 1)
+    fin = date(annee, mois, calendar.monthrange(annee, mois)[1])
+
+    projets = AppelOffre.objects.filter(statut='gagne')
+    if agence_id:
+        projets = projets.filter(agence_id=agence_id)
+    phases = ProjetPhase.objects.chevauchant(debut, fin).filter(projet__in=projets)
+    receptions = projets.filter(date_reception_france__range=(debut, fin)).annotate(
+        projet_id=F('id'), phase=Value('envoi_mada'), type=Value('reception'), jour=F('date_reception_france')
+    ).values('projet_id', 'phase', 'type', 'jour').order_by()
+
+    union = _evenements(phases, 'debut', 'date_debut', debut, fin).union(
+        _evenements(phases, 'echeance', 'date_fin_prevue', debut, fin),
+        _evenements(phases.filter(phase='envoi_mada'), 'livraison', 'date_fin_reelle', debut, fin),
+        receptions,
+        all=True,
+    )
+    sql_union, params = union.query.sql_with_params()
+
+    nom = connection.ops.quote_name
+    sql = f"""
+        SELECT e.jour, e.type, e.phase, e.projet_id, ao.{nom('reference')}, ag.{nom('nom')}, ag.{nom('couleur')},
+               e.total
+        FROM (
+            SELECT u.*,
+                   ROW_NUMBER() OVER (PARTITION BY u.jour ORDER BY u.type, u.projet_id, u.phase) AS rang,
+                   COUNT(*) OVER (PARTITION BY u.jour) AS total
+            FROM ({sql_union}) u
+        ) e
+        JOIN {nom(AppelOffre._meta.db_table)} ao ON ao.{nom('id')} = e.projet_id
+        JOIN {nom(Agence._meta.db_table)} ag ON ag.{nom('id')} = ao.{nom('agence_id')}
+        WHERE e.rang <= %s
+        ORDER BY e.jour, e.rang
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, (*params, limite))
+        lignes = cursor.fetchall()
+
+    libelles_types = dict(TYPE_CHOICES)
+    libelles_phases = dict(workflow.PHASE_CHOICES)
+    jours = {}
+    for jour, type_evenement, phase, projet_id, reference, agence, couleur, total in lignes:
+        cle = jour.isoformat()
+        if cle not in jours:
+            jours[cle] = {'evenements': [], 'autres': max(total - limite, 0)}
+        jours[cle]['evenements'].append({
+            'projet_id': projet_id,
+            'reference': reference,
+            'agence': agence,
+            'couleur': couleur,
+            'phase': phase,
+            'type': type_evenement,
+            'libelle': f"{libelles_types[type_evenement]} {libelles_phases[phase]}",
+        })
+    return jours
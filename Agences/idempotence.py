@@ -0,0 +1,86 @@
+"""En-tête ``Idempotency-Key`` des endpoints qui créent des lignes.
+
+Un double clic ou une requête relancée après une coupure réseau doit renvoyer
+la réponse de la première exécution, sans rejouer le workflow. La clé est
+réservée avant d'exécuter la vue, dans la même transaction : une requête
+concurrente portant la même clé attend sur la contrainte d'unicité, puis rejoue
+la réponse de la première une fois celle-ci validée. Seules les réponses
+réussies sont conservées : une erreur annule la réservation, la requête
+corrigée peut être renvoyée avec la même clé.
+
+Les clés sont gardées ``DUREE_CONSERVATION`` puis supprimées par
+``manage.py purger_idempotence``.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import CleIdempotence
+
+DUREE_CONSERVATION = timedelta(hours=24)
+
+
+def limite_conservation():
+    return timezone.now() - DUREE_CONSERVATION
+
+
+def rejouer(enregistrement, chemin, empreinte):
+    if (enregistrement.chemin, enregistrement.empreinte) != (chemin, empreinte):
+        return JsonResponse({'error': "Clé d'idempotence déjà utilisée pour une autre requête"}, status=422)
+    reponse = JsonResponse(enregistrement.reponse, status=enregistrement.statut_http, safe=False)
+    reponse['Idempotent-Replayed'] = 'true'
+    return reponse
+
+
+def idempotent(vue):
+    """Rejoue la réponse enregistrée d'un POST déjà reçu avec le même ``Idempotency-Key``."""
+    @wraps(vue)
+    def enveloppe(request, *args, **kwargs):
+        cle = request.headers.get('Idempotency-Key')
+        if request.method != 'POST' or not cle:
+            return vue(request, *args, **kwargs)
+        if len(cle) > 255:
+            return JsonResponse({'error': "Idempotency-Key trop longue (255 caractères maximum)"}, status=400)
+
+        empreinte = hashlib.sha256(request.body).hexdigest()
+        cles = CleIdempotence.objects.filter(utilisateur=request.user, cle=cle)
+        cles.filter(created_at__lt=limite_conservation()).delete()
+        enregistrement = cles.first()
+        if enregistrement:
+            return rejouer(enregistrement, request.path, empreinte)
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    # Réservation : une requête concurrente avec la même clé attend ici la fin de la nôtre
+                    enregistrement = CleIdempotence.objects.create(
+                        utilisateur=request.user, cle=cle, chemin=request.path, empreinte=empreinte,
+                        statut_http=0, reponse={},
+                    )
+            except IntegrityError:
+                # Même clé exécutée en parallèle et validée avant nous : on rejoue sa réponse
+                enregistrement = None
+            if enregistrement:
+                reponse = vue(request, *args, **kwargs)
+                if not 200 <= reponse.status_code < 300:
+                    # Rien n'est conservé : la requête corrigée pourra réutiliser la clé
+                    transaction.set_rollback(True)
+                    return reponse
+                enregistrement.statut_http = reponse.status_code
+                enregistrement.reponse = json.loads(reponse.content)
+                enregistrement.save(update_fields=['statut_http', 'reponse'])
+                return reponse
+        return rejouer(cles.get(), request.path, empreinte)
+
+    return enveloppe
+
+
+def purger(limite=None):
+    """Supprime les clés expirées ; retourne le nombre de clés supprimées."""
+    supprimees, _ = CleIdempotence.objects.filter(created_at__lt=limite or limite_conservation()).delete()
+    return supprimees
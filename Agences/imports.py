@@ -0,0 +1,198 @@
+"""Import Excel des utilisateurs (colonnes : nom, prénoms, pseudo, email, prestation, poste, agence).
+
+Le classeur est lu en flux et les utilisateurs écrits par lots ; l'import est
+lancé en tâche de fond depuis l'admin (voir taches.py).
+"""
+import openpyxl
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import references
+from .models import MOT_DE_PASSE_DEFAUT, Agence, Poste, TypePrestation, User, VersionTable
+
+TAILLE_LOT = 500
+
+POSTES = {
+    'COMMERCIAL': 'COMMERCIAL',
+    'Commercial': 'COMMERCIAL',
+    'commercial': 'COMMERCIAL',
+    'CA': 'CA',
+    'ca': 'CA',
+    'PROD': 'PROD',
+    'Prod': 'PROD',
+    'prod': 'PROD',
+    'Production': 'PROD',
+    'production': 'PROD'
+}
+
+
+def get_poste_code(poste_nom):
+    return POSTES.get(poste_nom, poste_nom.upper())
+
+
+def importer_fichier(fichier, progression=None):
+    """Importe un fichier .xlsx ouvert ; ``progression(pourcentage)`` est appelée après chaque lot."""
+    classeur = openpyxl.load_workbook(fichier, read_only=True, data_only=True)
+    try:
+        feuille = classeur.active
+        return importer_lignes(feuille.iter_rows(values_only=True), progression, total=feuille.max_row)
+    finally:
+        classeur.close()
+
+
+def importer_lignes(lignes, progression=None, total=None):
+    """Importe les lignes par lots et retourne ``{'created', 'updated', 'errors'}``.
+
+    Chaque lot est validé dans sa propre transaction, puis ``progression`` est
+    appelée hors transaction : l'avancement enregistré est visible des autres
+    connexions pendant l'import. Une ligne invalide est signalée dans
+    ``errors`` et ignorée sans interrompre les autres ; si un lot échoue, les
+    lots déjà validés restent en place et la relance de la tâche les réécrit à
+    l'identique (les utilisateurs sont retrouvés par e-mail).
+    """
+    results = {
+        'created': 0,
+        'updated': 0,
+        'errors': [],
+    }
+    contexte = {
+        'agences': {agence.nom: agence for agence in Agence.objects.all()},
+        'postes': {poste.nom: poste for poste in Poste.objects.all()},
+        'prestations': {prestation.nom: prestation for prestation in TypePrestation.objects.all()},
+        # Un seul hachage PBKDF2 pour tous les comptes créés
+        'mot_de_passe': make_password(MOT_DE_PASSE_DEFAUT),
+        'tables_modifiees': set(),
+        # Noms refusés par le modèle, avec le message à reporter sur chaque ligne qui les utilise
+        'refuses': {'agences': {}, 'postes': {}, 'prestations': {}},
+    }
+
+    def lot_termine(index):
+        if progression and total:
+            progression(min(index * 100 // total, 99))
+
+    def importer_lot(lot):
+        with transaction.atomic():
+            _importer_lot(lot, contexte, results)
+
+    try:
+        lot = []
+        for index, row in enumerate(lignes, start=1):
+            row = (list(row) + [None] * 7)[:7]
+            if index == 1 and row[0] in ['Nom', 'nom', 'NOM']:
+                continue
+            if all(valeur is None for valeur in row):
+                continue
+
+            nom, prenoms, pseudo, email, type_prestation_nom, poste_nom, agence_nom = (
+                str(valeur).strip() if valeur is not None else "" for valeur in row
+            )
+            if not all([prenoms, pseudo, email]):
+                results['errors'].append(f"Ligne {index}: Champs obligatoires manquants")
+                continue
+
+            lot.append((index, User.objects.normalize_email(email), nom, prenoms, pseudo,
+                        type_prestation_nom, poste_nom, agence_nom))
+            if len(lot) >= TAILLE_LOT:
+                importer_lot(lot)
+                lot = []
+                lot_termine(index)
+        if lot:
+            importer_lot(lot)
+    finally:
+        # bulk_create / bulk_update ne déclenchent pas les signaux : versions à incrémenter ici,
+        # y compris pour les lots validés avant une erreur
+        for nom_table in contexte['tables_modifiees']:
+            VersionTable.incrementer(nom_table)
+            references.invalider(nom_table)
+
+    return results
+
+
+def _importer_lot(lot, contexte, results):
+    """Crée ou met à jour les utilisateurs d'un lot en quelques requêtes groupées"""
+    _completer_references(lot, contexte)
+    existants = {user.email: user for user in User.objects.filter(email__in={ligne[1] for ligne in lot})}
+
+    nouveaux, modifies, liens = {}, {}, set()
+    for index, email, nom, prenoms, pseudo, type_prestation_nom, poste_nom, agence_nom in lot:
+        refus = [contexte['refuses'][cle][valeur] for cle, valeur in [
+            ('agences', agence_nom), ('postes', get_poste_code(poste_nom)), ('prestations', type_prestation_nom),
+        ] if valeur in contexte['refuses'][cle]]
+        if refus:
+            results['errors'].append(f"Ligne {index}: {'; '.join(refus)}")
+            continue
+
+        user = existants.get(email) or nouveaux.get(email)
+        created = user is None
+        if created:
+            user = User(email=email, prenoms=prenoms, pseudo=pseudo, password=contexte['mot_de_passe'])
+
+        # Une cellule vide ne remplace pas la valeur existante
+        user.nom = nom or user.nom
+        user.prenoms = prenoms or user.prenoms
+        user.pseudo = pseudo or user.pseudo
+        if agence_nom:
+            user.agence = contexte['agences'][agence_nom]
+        if poste_nom:
+            user.poste = contexte['postes'][get_poste_code(poste_nom)]
+
+        try:
+            user.clean_fields(exclude=['password', 'photo'])
+        except ValidationError as e:
+            results['errors'].append(f"Ligne {index}: {'; '.join(e.messages)}")
+            if user.pk:
+                user.refresh_from_db()  # annuler les modifications de cette ligne
+            continue
+
+        if email in existants:
+            modifies[email] = user
+        else:
+            nouveaux[email] = user
+        if type_prestation_nom:
+            liens.add((email, contexte['prestations'][type_prestation_nom].pk))
+
+        if created:
+            results['created'] += 1
+        else:
+            results['updated'] += 1
+
+    if nouveaux:
+        User.objects.bulk_create(nouveaux.values())
+    if modifies:
+        User.objects.bulk_update(modifies.values(), ['nom', 'prenoms', 'pseudo', 'agence', 'poste'])
+    if liens:
+        utilisateurs = {**modifies, **nouveaux}
+        User.types_prestation.through.objects.bulk_create([
+            User.types_prestation.through(user_id=utilisateurs[email].pk, typeprestation_id=prestation_id)
+            for email, prestation_id in liens if email in utilisateurs
+        ], ignore_conflicts=True)
+    if nouveaux or modifies:
+        contexte['tables_modifiees'].add('user')
+
+
+def _completer_references(lot, contexte):
+    """Crée en une requête par table les agences, postes et prestations inconnus du lot.
+
+    Un nom que le modèle refuse (trop long, poste hors ``POSTE_CHOICES``) n'est
+    pas créé : il est rangé dans ``contexte['refuses']`` et les lignes qui
+    l'utilisent sont signalées en erreur.
+    """
+    for cle, modele, nom_table, noms in [
+        ('agences', Agence, 'agence', {ligne[7] for ligne in lot if ligne[7]}),
+        ('postes', Poste, 'poste', {get_poste_code(ligne[6]) for ligne in lot if ligne[6]}),
+        ('prestations', TypePrestation, 'typeprestation', {ligne[5] for ligne in lot if ligne[5]}),
+    ]:
+        champ = modele._meta.get_field('nom')
+        manquants = set()
+        for nom in noms - contexte[cle].keys() - contexte['refuses'][cle].keys():
+            try:
+                champ.clean(nom, None)
+            except ValidationError as e:
+                contexte['refuses'][cle][nom] = f"{modele._meta.verbose_name} « {nom} » : {' '.join(e.messages)}"
+            else:
+                manquants.add(nom)
+        if manquants:
+            modele.objects.bulk_create([modele(nom=nom) for nom in manquants], ignore_conflicts=True)
+            contexte[cle].update((objet.nom, objet) for objet in modele.objects.filter(nom__in=manquants))
+            contexte['tables_modifiees'].add(nom_table)
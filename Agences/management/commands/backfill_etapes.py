@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from Agences.models import AppelOffre
+
+
+class Command(BaseCommand):
+    help = "Recalcule les étapes CA/PROD stockées de tous les appels d'offre"
+
+    def handle(self, *args, **options):
+        total = AppelOffre.objects.all().synchroniser_etapes()
+        self.stdout.write(self.style.SUCCESS(f"{total} appel(s) d'offre mis à jour"))
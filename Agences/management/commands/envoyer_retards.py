@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from Agences import notifications
+
+
+class Command(BaseCommand):
+    help = ("Envoie à chaque responsable CA/PROD le récapitulatif de ses phases en retard "
+            "(à planifier une fois par jour, par exemple via cron)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Afficher les destinataires sans envoyer")
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            for email, destinataire in sorted(notifications.retards_par_destinataire().items()):
+                self.stdout.write(f"{email} : {len(destinataire['retards'])} phase(s) en retard")
+            return
+
+        total = notifications.envoyer_recapitulatifs()
+        self.stdout.write(self.style.SUCCESS(f"{total} récapitulatif(s) envoyé(s)"))
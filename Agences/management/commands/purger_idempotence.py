@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from Agences import idempotence
+
+
+class Command(BaseCommand):
+    help = ("Supprime les clés Idempotency-Key expirées "
+            "(à planifier une fois par jour, par exemple via cron)")
+
+    def handle(self, *args, **options):
+        supprimees = idempotence.purger()
+        self.stdout.write(self.style.SUCCESS(f"{supprimees} clé(s) d'idempotence supprimée(s)"))
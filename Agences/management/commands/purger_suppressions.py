@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from Agences.models import AppelOffreSuppression
+
+
+class Command(BaseCommand):
+    help = ("Supprime les traces d'appels d'offre supprimés sorties de la fenêtre ?since= des tableaux "
+            "(à planifier une fois par jour, par exemple via cron)")
+
+    def handle(self, *args, **options):
+        supprimees = AppelOffreSuppression.purger()
+        self.stdout.write(self.style.SUCCESS(f"{supprimees} trace(s) de suppression purgée(s)"))
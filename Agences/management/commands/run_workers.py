@@ -0,0 +1,50 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from Agences import taches
+
+
+class Command(BaseCommand):
+    help = "Exécute la file des tâches de fond (import Excel, envoi d'e-mails...)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help="Nombre de workers (threads)")
+        parser.add_argument('--intervalle', type=float, default=2.0,
+                            help="Attente en secondes quand la file est vide")
+        parser.add_argument('--once', action='store_true', help="Vider la file puis s'arrêter")
+
+    def handle(self, *args, **options):
+        repris = taches.reprendre_abandonnees()
+        if repris:
+            self.stdout.write(self.style.WARNING(f"{repris} tâche(s) abandonnée(s) remise(s) en file"))
+
+        arret = threading.Event()
+        concurrence = max(options['concurrency'], 1)
+        self.stdout.write(f"{concurrence} worker(s) démarré(s)")
+
+        with ThreadPoolExecutor(max_workers=concurrence) as executeur:
+            workers = [executeur.submit(self.worker, arret, options['intervalle'], options['once'])
+                       for _ in range(concurrence)]
+            try:
+                for worker in workers:
+                    worker.result()
+            except KeyboardInterrupt:
+                self.stdout.write("Arrêt demandé, fin des tâches en cours...")
+                arret.set()
+
+        self.stdout.write(self.style.SUCCESS("Workers arrêtés"))
+
+    def worker(self, arret, intervalle, une_fois):
+        try:
+            while not arret.is_set():
+                close_old_connections()
+                if not taches.executer_suivante():
+                    if une_fois:
+                        return
+                    arret.wait(intervalle)
+        finally:
+            # Chaque thread a sa propre connexion à la base
+            connection.close()
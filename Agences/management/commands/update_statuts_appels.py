@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from Agences.models import AppelOffre
+
+
+class Command(BaseCommand):
+    help = ("Passe à « En cours » les appels d'offre en attente dont la date de début est atteinte "
+            "(à planifier une fois par jour, par exemple via cron)")
+
+    def handle(self, *args, **options):
+        total = AppelOffre.objects.all().demarrer_appels_echus()
+        self.stdout.write(self.style.SUCCESS(f"{total} appel(s) d'offre passé(s) en cours"))
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0019_appeloffre_historique_commentaires'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appeloffre',
+            name='etape_ca',
+            field=models.CharField(choices=[('non_gagne', 'Non gagné'), ('ao_gagne', 'AO Gagné'), ('terrain_france', 'Terrain France'), ('traitement_france', 'Traitement France'), ('traitement_france_en_cours', 'Traitement France en cours'), ('pret_envoi_mada', 'Prêt pour envoi Mada'), ('probleme_reception', 'Problème de réception'), ('envoi_mada', 'Envoi des données à Mada'), ('reprise_france', 'Reprise des données France'), ('prod_mada', 'Prod en cours Mada'), ('production_terminee', 'Production terminée'), ('en_attente', 'En attente')], default='non_gagne', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='appeloffre',
+            name='etape_prod',
+            field=models.CharField(choices=[('reception_france', 'Réception des données en France'), ('probleme_reception', 'Problème de réception'), ('envoi_reprise', 'Envoie de reprise en France'), ('reprise_en_cours', 'Reprise en cours'), ('prod_mada', 'Prod en cours Mada'), ('production_terminee', 'Production terminée'), ('complement', 'Complément'), ('non_pret', 'Non prêt pour PROD')], default='non_pret', max_length=30),
+        ),
+        migrations.AddIndex(
+            model_name='appeloffre',
+            index=models.Index(fields=['statut', 'etape_ca'], name='ao_statut_etape_ca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appeloffre',
+            index=models.Index(fields=['statut', 'etape_prod'], name='ao_statut_etape_prod_idx'),
+        ),
+    ]
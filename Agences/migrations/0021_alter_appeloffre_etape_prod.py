@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0020_appeloffre_etape_ca_etape_prod'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appeloffre',
+            name='etape_prod',
+            field=models.CharField(choices=[('probleme_reception', 'Problème de réception'), ('reception_france', 'Réception des données en France'), ('envoi_reprise', 'Envoie de reprise en France'), ('reprise_en_cours', 'Reprise en cours'), ('prod_mada', 'Prod en cours Mada'), ('production_terminee', 'Production terminée'), ('complement', 'Complément'), ('non_pret', 'Non prêt pour PROD')], default='non_pret', max_length=30),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:22
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+from datetime import datetime, time, timezone
+
+
+def historique_vers_evenements(apps, schema_editor):
+    """Transfère le JSON historique_commentaires vers la table d'événements"""
+    AppelOffre = apps.get_model('Agences', 'AppelOffre')
+    AppelOffreEvent = apps.get_model('Agences', 'AppelOffreEvent')
+
+    evenements = []
+    for projet in AppelOffre.objects.exclude(historique_commentaires=[]).only('id', 'historique_commentaires'):
+        for entry in projet.historique_commentaires or []:
+            entry = dict(entry)
+            jour = datetime.strptime(entry.pop('date'), '%Y-%m-%d').date()
+            evenements.append(AppelOffreEvent(
+                projet_id=projet.id,
+                type=entry.pop('type', 'non_recu'),
+                date=datetime.combine(jour, time.min, tzinfo=timezone.utc),
+                payload=entry,
+            ))
+    AppelOffreEvent.objects.bulk_create(evenements, batch_size=1000)
+
+
+def evenements_vers_historique(apps, schema_editor):
+    AppelOffre = apps.get_model('Agences', 'AppelOffre')
+    AppelOffreEvent = apps.get_model('Agences', 'AppelOffreEvent')
+
+    historiques = {}
+    for evenement in AppelOffreEvent.objects.order_by('date', 'id'):
+        historiques.setdefault(evenement.projet_id, []).append({
+            'date': evenement.date.date().isoformat(),
+            'type': evenement.type,
+            **evenement.payload
+        })
+    for projet_id, historique in historiques.items():
+        AppelOffre.objects.filter(id=projet_id).update(historique_commentaires=historique)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0021_alter_appeloffre_etape_prod'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppelOffreEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('non_recu', 'Non reçu'), ('avant_reenvoi', 'Avant ré-envoi')], max_length=30)),
+                ('date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('auteur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='evenements_appel_offre', to=settings.AUTH_USER_MODEL)),
+                ('projet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='evenements', to='Agences.appeloffre')),
+            ],
+            options={
+                'verbose_name': "Événement d'appel d'offre",
+                'verbose_name_plural': "Événements d'appel d'offre",
+                'ordering': ['date', 'id'],
+                'indexes': [models.Index(fields=['projet', 'date'], name='ao_event_projet_date_idx')],
+            },
+        ),
+        migrations.RunPython(historique_vers_evenements, evenements_vers_historique),
+        migrations.RemoveField(
+            model_name='appeloffre',
+            name='historique_commentaires',
+        ),
+    ]
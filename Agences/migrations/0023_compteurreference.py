@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:25
+
+import re
+
+from django.db import migrations, models
+
+REFERENCE_AO = re.compile(r'^AO-(\d{4})-(\d+)$')
+
+
+def initialiser_compteurs(apps, schema_editor):
+    """Démarre chaque compteur annuel au plus grand numéro déjà attribué"""
+    AppelOffre = apps.get_model('Agences', 'AppelOffre')
+    CompteurReference = apps.get_model('Agences', 'CompteurReference')
+
+    derniers = {}
+    for reference in AppelOffre.objects.filter(reference__startswith='AO-').values_list('reference', flat=True):
+        match = REFERENCE_AO.match(reference)
+        if match:
+            annee, numero = int(match.group(1)), int(match.group(2))
+            derniers[annee] = max(derniers.get(annee, 0), numero)
+
+    CompteurReference.objects.bulk_create(
+        [CompteurReference(annee=annee, dernier_numero=numero) for annee, numero in derniers.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0022_appeloffreevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompteurReference',
+            fields=[
+                ('annee', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('dernier_numero', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Compteur de références',
+                'verbose_name_plural': 'Compteurs de références',
+            },
+        ),
+        migrations.RunPython(initialiser_compteurs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0023_compteurreference'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appeloffre',
+            index=models.Index(fields=['statut', '-updated_at', '-id'], name='ao_statut_maj_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appeloffre',
+            index=models.Index(fields=['agence', 'statut', '-updated_at', '-id'], name='ao_agence_statut_maj_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appeloffre',
+            index=models.Index(fields=['agence_terrain', 'statut', '-updated_at', '-id'], name='ao_agterrain_statut_maj_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:27
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0024_appeloffre_index_pagination'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppelOffreSuppression',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('projet_id', models.BigIntegerField()),
+                ('date_suppression', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': "Appel d'offre supprimé",
+                'verbose_name_plural': "Appels d'offre supprimés",
+            },
+        ),
+        migrations.AlterField(
+            model_name='appeloffre',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0025_appeloffresuppression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionTable',
+            fields=[
+                ('nom', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Version de table',
+                'verbose_name_plural': 'Versions de table',
+            },
+        ),
+    ]
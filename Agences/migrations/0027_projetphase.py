@@ -0,0 +1,69 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:34
+
+import Agences.models
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# (phase, début, fin prévue, fin réelle, agence, responsable) : colonnes d'AppelOffre à reprendre
+PHASES = [
+    ('terrain', 'date_debut_terrain', 'date_fin_prevue_terrain', 'date_fin_terrain_reelle',
+     'agence_terrain_id', 'responsable_prod_terrain_id'),
+    ('traitement', 'date_debut_traitement', 'date_fin_prevue_traitement', 'date_fin_traitement_reelle',
+     'agence_traitement_id', 'responsable_prod_traitement_id'),
+    ('envoi_mada', 'date_envoi_mada', 'date_livraison_prevue_mada', 'date_livraison_reelle_mada', None, None),
+    ('reprise', 'date_debut_reprise', 'date_fin_prevue_reprise', 'date_fin_reprise_reelle', None, None),
+    ('prod_mada', 'date_debut_prod_mada', 'date_fin_prevue_prod_mada', 'date_fin_prod_mada_reelle', None, None),
+]
+
+
+def remplir_phases(apps, schema_editor):
+    """Crée les phases à partir des colonnes de dates existantes (qui sont conservées)"""
+    AppelOffre = apps.get_model('Agences', 'AppelOffre')
+    ProjetPhase = apps.get_model('Agences', 'ProjetPhase')
+
+    phases = []
+    for projet in AppelOffre.objects.iterator(chunk_size=1000):
+        for phase, debut, fin_prevue, fin_reelle, agence, responsable in PHASES:
+            if getattr(projet, debut):
+                phases.append(ProjetPhase(
+                    projet_id=projet.id,
+                    phase=phase,
+                    date_debut=getattr(projet, debut),
+                    date_fin_prevue=getattr(projet, fin_prevue),
+                    date_fin_reelle=getattr(projet, fin_reelle),
+                    agence_id=(getattr(projet, agence) if agence else None) or projet.agence_id,
+                    responsable_id=getattr(projet, responsable) if responsable else None,
+                ))
+    ProjetPhase.objects.bulk_create(phases, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0026_versiontable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjetPhase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phase', models.CharField(choices=[('terrain', 'Terrain France'), ('traitement', 'Traitement France'), ('envoi_mada', 'Envoi Mada'), ('reprise', 'Reprise France'), ('prod_mada', 'Prod Mada')], max_length=20)),
+                ('date_debut', models.DateField()),
+                ('date_fin_prevue', models.DateField(blank=True, null=True)),
+                ('date_fin_reelle', models.DateField(blank=True, null=True)),
+                ('agence', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='phases_projet', to='Agences.agence')),
+                ('projet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='phases', to='Agences.appeloffre')),
+                ('responsable', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='phases_projet', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Phase de projet',
+                'verbose_name_plural': 'Phases de projet',
+                'indexes': [django.contrib.postgres.indexes.GistIndex(Agences.models.PeriodePhase(), name='projet_phase_periode_gist')],
+                'constraints': [models.UniqueConstraint(fields=('projet', 'phase'), name='projet_phase_unique')],
+            },
+        ),
+        migrations.RunPython(remplir_phases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+
+def remplir_phases_ao(apps, schema_editor):
+    """Ajoute la période de l'AO (début, fin prévue, fin réelle) à chaque projet"""
+    AppelOffre = apps.get_model('Agences', 'AppelOffre')
+    ProjetPhase = apps.get_model('Agences', 'ProjetPhase')
+
+    ProjetPhase.objects.bulk_create([
+        ProjetPhase(projet_id=projet['id'], phase='ao', date_debut=projet['date_debut'],
+                    date_fin_prevue=projet['date_fin'], date_fin_reelle=projet['date_fin_reelle'],
+                    agence_id=projet['agence_id'], responsable_id=projet['responsable_ca_id'])
+        for projet in AppelOffre.objects.values(
+            'id', 'date_debut', 'date_fin', 'date_fin_reelle', 'agence_id', 'responsable_ca_id'
+        ).iterator(chunk_size=1000)
+    ], batch_size=1000)
+
+
+def supprimer_phases_ao(apps, schema_editor):
+    apps.get_model('Agences', 'ProjetPhase').objects.filter(phase='ao').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0027_projetphase'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='projetphase',
+            name='phase',
+            field=models.CharField(choices=[('ao', 'AO Gagné'), ('terrain', 'Terrain France'), ('traitement', 'Traitement France'), ('envoi_mada', 'Envoi Mada'), ('reprise', 'Reprise France'), ('prod_mada', 'Prod Mada')], max_length=20),
+        ),
+        migrations.RunPython(remplir_phases_ao, supprimer_phases_ao),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0029_tache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appeloffre',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:01
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0030_appeloffre_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CleIdempotence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cle', models.CharField(max_length=255)),
+                ('chemin', models.CharField(max_length=255)),
+                ('empreinte', models.CharField(max_length=64)),
+                ('statut_http', models.PositiveSmallIntegerField()),
+                ('reponse', models.JSONField()),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('utilisateur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cles_idempotence', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': "Clé d'idempotence",
+                'verbose_name_plural': "Clés d'idempotence",
+                'constraints': [models.UniqueConstraint(fields=('utilisateur', 'cle'), name='cle_idempotence_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0031_cleidempotence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appeloffre',
+            name='is_complement',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='appeloffre',
+            name='parent',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='complements', to='Agences.appeloffre'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:05
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Left, Length
+
+SUFFIXE_COMPLEMENT = ' - Complément'
+
+
+def marquer_complements(apps, schema_editor):
+    """Renseigne is_complement et parent à partir de la référence « <ref> - Complément »"""
+    AppelOffre = apps.get_model('Agences', 'AppelOffre')
+
+    # Même règle que l'ancienne étape PROD « Complément » : l'étape stockée ne change pas
+    AppelOffre.objects.filter(reference__contains='Complément').update(is_complement=True)
+    AppelOffre.objects.filter(reference__endswith=SUFFIXE_COMPLEMENT).update(parent=Subquery(
+        AppelOffre.objects.filter(
+            reference=Left(OuterRef('reference'), Length(OuterRef('reference')) - Value(len(SUFFIXE_COMPLEMENT)))
+        ).values('id')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Agences', '0032_appeloffre_complement_parent'),
+    ]
+
+    operations = [
+        migrations.RunPython(marquer_complements, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,20 @@
-from django.db import models
+from datetime import timedelta
+
+from django.db import models, transaction
+from django.db.backends.postgresql.psycopg_any import DateRange
+from django.db.models import BooleanField, Case, DateField, ExpressionWrapper, F, Q, Value, When
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.contrib.postgres.fields import DateRangeField
+from django.contrib.postgres.indexes import GistIndex
 from django.utils import timezone
 
+from . import workflow
+
+
+# Mot de passe attribué aux comptes créés sans mot de passe (admin, import Excel)
+MOT_DE_PASSE_DEFAUT = 'groupeparera*25'
+
 
 class UserManager(BaseUserManager):
     """Manager personnalisé pour le modèle User sans username."""
@@ -107,14 +120,164 @@ class User(AbstractUser):
 
     def save(self, *args, **kwargs):
         creating = self._state.adding
-        if creating and (not self.password or self.password == 'groupeparera*25'):
-            self.set_password('groupeparera*25')
+        if creating and (not self.password or self.password == MOT_DE_PASSE_DEFAUT):
+            self.set_password(MOT_DE_PASSE_DEFAUT)
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.prenoms} ({self.pseudo})"
 
 
+class JoursEcoules(models.Func):
+    """Nombre de jours entre deux dates, calculé par la base (``fin - debut``)."""
+    arity = 2
+    template = '(%(expressions)s)'
+    arg_joiner = ' - '
+    output_field = models.IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, template='CAST(julianday(%(expressions)s) AS INTEGER)',
+                              arg_joiner=') - julianday(', **extra_context)
+
+
+class PeriodePhase(models.Func):
+    """Période fermée ``[date_debut, fin]`` d'une phase (``daterange`` PostgreSQL).
+
+    La fin est la date réelle, à défaut la date prévue, jamais avant le début.
+    """
+    function = 'DATERANGE'
+    output_field = DateRangeField()
+
+    def __init__(self, **extra):
+        fin = Greatest(F('date_debut'), Coalesce(F('date_fin_reelle'), F('date_fin_prevue'), F('date_debut')))
+        super().__init__(F('date_debut'), fin, Value('[]'), **extra)
+
+
+class CompteurReference(models.Model):
+    """Dernier numéro de référence AO attribué pour une année."""
+    annee = models.PositiveIntegerField(primary_key=True)
+    dernier_numero = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.annee} : {self.dernier_numero}"
+
+    class Meta:
+        verbose_name = "Compteur de références"
+        verbose_name_plural = "Compteurs de références"
+
+    @classmethod
+    def prochaine_reference(cls, annee):
+        """Réserve le numéro suivant de l'année et retourne la référence ``AO-AAAA-NNN``.
+
+        L'UPDATE verrouille la ligne du compteur jusqu'à la fin de la transaction
+        appelante : deux créations simultanées obtiennent des numéros distincts.
+        """
+        with transaction.atomic():
+            if not cls.objects.filter(annee=annee).update(dernier_numero=F('dernier_numero') + 1):
+                _, created = cls.objects.get_or_create(annee=annee, defaults={'dernier_numero': 1})
+                if not created:  # Créé entre-temps par une autre transaction
+                    cls.objects.filter(annee=annee).update(dernier_numero=F('dernier_numero') + 1)
+            numero = cls.objects.values_list('dernier_numero', flat=True).get(annee=annee)
+        return f"AO-{annee}-{str(numero).zfill(3)}"
+
+
+class VersionTable(models.Model):
+    """Numéro de version d'une table de référence, incrémenté à chaque modification.
+
+    Sert à répondre ``304 Not Modified`` sans recalculer les données.
+    """
+    nom = models.CharField(max_length=50, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.nom} v{self.version}"
+
+    class Meta:
+        verbose_name = "Version de table"
+        verbose_name_plural = "Versions de table"
+
+    @classmethod
+    def incrementer(cls, nom):
+        if not cls.objects.filter(nom=nom).update(version=F('version') + 1):
+            _, created = cls.objects.get_or_create(nom=nom, defaults={'version': 1})
+            if not created:
+                cls.objects.filter(nom=nom).update(version=F('version') + 1)
+
+    @classmethod
+    def lire(cls, *noms):
+        """Retourne ``{nom: version}`` en une requête (0 pour une table jamais modifiée)."""
+        versions = dict(cls.objects.filter(nom__in=noms).values_list('nom', 'version'))
+        return {nom: versions.get(nom, 0) for nom in noms}
+
+
+class ModificationConcurrente(Exception):
+    """Le projet a été modifié par une autre écriture depuis sa lecture (version différente)."""
+
+
+class AppelOffreQuerySet(models.QuerySet):
+    """QuerySet des appels d'offre, avec les opérations de masse du workflow."""
+
+    def avec_etapes(self):
+        """Annote ``etape_ca_calculee`` / ``etape_prod_calculee`` directement en SQL."""
+        return self.annotate(
+            etape_ca_calculee=workflow.expression_etape_ca(),
+            etape_prod_calculee=workflow.expression_etape_prod(),
+        )
+
+    def synchroniser_etapes(self):
+        """Recalcule les étapes stockées en une seule requête UPDATE.
+
+        À appeler après un ``update()`` de masse, qui ne passe pas par ``save()``.
+        Seules les lignes dont l'étape change sont réécrites (et leurs
+        ``version`` et ``updated_at`` avancés). Retourne le nombre de lignes
+        mises à jour.
+        """
+        return self.avec_etapes().exclude(
+            etape_ca=F('etape_ca_calculee'), etape_prod=F('etape_prod_calculee')
+        ).update(
+            etape_ca=workflow.expression_etape_ca(),
+            etape_prod=workflow.expression_etape_prod(),
+            version=F('version') + 1,
+            updated_at=timezone.now(),
+        )
+
+    def demarrer_appels_echus(self, aujourd_hui=None):
+        """Passe en une seule requête UPDATE les AO ``en_attente`` commencés à ``en_cours``.
+
+        Retourne le nombre de lignes mises à jour.
+        """
+        aujourd_hui = aujourd_hui or timezone.localdate()
+        return self.filter(statut='en_attente', date_debut__lte=aujourd_hui).update(
+            statut='en_cours',
+            version=F('version') + 1,
+            updated_at=timezone.now(),
+        )
+
+    def synchroniser_phases(self):
+        """Reporte dans ProjetPhase les dates modifiées par un ``update()`` de masse"""
+        ProjetPhase.synchroniser(list(self))
+
+    def en_retard(self, aujourd_hui=None):
+        """Projets gagnés dont l'échéance de l'étape CA en cours est dépassée.
+
+        Annote ``echeance`` (date prévue de l'étape) et ``jours_retard``, tous
+        deux calculés par la base : seules les lignes en retard sont renvoyées.
+        """
+        aujourd_hui = aujourd_hui or timezone.localdate()
+        return self.filter(
+            statut='gagne', etape_ca__in=list(workflow.ECHEANCES_CA)
+        ).annotate(
+            echeance=Case(
+                *[When(etape_ca=etape, then=F(champ)) for etape, champ in workflow.ECHEANCES_CA.items()],
+                output_field=DateField(),
+            ),
+        ).filter(
+            echeance__lt=aujourd_hui
+        ).annotate(
+            jours_retard=JoursEcoules(Value(aujourd_hui, output_field=DateField()), F('echeance')),
+        )
+
+
 class AppelOffre(models.Model):
     STATUT_CHOICES = [
         ('en_attente', 'En attente'),
@@ -130,6 +293,10 @@ class AppelOffre(models.Model):
         ('termine', 'Terminé'),
     ]
 
+    # Étapes calculées des tableaux CA et PROD (voir workflow.py)
+    ETAPE_CA_CHOICES = workflow.ETAPE_CA_CHOICES
+    ETAPE_PROD_CHOICES = workflow.ETAPE_PROD_CHOICES
+
     # Champs existants
     reference = models.CharField(max_length=50, unique=True)
     agence = models.ForeignKey('Agence', on_delete=models.CASCADE)
@@ -145,7 +312,7 @@ class AppelOffre(models.Model):
     probleme_confirme = models.BooleanField(default=False)
     couleur = models.CharField(max_length=7, default='#007bff')
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
 
     # === NOUVEAUX CHAMPS POUR LE WORKFLOW CA ===
@@ -193,7 +360,6 @@ class AppelOffre(models.Model):
     date_fin_reprise_reelle = models.DateField(null=True, blank=True)  # CORRECTION: nom cohérent
     etape_reprise_france = models.CharField(max_length=20, choices=ETAPE_CHOICES, default='en_attente')
     commentaire_fin_reprise = models.TextField(blank=True)  # CORRECTION: nom cohérent
-    historique_commentaires = models.JSONField(default=list, blank=True)  # ← NOUVEAU CHAMP
 
     # Phase Production Madagascar
     date_debut_prod_mada = models.DateField(null=True, blank=True)
@@ -202,94 +368,310 @@ class AppelOffre(models.Model):
     etape_prod_mada = models.CharField(max_length=20, choices=ETAPE_CHOICES, default='en_attente')
     commentaire_fin_prod_mada = models.TextField(blank=True)  # CORRECTION: nom cohérent
 
+    # Étapes calculées, stockées pour filtrer les tableaux CA/PROD en SQL
+    etape_ca = models.CharField(max_length=30, choices=ETAPE_CA_CHOICES, default='non_gagne')
+    etape_prod = models.CharField(max_length=30, choices=ETAPE_PROD_CHOICES, default='non_pret')
+
+    # Complément créé par une reprise (envoie_reprise) et projet d'origine
+    is_complement = models.BooleanField(default=False, db_index=True, editable=False)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, editable=False,
+                               related_name='complements')
+
+    # Verrou optimiste : incrémentée à chaque écriture, vérifiée par enregistrer_transition()
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = AppelOffreQuerySet.as_manager()
+
     def __str__(self):
         return self.reference
 
     class Meta:
         verbose_name = "Appel d'offre"
         verbose_name_plural = "Appels d'offre"
+        indexes = [
+            models.Index(fields=['statut', 'etape_ca'], name='ao_statut_etape_ca_idx'),
+            models.Index(fields=['statut', 'etape_prod'], name='ao_statut_etape_prod_idx'),
+            # Pagination par curseur des tableaux, avec ou sans filtre agence
+            models.Index(fields=['statut', '-updated_at', '-id'], name='ao_statut_maj_idx'),
+            models.Index(fields=['agence', 'statut', '-updated_at', '-id'], name='ao_agence_statut_maj_idx'),
+            models.Index(fields=['agence_terrain', 'statut', '-updated_at', '-id'], name='ao_agterrain_statut_maj_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.synchroniser_etapes()
+        if not self._state.adding:
+            self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'etape_ca', 'etape_prod', 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+        self.synchroniser_phases()
+
+    def enregistrer_transition(self, champs, version=None):
+        """Écrit seulement ``champs`` (plus étapes, version et ``updated_at``) si la version n'a pas bougé.
+
+        ``version`` est celle sur laquelle le client s'est basé (par défaut celle
+        lue avec l'instance) : elle est vérifiée dans le WHERE de l'UPDATE, sans
+        verrou de ligne. Lève ``ModificationConcurrente`` si une autre écriture
+        est passée entre-temps.
+        """
+        version_lue = self.version if version is None else int(version)
+        self.synchroniser_etapes()
+        self.updated_at = timezone.now()
+        colonnes = [self._meta.get_field(champ).attname for champ in [*champs, 'etape_ca', 'etape_prod', 'updated_at']]
+        lignes = AppelOffre.objects.filter(pk=self.pk, version=version_lue).update(
+            version=version_lue + 1, **{colonne: getattr(self, colonne) for colonne in colonnes}
+        )
+        if not lignes:
+            raise ModificationConcurrente("Le projet a été modifié entre-temps : rechargez-le avant de recommencer")
+        self.version = version_lue + 1
+        if workflow.COLONNES_PHASES.intersection(champs):
+            self.synchroniser_phases()
+
+    def synchroniser_phases(self):
+        """Reporte les dates des phases dans ProjetPhase"""
+        ProjetPhase.synchroniser([self])
+
+    def synchroniser_etapes(self):
+        """Recalcule les étapes CA et PROD stockées à partir des champs du workflow"""
+        self.etape_ca = self.calculer_etape_ca()
+        self.etape_prod = self.calculer_etape_prod()
+
+    def calculer_etape_ca(self):
+        """Détermine l'étape actuelle du projet pour l'interface CA"""
+        return workflow.etape_ca(self)
+
+    def calculer_etape_prod(self):
+        """Détermine l'étape actuelle du projet pour l'interface PROD"""
+        return workflow.etape_prod(self)
 
     # Nouvelle méthode pour déterminer l'étape actuelle
     def get_etape_actuelle(self):
         """Retourne l'étape actuelle du projet pour l'affichage"""
-        if self.statut != 'gagne':
-            return 'Non gagné'
-
-        if not self.date_debut_terrain:
-            return 'AO Gagné'
-        elif self.date_debut_terrain and not self.date_fin_terrain_reelle:
-            return 'Terrain France'
-        elif self.date_fin_terrain_reelle and not self.date_debut_traitement:
-            return 'Terrain France terminé'
-        elif self.date_debut_traitement and not self.date_fin_traitement_reelle:
-            return 'Traitement France'
-        elif self.date_fin_traitement_reelle and not self.date_envoi_mada:
-            return 'Prêt pour envoi Mada'
-        elif self.date_envoi_mada and not self.date_debut_reprise:
-            return 'Envoi des données à Mada'
-        elif self.date_debut_reprise and not self.date_fin_reprise_reelle:
-            return 'Reprise des données France'
-        elif self.date_fin_reprise_reelle and not self.date_debut_prod_mada:
-            return 'Prêt pour production Mada'
-        elif self.date_debut_prod_mada and not self.date_fin_prod_mada_reelle:
-            return 'Prod en cours Mada'
-        elif self.date_fin_prod_mada_reelle:
-            return 'Production terminée'
-        else:
-            return 'En attente'
+        return self.get_etape_ca_display()
 
     # Méthode pour obtenir les responsables prod selon l'étape
     def get_responsable_prod_actuel(self):
         """Retourne le responsable prod actuel selon l'étape"""
-        etape = self.get_etape_actuelle()
-
-        if etape in ['AO Gagné', 'Terrain France', 'Terrain France terminé']:
+        if self.etape_ca in ['ao_gagne', 'terrain_france']:
             return self.responsable_prod_terrain
-        elif etape in ['Traitement France', 'Prêt pour envoi Mada']:
-            return self.responsable_prod_traitement or self.responsable_prod_terrain
-        else:
-            return self.responsable_prod_traitement or self.responsable_prod_terrain
+        return self.responsable_prod_traitement or self.responsable_prod_terrain
 
     # Méthode pour vérifier si le projet est en retard
     def est_en_retard(self):
         """Vérifie si le projet est en retard selon son étape actuelle"""
-        today = timezone.now().date()
-        etape = self.get_etape_actuelle()
-
-        if etape == 'Terrain France' and self.date_fin_prevue_terrain and self.date_fin_prevue_terrain < today:
-            return True
-        elif etape == 'Traitement France' and self.date_fin_prevue_traitement and self.date_fin_prevue_traitement < today:
-            return True
-        elif etape == 'Envoi des données à Mada' and self.date_livraison_prevue_mada and self.date_livraison_prevue_mada < today:
-            return True
-        elif etape == 'Reprise des données France' and self.date_fin_prevue_reprise and self.date_fin_prevue_reprise < today:
-            return True
-        elif etape == 'Prod en cours Mada' and self.date_fin_prevue_prod_mada and self.date_fin_prevue_prod_mada < today:
-            return True
-
-        return False
+        return self.get_jours_retard() > 0
 
     # Méthode pour calculer les jours de retard
     def get_jours_retard(self):
         """Retourne le nombre de jours de retard"""
-        if not self.est_en_retard():
+        if hasattr(self, 'jours_retard'):
+            # Déjà calculé en SQL par AppelOffreQuerySet.en_retard()
+            return self.jours_retard
+        champ_echeance = workflow.ECHEANCES_CA.get(self.calculer_etape_ca())
+        echeance = getattr(self, champ_echeance) if champ_echeance else None
+        if not echeance:
             return 0
+        return max((timezone.now().date() - echeance).days, 0)
+
+
+class AppelOffreEvent(models.Model):
+    """Événement du workflow d'un appel d'offre (historique en ajout seul)."""
+
+    TYPE_CHOICES = [
+        ('non_recu', 'Non reçu'),
+        ('avant_reenvoi', 'Avant ré-envoi'),
+    ]
+
+    projet = models.ForeignKey(AppelOffre, on_delete=models.CASCADE, related_name='evenements')
+    type = models.CharField(max_length=30, choices=TYPE_CHOICES)
+    auteur = models.ForeignKey('User', on_delete=models.SET_NULL, null=True, blank=True,
+                               related_name='evenements_appel_offre')
+    date = models.DateTimeField(default=timezone.now)
+    payload = models.JSONField(default=dict, blank=True)
+
+    def __str__(self):
+        return f"{self.projet} - {self.get_type_display()}"
+
+    class Meta:
+        verbose_name = "Événement d'appel d'offre"
+        verbose_name_plural = "Événements d'appel d'offre"
+        ordering = ['date', 'id']
+        indexes = [
+            models.Index(fields=['projet', 'date'], name='ao_event_projet_date_idx'),
+        ]
+
+
+class ProjetPhaseQuerySet(models.QuerySet):
+
+    def chevauchant(self, debut, fin):
+        """Phases dont la période chevauche ``[debut, fin]`` (lue dans l'index GiST)."""
+        return self.annotate(periode=PeriodePhase()).filter(periode__overlap=DateRange(debut, fin, '[]'))
+
+    def avec_terminee(self):
+        """Annote ``terminee`` : fin réelle saisie, ou projet arrivé au-delà de la phase (``Phase.terminee``)."""
+        terminee = Q(date_fin_reelle__isnull=False)
+        for phase in workflow.PHASES:
+            colonne, valeur = phase.terminee
+            terminee |= Q(phase=phase.code, **{f'projet__{colonne}': valeur})
+        return self.annotate(terminee=ExpressionWrapper(terminee, output_field=BooleanField()))
+
+    def en_retard(self, aujourd_hui=None):
+        """Phases non terminées de projets gagnés dont la fin prévue est dépassée.
+
+        Même règle que les barres en retard du Gantt ; annote ``jours_retard``.
+        """
+        aujourd_hui = aujourd_hui or timezone.localdate()
+        return self.avec_terminee().filter(
+            projet__statut='gagne', terminee=False, date_fin_prevue__lt=aujourd_hui
+        ).annotate(
+            jours_retard=JoursEcoules(Value(aujourd_hui, output_field=DateField()), F('date_fin_prevue')),
+        )
+
+
+class ProjetPhase(models.Model):
+    """Phase datée d'un projet, une ligne par phase renseignée.
+
+    Tenue à jour depuis les colonnes de dates d'AppelOffre (voir
+    ``workflow.PHASES``), qui restent la source lue par les écrans existants.
+    """
+    projet = models.ForeignKey(AppelOffre, on_delete=models.CASCADE, related_name='phases')
+    phase = models.CharField(max_length=20, choices=workflow.PHASE_CHOICES)
+    date_debut = models.DateField()
+    date_fin_prevue = models.DateField(null=True, blank=True)
+    date_fin_reelle = models.DateField(null=True, blank=True)
+    agence = models.ForeignKey(Agence, on_delete=models.SET_NULL, null=True, blank=True,
+                               related_name='phases_projet')
+    responsable = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                    related_name='phases_projet')
+
+    objects = ProjetPhaseQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.projet} - {self.get_phase_display()}"
+
+    @classmethod
+    def synchroniser(cls, projets):
+        """Upsert des phases renseignées des projets, suppression de celles qui ont été vidées"""
+        phases = [cls.depuis_projet(projet, phase) for projet in projets
+                  for phase in workflow.PHASES if getattr(projet, phase.debut)]
+        cls.objects.bulk_create(
+            phases, update_conflicts=True, unique_fields=['projet', 'phase'],
+            update_fields=['date_debut', 'date_fin_prevue', 'date_fin_reelle', 'agence', 'responsable'],
+        )
+        cls.objects.filter(projet__in=projets).exclude(pk__in=[phase.pk for phase in phases]).delete()
+
+    @classmethod
+    def depuis_projet(cls, projet, phase):
+        """Construit (sans l'enregistrer) la ligne d'une phase à partir des colonnes du projet"""
+        agence_id = getattr(projet, f'{phase.agence}_id') if phase.agence else None
+        responsable_id = getattr(projet, f'{phase.responsable}_id') if phase.responsable else None
+        return cls(
+            projet=projet,
+            phase=phase.code,
+            date_debut=getattr(projet, phase.debut),
+            date_fin_prevue=getattr(projet, phase.fin_prevue),
+            date_fin_reelle=getattr(projet, phase.fin_reelle),
+            agence_id=agence_id or projet.agence_id,
+            responsable_id=responsable_id,
+        )
+
+    class Meta:
+        verbose_name = "Phase de projet"
+        verbose_name_plural = "Phases de projet"
+        constraints = [
+            models.UniqueConstraint(fields=['projet', 'phase'], name='projet_phase_unique'),
+        ]
+        indexes = [
+            GistIndex(PeriodePhase(), name='projet_phase_periode_gist'),
+        ]
+
 
-        today = timezone.now().date()
-        etape = self.get_etape_actuelle()
-
-        if etape == 'Terrain France' and self.date_fin_prevue_terrain:
-            return (today - self.date_fin_prevue_terrain).days
-        elif etape == 'Traitement France' and self.date_fin_prevue_traitement:
-            return (today - self.date_fin_prevue_traitement).days
-        elif etape == 'Envoi des données à Mada' and self.date_livraison_prevue_mada:
-            return (today - self.date_livraison_prevue_mada).days
-        elif etape == 'Reprise des données France' and self.date_fin_prevue_reprise:
-            return (today - self.date_fin_prevue_reprise).days
-        elif etape == 'Prod en cours Mada' and self.date_fin_prevue_prod_mada:
-            return (today - self.date_fin_prevue_prod_mada).days
-
-        return 0
+# Fenêtre de synchronisation ?since= des tableaux : les traces plus anciennes sont purgées
+DUREE_CONSERVATION_SUPPRESSIONS = timedelta(days=30)
+
+
+class AppelOffreSuppression(models.Model):
+    """Trace d'un appel d'offre supprimé, pour la synchronisation incrémentale des tableaux."""
+    projet_id = models.BigIntegerField()
+    date_suppression = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"AO #{self.projet_id} supprimé le {self.date_suppression:%d/%m/%Y}"
+
+    @staticmethod
+    def limite_conservation():
+        return timezone.now() - DUREE_CONSERVATION_SUPPRESSIONS
+
+    @classmethod
+    def purger(cls, limite=None):
+        """Supprime les traces sorties de la fenêtre ``?since=`` ; retourne le nombre supprimé."""
+        supprimees, _ = cls.objects.filter(date_suppression__lt=limite or cls.limite_conservation()).delete()
+        return supprimees
+
+    class Meta:
+        verbose_name = "Appel d'offre supprimé"
+        verbose_name_plural = "Appels d'offre supprimés"
+
+
+class Tache(models.Model):
+    """Tâche de fond exécutée par ``manage.py run_workers`` (voir taches.py)."""
+
+    STATUT_CHOICES = [
+        ('en_attente', 'En attente'),
+        ('en_cours', 'En cours'),
+        ('terminee', 'Terminée'),
+        ('echouee', 'Échouée'),
+    ]
+
+    nom = models.CharField(max_length=100)
+    arguments = models.JSONField(default=dict, blank=True)
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='en_attente')
+    tentatives = models.PositiveSmallIntegerField(default=0)
+    max_tentatives = models.PositiveSmallIntegerField(default=3)
+    progression = models.PositiveSmallIntegerField(default=0)  # en %
+    message = models.CharField(max_length=255, blank=True)
+    resultat = models.JSONField(null=True, blank=True)
+    erreur = models.TextField(blank=True)
+    executer_apres = models.DateTimeField(default=timezone.now)
+    created_by = models.ForeignKey('User', on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='taches')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.nom} #{self.pk} ({self.get_statut_display()})"
+
+    class Meta:
+        verbose_name = "Tâche de fond"
+        verbose_name_plural = "Tâches de fond"
+        ordering = ['-created_at']
+        indexes = [
+            # Index partiel : la file ne parcourt que les tâches à exécuter
+            models.Index(fields=['executer_apres', 'id'], name='tache_file_idx',
+                         condition=models.Q(statut='en_attente')),
+        ]
+
+
+class CleIdempotence(models.Model):
+    """Clé ``Idempotency-Key`` d'une requête de création et réponse renvoyée (voir idempotence.py)."""
+    utilisateur = models.ForeignKey('User', on_delete=models.CASCADE, related_name='cles_idempotence')
+    cle = models.CharField(max_length=255)
+    chemin = models.CharField(max_length=255)
+    empreinte = models.CharField(max_length=64)  # SHA-256 du corps de la requête
+    statut_http = models.PositiveSmallIntegerField()
+    reponse = models.JSONField()
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.cle} ({self.chemin})"
+
+    class Meta:
+        verbose_name = "Clé d'idempotence"
+        verbose_name_plural = "Clés d'idempotence"
+        constraints = [
+            models.UniqueConstraint(fields=['utilisateur', 'cle'], name='cle_idempotence_unique'),
+        ]
 
 
 # ==================== PROXY MODELS POUR LES VUES SÉPARÉES ====================
@@ -0,0 +1,72 @@
+"""Récapitulatif quotidien des phases en retard, un e-mail par responsable.
+
+Les phases en retard sont lues en une requête (``ProjetPhase.en_retard``) puis
+regroupées par destinataire : le responsable de la phase (PROD terrain ou
+traitement, CA pour la phase AO) et le responsable CA du projet, qui suit
+toutes ses phases. Les e-mails partent ensuite sur une seule connexion SMTP.
+"""
+from collections import defaultdict
+
+from django.core.mail import EmailMessage, get_connection
+
+from . import workflow
+from .models import ProjetPhase
+
+
+def retards_par_destinataire(aujourd_hui=None):
+    """Retourne ``{email: {'prenoms': ..., 'retards': [...]}}``, retards triés du plus ancien."""
+    phases = ProjetPhase.objects.en_retard(aujourd_hui).order_by('-jours_retard', 'projet_id', 'phase').values(
+        'projet__reference', 'projet__nom_affaire', 'phase', 'date_fin_prevue', 'jours_retard',
+        'responsable__email', 'responsable__prenoms',
+        'projet__responsable_ca__email', 'projet__responsable_ca__prenoms',
+    )
+
+    libelles = dict(workflow.PHASE_CHOICES)
+    destinataires = defaultdict(lambda: {'prenoms': '', 'retards': []})
+    for ligne in phases:
+        retard = {
+            'reference': ligne['projet__reference'],
+            'nom_affaire': ligne['projet__nom_affaire'] or '',
+            'phase': libelles[ligne['phase']],
+            'date_fin_prevue': ligne['date_fin_prevue'],
+            'jours_retard': ligne['jours_retard'],
+        }
+        # Un même utilisateur peut être responsable de la phase et CA du projet : une seule ligne
+        for email, prenoms in {
+            ligne['responsable__email']: ligne['responsable__prenoms'],
+            ligne['projet__responsable_ca__email']: ligne['projet__responsable_ca__prenoms'],
+        }.items():
+            if email:
+                destinataires[email]['prenoms'] = prenoms
+                destinataires[email]['retards'].append(retard)
+    return dict(destinataires)
+
+
+def message_retards(email, prenoms, retards):
+    lignes = [
+        f"- {retard['reference']} {retard['nom_affaire']} : {retard['phase']}, "
+        f"fin prévue le {retard['date_fin_prevue']:%d/%m/%Y} ({retard['jours_retard']} jour(s) de retard)"
+        for retard in retards
+    ]
+    corps = "\n".join([
+        f"Bonjour {prenoms},",
+        "",
+        f"{len(retards)} phase(s) de vos projets ont dépassé leur date de fin prévue :",
+        "",
+        *lignes,
+        "",
+        "Ce récapitulatif est envoyé une fois par jour tant que les phases restent en retard.",
+    ])
+    return EmailMessage(f"[Agence Manager] {len(retards)} phase(s) en retard", corps, to=[email])
+
+
+def envoyer_recapitulatifs(aujourd_hui=None):
+    """Envoie un récapitulatif par destinataire ; retourne le nombre d'e-mails envoyés."""
+    messages = [
+        message_retards(email, destinataire['prenoms'], destinataire['retards'])
+        for email, destinataire in sorted(retards_par_destinataire(aujourd_hui).items())
+    ]
+    if not messages:
+        return 0
+    with get_connection() as connexion:
+        return connexion.send_messages(messages)
@@ -0,0 +1,57 @@
+"""Pagination par curseur (keyset) des tableaux CA/PROD.
+
+Les projets sont triés du plus récemment modifié au plus ancien sur
+``(updated_at, id)`` (l'historique d'un projet sur ``(date, id)``). Le curseur
+encode la dernière ligne renvoyée : la page suivante est lue directement dans
+l'index, quel que soit son rang.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+LIMITE_DEFAUT = 100
+LIMITE_MAX = 500
+
+
+class CurseurInvalide(ValueError):
+    """Curseur de pagination illisible ou falsifié."""
+
+
+def encoder_curseur(objet, champ='updated_at'):
+    brut = f"{getattr(objet, champ).isoformat()}|{objet.id}"
+    return base64.urlsafe_b64encode(brut.encode()).decode()
+
+
+def decoder_curseur(curseur):
+    try:
+        horodatage, identifiant = base64.urlsafe_b64decode(curseur.encode()).decode().split('|')
+        return datetime.fromisoformat(horodatage), int(identifiant)
+    except (ValueError, UnicodeDecodeError):
+        raise CurseurInvalide("Curseur de pagination invalide")
+
+
+def pagination_demandee(request):
+    return 'limit' in request.GET or 'cursor' in request.GET
+
+
+def paginer(queryset, request, champ='updated_at', limite_defaut=LIMITE_DEFAUT):
+    """Retourne ``(objets, curseur_suivant)`` pour la page demandée par ``?limit=&cursor=``.
+
+    Tri décroissant sur ``(champ, id)`` ; ``curseur_suivant`` vaut ``None`` sur la dernière page.
+    """
+    try:
+        limite = min(max(int(request.GET.get('limit', limite_defaut)), 1), LIMITE_MAX)
+    except ValueError:
+        raise CurseurInvalide("Paramètre limit invalide")
+
+    queryset = queryset.order_by(f'-{champ}', '-id')
+    curseur = request.GET.get('cursor')
+    if curseur:
+        valeur, identifiant = decoder_curseur(curseur)
+        queryset = queryset.filter(Q(**{f'{champ}__lt': valeur}) | Q(**{champ: valeur, 'id__lt': identifiant}))
+
+    objets = list(queryset[:limite + 1])
+    if len(objets) > limite:
+        return objets[:limite], encoder_curseur(objets[limite - 1], champ)
+    return objets, None
@@ -0,0 +1,59 @@
+"""Projection ``?fields=`` des endpoints JSON d'appels d'offre.
+
+Chaque endpoint décrit ses clés de sortie avec des ``Champ`` : colonnes à
+lire (chemins ORM, relations comprises), fonction de sérialisation et
+préchargements éventuels. Seules les colonnes et relations des clés demandées
+sont lues (``.only()`` / ``select_related``), les autres ne sont ni chargées
+ni sérialisées. Sans ``?fields=``, l'endpoint renvoie ses clés par défaut
+(toutes, sauf pour les listes qui laissent les textes longs au détail).
+"""
+from collections import namedtuple
+
+Champ = namedtuple('Champ', ['colonnes', 'valeur', 'prefetch'], defaults=[()])
+
+# Colonnes toujours lues : tri et curseur de pagination, synchronisation ?since=
+COLONNES_TOUJOURS = ('id', 'updated_at')
+
+
+class ChampsInvalides(ValueError):
+    """Paramètre ?fields= contenant des clés inconnues."""
+
+
+def iso(valeur):
+    return valeur.isoformat() if valeur else None
+
+
+def nom_complet(utilisateur, defaut=None):
+    return f"{utilisateur.prenoms} {utilisateur.nom}" if utilisateur else defaut
+
+
+def champs_demandes(request, champs, defaut=None):
+    """Clés demandées par ``?fields=a,b,c`` dans l'ordre de ``champs`` (``defaut``, ou toutes, si absent)."""
+    brut = request.GET.get('fields')
+    if not brut:
+        return list(defaut if defaut is not None else champs)
+    demandes = {cle.strip() for cle in brut.split(',') if cle.strip()}
+    inconnues = demandes - champs.keys()
+    if inconnues:
+        raise ChampsInvalides(f"Champs inconnus : {', '.join(sorted(inconnues))}")
+    return [cle for cle in champs if cle in demandes]
+
+
+def projeter(queryset, champs, cles):
+    """Restreint ``queryset`` aux colonnes, relations et préchargements des ``cles``."""
+    colonnes, prefetch = set(COLONNES_TOUJOURS), []
+    for cle in cles:
+        colonnes.update(champs[cle].colonnes)
+        prefetch.extend(p for p in champs[cle].prefetch if p not in prefetch)
+    relations = {colonne.rsplit('__', 1)[0] for colonne in colonnes if '__' in colonne}
+
+    queryset = queryset.select_related(None).prefetch_related(None)
+    if relations:
+        queryset = queryset.select_related(*relations)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset.only(*colonnes)
+
+
+def serialiser(objet, champs, cles):
+    return {cle: champs[cle].valeur(objet) for cle in cles}
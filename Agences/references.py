@@ -0,0 +1,160 @@
+"""Cache des données de référence (agences, postes, prestations, responsables).
+
+Chaque donnée est rangée sous une clé qui contient la version des tables dont
+elle dépend (``VersionTable``). Les signaux incrémentent ces versions : une
+modification rend aussitôt les anciennes clés inaccessibles, sans avoir à les
+supprimer.
+
+Lecture en deux niveaux :
+
+- un LRU local au processus, sans aucun aller-retour réseau ;
+- le cache Django partagé (``CACHES['default']``), pour les autres processus.
+
+Les numéros de version sont gardés dans le cache partagé (le cache en base de
+``settings.CACHES``, commun à tous les processus) et relus en base seulement
+s'ils en ont disparu. Chaque processus en garde une copie ``DUREE_VERSION_LOCALE``
+secondes : une lecture servie par le LRU ne fait alors aucune requête. Une
+modification est vue aussitôt par le processus qui l'a faite (``invalider``), et
+par les autres au plus tard après ``DUREE_VERSION_LOCALE``.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Agence, Poste, TypePrestation, User, VersionTable
+
+TAILLE_LRU = 256
+DUREE_DONNEES = 60 * 60
+# Borne la durée d'une version périmée si une invalidation croise une lecture
+DUREE_VERSION = 5 * 60
+# Copie locale des versions : délai maximal avant qu'un processus voie la modification d'un autre
+DUREE_VERSION_LOCALE = 5
+
+_lru = OrderedDict()
+_versions_locales = {}  # {nom: (version, expiration en secondes monotones)}
+_verrou = threading.Lock()
+
+
+def _cle_version(nom):
+    return f'references:version:{nom}'
+
+
+def versions(*noms):
+    """Retourne ``{nom: version}`` depuis la copie locale, puis le cache partagé, puis la base."""
+    maintenant = time.monotonic()
+    with _verrou:
+        resultat = {nom: _versions_locales[nom][0] for nom in noms
+                    if nom in _versions_locales and _versions_locales[nom][1] > maintenant}
+    a_lire = [nom for nom in noms if nom not in resultat]
+    if a_lire:
+        cles = {_cle_version(nom): nom for nom in a_lire}
+        lues = {cles[cle]: version for cle, version in cache.get_many(list(cles)).items()}
+        manquantes = [nom for nom in a_lire if nom not in lues]
+        if manquantes:
+            for nom, version in VersionTable.lire(*manquantes).items():
+                # add() : ne jamais écraser une version posée entre-temps par invalider()
+                cache.add(_cle_version(nom), version, DUREE_VERSION)
+                lues[nom] = version
+        with _verrou:
+            for nom, version in lues.items():
+                _versions_locales[nom] = (version, maintenant + DUREE_VERSION_LOCALE)
+        resultat.update(lues)
+    return {nom: resultat[nom] for nom in noms}
+
+
+def invalider(nom):
+    """À appeler après ``VersionTable.incrementer(nom)`` (voir signals.py)."""
+    with _verrou:
+        _versions_locales.pop(nom, None)
+    cache.delete(_cle_version(nom))
+    transaction.on_commit(
+        lambda: cache.set(_cle_version(nom), VersionTable.lire(nom)[nom], DUREE_VERSION)
+    )
+
+
+def lire(cle, tables, calculer):
+    """Retourne la donnée ``cle``, calculée par ``calculer()`` si aucun cache ne l'a pour
+    les versions actuelles de ``tables``. La valeur renvoyée est partagée : ne pas la modifier.
+    """
+    suffixe = '.'.join(str(version) for version in versions(*tables).values())
+    cle_complete = f'references:{cle}:{suffixe}'
+
+    with _verrou:
+        if cle_complete in _lru:
+            _lru.move_to_end(cle_complete)
+            return _lru[cle_complete]
+
+    valeur = cache.get(cle_complete)
+    if valeur is None:
+        valeur = calculer()
+        cache.set(cle_complete, valeur, DUREE_DONNEES)
+
+    with _verrou:
+        _lru[cle_complete] = valeur
+        while len(_lru) > TAILLE_LRU:
+            _lru.popitem(last=False)
+    return valeur
+
+
+def vider_lru():
+    with _verrou:
+        _lru.clear()
+        _versions_locales.clear()
+
+
+# ---------------------------------------------------------------------------
+# Données de référence
+# ---------------------------------------------------------------------------
+
+def couleurs_agences():
+    """``{nom d'agence: couleur}``"""
+    return lire('couleurs_agences', ['agence'], lambda: dict(Agence.objects.values_list('nom', 'couleur')))
+
+
+def listes_formulaire():
+    """Agences, postes et prestations des listes déroulantes des formulaires de profil"""
+    return lire('listes_formulaire', ['agence', 'poste', 'typeprestation'], lambda: {
+        'agences': list(Agence.objects.all()),
+        'postes': list(Poste.objects.all()),
+        'prestations': list(TypePrestation.objects.all()),
+    })
+
+
+def responsables_prod():
+    def calculer():
+        return [{
+            'id': responsable.id,
+            'prenoms': responsable.prenoms,
+            'nom': responsable.nom,
+            'pseudo': responsable.pseudo,
+            'agence': responsable.agence.nom if responsable.agence else 'Non assigné'
+        } for responsable in User.objects.filter(poste__nom='PROD').select_related('agence').order_by('id')]
+
+    return lire('responsables_prod', ['user', 'agence', 'poste'], calculer)
+
+
+def responsables_ca():
+    """Tous les responsables CA avec leur agence et leurs types de prestation"""
+    def calculer():
+        responsables = User.objects.filter(poste__nom='CA').select_related('agence', 'poste').prefetch_related(
+            'types_prestation'
+        ).order_by('id')
+        return [{
+            'id': responsable.id,
+            'prenoms': responsable.prenoms,
+            'nom': responsable.nom,
+            'pseudo': responsable.pseudo,
+            'agence': {
+                'id': responsable.agence.id if responsable.agence else None,
+                'nom': responsable.agence.nom if responsable.agence else 'Non assigné'
+            },
+            'poste': {
+                'nom': responsable.poste.get_nom_display() if responsable.poste else ''
+            },
+            'types_prestation': [{'id': p.id, 'nom': p.nom} for p in responsable.types_prestation.all()]
+        } for responsable in responsables]
+
+    return lire('responsables_ca', ['user', 'agence', 'poste', 'typeprestation'], calculer)
@@ -0,0 +1,40 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import references
+from .models import User, Agence, Poste, TypePrestation, AppelOffre, AppelOffreSuppression, VersionTable
+
+# Tables de référence versionnées (voir VersionTable) : modèle -> nom de version
+TABLES_VERSIONNEES = {
+    Agence: 'agence',
+    Poste: 'poste',
+    TypePrestation: 'typeprestation',
+    User: 'user',
+}
+
+
+@receiver(post_delete)
+def tracer_suppression_appel_offre(sender, instance, **kwargs):
+    """Garde une trace des AO supprimés (y compris via les proxys) pour le mode ?since= des tableaux"""
+    if isinstance(instance, AppelOffre):
+        AppelOffreSuppression.objects.create(projet_id=instance.pk)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def incrementer_version_table(sender, instance, update_fields=None, **kwargs):
+    nom = TABLES_VERSIONNEES.get(sender)
+    if nom is None:
+        return
+    # La connexion ne met à jour que last_login : rien d'affiché ne change
+    if sender is User and update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    VersionTable.incrementer(nom)
+    references.invalider(nom)
+
+
+@receiver(m2m_changed, sender=User.types_prestation.through)
+def incrementer_version_prestations_utilisateur(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        VersionTable.incrementer('user')
+        references.invalider('user')
@@ -0,0 +1,123 @@
+"""File de tâches de fond stockée en base (modèle ``Tache``).
+
+Les vues planifient une tâche avec ``planifier()`` et répondent tout de
+suite ; ``manage.py run_workers`` exécute la file. Chaque worker réserve la
+prochaine tâche avec ``SELECT ... FOR UPDATE SKIP LOCKED`` : plusieurs
+workers (threads ou processus) ne prennent jamais la même tâche et ne
+s'attendent pas entre eux. Une tâche qui lève une exception est relancée
+plus tard (délai doublé à chaque tentative) jusqu'à ``max_tentatives``.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from . import imports
+from .models import Tache
+
+logger = logging.getLogger(__name__)
+
+DELAI_RELANCE = timedelta(seconds=30)
+# Au-delà, une tâche « en cours » est considérée abandonnée (worker arrêté brutalement)
+DELAI_ABANDON = timedelta(hours=1)
+
+TACHES = {}
+
+
+def tache(nom):
+    """Enregistre une fonction ``f(tache, **arguments)`` sous ``nom``."""
+    def enregistrer(fonction):
+        TACHES[nom] = fonction
+        return fonction
+    return enregistrer
+
+
+def planifier(nom, utilisateur=None, max_tentatives=3, **arguments):
+    """Ajoute une tâche à la file ; ``arguments`` doit être sérialisable en JSON."""
+    if nom not in TACHES:
+        raise ValueError(f"Tâche inconnue : {nom}")
+    return Tache.objects.create(nom=nom, arguments=arguments, created_by=utilisateur,
+                                max_tentatives=max_tentatives)
+
+
+def progresser(tache, pourcentage, message=None):
+    """Enregistre l'avancement (0-100) d'une tâche en cours."""
+    tache.progression = pourcentage
+    champs = {'progression': pourcentage}
+    if message is not None:
+        tache.message = champs['message'] = message[:255]
+    Tache.objects.filter(pk=tache.pk).update(**champs)
+
+
+def reserver():
+    """Réserve la prochaine tâche à exécuter, ou retourne ``None`` si la file est vide."""
+    with transaction.atomic():
+        tache = Tache.objects.select_for_update(skip_locked=True).filter(
+            statut='en_attente', executer_apres__lte=timezone.now()
+        ).order_by('executer_apres', 'id').first()
+        if tache is None:
+            return None
+        tache.statut = 'en_cours'
+        tache.tentatives += 1
+        tache.started_at = timezone.now()
+        tache.save(update_fields=['statut', 'tentatives', 'started_at'])
+    return tache
+
+
+def executer(tache):
+    """Exécute une tâche réservée et enregistre son résultat, sa relance ou son échec."""
+    try:
+        resultat = TACHES[tache.nom](tache, **tache.arguments)
+    except Exception:
+        logger.exception("Échec de la tâche %s", tache)
+        tache.erreur = traceback.format_exc()
+        if tache.tentatives < tache.max_tentatives:
+            tache.statut = 'en_attente'
+            tache.executer_apres = timezone.now() + DELAI_RELANCE * 2 ** (tache.tentatives - 1)
+        else:
+            tache.statut = 'echouee'
+            tache.finished_at = timezone.now()
+        tache.save(update_fields=['statut', 'erreur', 'executer_apres', 'finished_at'])
+        return
+
+    tache.statut = 'terminee'
+    tache.progression = 100
+    tache.resultat = resultat
+    tache.erreur = ''
+    tache.finished_at = timezone.now()
+    tache.save(update_fields=['statut', 'progression', 'resultat', 'erreur', 'finished_at'])
+
+
+def executer_suivante():
+    """Réserve et exécute une tâche ; retourne ``False`` si la file était vide."""
+    tache = reserver()
+    if tache is None:
+        return False
+    executer(tache)
+    return True
+
+
+def reprendre_abandonnees():
+    """Remet en file les tâches restées « en cours » trop longtemps."""
+    return Tache.objects.filter(
+        statut='en_cours', started_at__lt=timezone.now() - DELAI_ABANDON
+    ).update(statut='en_attente', executer_apres=timezone.now())
+
+
+# ---------------------------------------------------------------------------
+# Tâches
+# ---------------------------------------------------------------------------
+
+@tache('import_utilisateurs')
+def importer_utilisateurs(tache, chemin):
+    """Import Excel des utilisateurs depuis un fichier déposé dans le stockage par défaut."""
+    with default_storage.open(chemin, 'rb') as fichier:
+        results = imports.importer_fichier(fichier, lambda pourcentage: progresser(tache, pourcentage))
+    default_storage.delete(chemin)
+    progresser(tache, 100, f"{results['created']} créé(s), {results['updated']} mis à jour, "
+                           f"{len(results['errors'])} erreur(s)")
+    return results
+
@@ -1,3 +1,1096 @@
-from django.test import TestCase
+import itertools
+import json
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import idempotence, imports, notifications, references, taches, views, workflow
+from .models import MOT_DE_PASSE_DEFAUT, User, Agence, Poste, TypePrestation, AppelOffre, AppelOffreSuppression, \
+    CleIdempotence, CompteurReference, ProjetPhase, Tache, VersionTable
+
+
+def creer_utilisateur(email='user@test.fr', **extra_fields):
+    return User.objects.create_user(email=email, prenoms='Test', pseudo=email.split('@')[0],
+                                    password='motdepasse', **extra_fields)
+
+
+def creer_appel_offre(reference, agence, utilisateur, **champs):
+    champs.setdefault('date_debut', date(2025, 1, 1))
+    champs.setdefault('date_fin', date(2025, 2, 1))
+    return AppelOffre.objects.create(
+        reference=reference,
+        agence=agence,
+        responsable_ca=utilisateur,
+        commercial=utilisateur,
+        **champs
+    )
+
+
+class WorkflowTests(TestCase):
+    """Le calcul Python et l'annotation SQL des étapes doivent toujours concorder."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test')
+        cls.utilisateur = creer_utilisateur()
+
+    def test_python_et_sql_concordent(self):
+        etapes = ['en_attente', 'en_cours', 'termine']
+        combinaisons = itertools.product(
+            ['gagne', 'en_cours'], etapes, etapes, etapes, etapes, [None, date(2025, 3, 1)], ['', 'Non reçu']
+        )
+        for i, (statut, terrain, envoi, reprise, prod, reception, commentaire) in enumerate(combinaisons):
+            creer_appel_offre(
+                f'AO-TEST-{i}', self.agence, self.utilisateur,
+                statut=statut,
+                etape_terrain_france=terrain,
+                etape_traitement_france='termine' if terrain == 'termine' else 'en_attente',
+                etape_envoi_mada=envoi,
+                etape_reprise_france=reprise,
+                etape_prod_mada=prod,
+                date_reception_france=reception,
+                commentaire_fin_reprise=commentaire,
+            )
+
+        for appel in AppelOffre.objects.avec_etapes():
+            self.assertEqual(appel.etape_ca_calculee, workflow.etape_ca(appel), appel.reference)
+            self.assertEqual(appel.etape_prod_calculee, workflow.etape_prod(appel), appel.reference)
+            self.assertEqual(appel.etape_ca, appel.etape_ca_calculee)
+            self.assertEqual(appel.etape_prod, appel.etape_prod_calculee)
+
+    def test_synchroniser_etapes_apres_update(self):
+        appel = creer_appel_offre('AO-TEST-SYNC', self.agence, self.utilisateur, statut='gagne')
+        AppelOffre.objects.filter(pk=appel.pk).update(etape_terrain_france='en_cours')
+        AppelOffre.objects.filter(pk=appel.pk).synchroniser_etapes()
+        appel.refresh_from_db()
+        self.assertEqual(appel.etape_ca, 'terrain_france')
+
+    def test_transition_refusee_hors_etape(self):
+        appel = creer_appel_offre('AO-TEST-TRANS', self.agence, self.utilisateur, statut='gagne')
+        workflow.verifier_transition('commencer_terrain_france', appel)
+        with self.assertRaises(workflow.TransitionInvalide):
+            workflow.verifier_transition('fin_traitement_france', appel)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Nécessite des écritures concurrentes (PostgreSQL)")
+class CompteurReferenceConcurrenceTests(TransactionTestCase):
+    """Des créations simultanées d'AO ne doivent jamais produire de référence en double."""
+
+    NB_CREATIONS = 200
+    NB_THREADS = 16
+
+    def setUp(self):
+        self.agence = Agence.objects.create(nom='Agence test')
+        self.commercial = creer_utilisateur('commercial@test.fr')
+
+    def _creer(self, _):
+        client = Client()
+        client.force_login(self.commercial)
+        try:
+            return client.post(
+                reverse('create_appel_offre'),
+                json.dumps({
+                    'agence_id': self.agence.id,
+                    'responsable_ca_id': self.commercial.id,
+                    'date_debut': '2025-01-01',
+                    'date_fin': '2025-02-01',
+                }),
+                content_type='application/json',
+            ).status_code
+        finally:
+            connections.close_all()
+
+    def test_creations_concurrentes_sans_doublon(self):
+        with ThreadPoolExecutor(max_workers=self.NB_THREADS) as executor:
+            statuts = list(executor.map(self._creer, range(self.NB_CREATIONS)))
+
+        self.assertEqual(statuts, [200] * self.NB_CREATIONS)
+        references = list(AppelOffre.objects.values_list('reference', flat=True))
+        self.assertEqual(len(references), self.NB_CREATIONS)
+        self.assertEqual(len(set(references)), self.NB_CREATIONS)
+        annee = date.today().year
+        self.assertEqual(CompteurReference.objects.get(annee=annee).dernier_numero, self.NB_CREATIONS)
+
+
+class RetardTests(TestCase):
+    """Les retards calculés en SQL doivent concorder avec le calcul par instance."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test')
+        cls.utilisateur = creer_utilisateur()
+
+    def test_en_retard_couvre_toutes_les_echeances(self):
+        aujourd_hui = date(2025, 6, 15)
+        cas = {
+            'AO-RET-TERRAIN': dict(etape_terrain_france='en_cours', date_fin_prevue_terrain=date(2025, 6, 10)),
+            'AO-RET-REPRISE': dict(etape_terrain_france='termine', etape_traitement_france='termine',
+                                   etape_envoi_mada='termine', date_reception_france=date(2025, 5, 1),
+                                   etape_reprise_france='en_cours', date_fin_prevue_reprise=date(2025, 6, 1)),
+            'AO-RET-PROD': dict(etape_terrain_france='termine', etape_traitement_france='termine',
+                                etape_envoi_mada='termine', date_reception_france=date(2025, 5, 1),
+                                etape_reprise_france='termine', etape_prod_mada='en_cours',
+                                date_fin_prevue_prod_mada=date(2025, 6, 14)),
+            'AO-RET-PROBLEME': dict(etape_terrain_france='termine', etape_traitement_france='termine',
+                                    etape_envoi_mada='en_cours', commentaire_fin_reprise='Archive illisible',
+                                    date_envoi_mada=date(2025, 6, 1), date_livraison_prevue_mada=date(2025, 6, 12)),
+            'AO-OK-TERRAIN': dict(etape_terrain_france='en_cours', date_fin_prevue_terrain=date(2025, 6, 15)),
+            'AO-OK-SANS-DATE': dict(etape_terrain_france='en_cours'),
+        }
+        for reference, champs in cas.items():
+            creer_appel_offre(reference, self.agence, self.utilisateur, statut='gagne', **champs)
+
+        retards = {a.reference: a.jours_retard for a in AppelOffre.objects.en_retard(aujourd_hui)}
+        self.assertEqual(retards, {'AO-RET-TERRAIN': 5, 'AO-RET-REPRISE': 14, 'AO-RET-PROD': 1,
+                                   'AO-RET-PROBLEME': 3})
+        self.assertEqual(AppelOffre.objects.get(reference='AO-RET-PROBLEME').etape_ca, 'probleme_reception')
+        # Les phases datées donnent le même retard pour l'envoi Mada
+        phase = ProjetPhase.objects.en_retard(aujourd_hui).get(projet__reference='AO-RET-PROBLEME', phase='envoi_mada')
+        self.assertEqual(phase.jours_retard, 3)
+
+
+class RecapitulatifRetardsTests(TestCase):
+    """Un seul e-mail par responsable, quel que soit le nombre de phases en retard."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test')
+        cls.ca = creer_utilisateur('ca@test.fr')
+        cls.prod = creer_utilisateur('prod@test.fr')
+        hier = date.today() - timedelta(days=1)
+        creer_appel_offre('AO-MAIL-1', cls.agence, cls.ca, statut='gagne', date_fin_reelle=date(2025, 2, 1),
+                          date_debut_terrain=date(2025, 3, 1), date_fin_prevue_terrain=hier,
+                          responsable_prod_terrain=cls.prod,
+                          date_debut_traitement=date(2025, 3, 1), date_fin_prevue_traitement=hier)
+        creer_appel_offre('AO-MAIL-2', cls.agence, cls.ca, statut='gagne', date_fin_reelle=date(2025, 2, 1),
+                          date_debut_reprise=date(2025, 3, 1), date_fin_prevue_reprise=hier - timedelta(days=9),
+                          responsable_prod_traitement=cls.prod)
+        creer_appel_offre('AO-MAIL-OK', cls.agence, cls.ca, statut='gagne', date_fin_reelle=date(2025, 2, 1),
+                          date_debut_terrain=date(2025, 3, 1), date_fin_prevue_terrain=hier,
+                          date_fin_terrain_reelle=hier, responsable_prod_terrain=cls.prod)
+        creer_appel_offre('AO-MAIL-PERDU', cls.agence, cls.ca, statut='perdu')
+
+    def test_regroupement_en_une_requete(self):
+        with self.assertNumQueries(1):
+            destinataires = notifications.retards_par_destinataire()
+
+        self.assertEqual(
+            {email: [(r['reference'], r['phase'], r['jours_retard']) for r in d['retards']]
+             for email, d in destinataires.items()},
+            {
+                'ca@test.fr': [('AO-MAIL-2', 'Reprise France', 10), ('AO-MAIL-1', 'Terrain France', 1),
+                               ('AO-MAIL-1', 'Traitement France', 1)],
+                'prod@test.fr': [('AO-MAIL-1', 'Terrain France', 1)],
+            },
+        )
+
+    def test_commande_envoie_un_recapitulatif_par_destinataire(self):
+        out = StringIO()
+        call_command('envoyer_retards', stdout=out)
+
+        self.assertIn('2 récapitulatif(s)', out.getvalue())
+        self.assertEqual([message.to for message in mail.outbox], [['ca@test.fr'], ['prod@test.fr']])
+        self.assertEqual(mail.outbox[0].subject, '[Agence Manager] 3 phase(s) en retard')
+        self.assertIn('AO-MAIL-2', mail.outbox[0].body)
+        self.assertNotIn('AO-MAIL-OK', mail.outbox[0].body)
+
+    def test_phases_terminees_par_etape(self):
+        # Ni la livraison Mada ni la fin de reprise n'ont de date réelle : c'est l'étape qui les clôt
+        avant_hier = date.today() - timedelta(days=2)
+        creer_appel_offre('AO-MAIL-RECU', self.agence, self.ca, statut='gagne', date_fin_reelle=date(2025, 2, 1),
+                          date_envoi_mada=date(2025, 3, 1), date_livraison_prevue_mada=avant_hier,
+                          etape_envoi_mada='termine', date_reception_france=avant_hier)
+        creer_appel_offre('AO-MAIL-REPRIS', self.agence, self.ca, statut='gagne', date_fin_reelle=date(2025, 2, 1),
+                          date_debut_reprise=date(2025, 3, 1), date_fin_prevue_reprise=avant_hier,
+                          etape_reprise_france='termine')
+
+        references = {retard['reference'] for destinataire in notifications.retards_par_destinataire().values()
+                      for retard in destinataire['retards']}
+        self.assertEqual(references, {'AO-MAIL-1', 'AO-MAIL-2'})
+
+    def test_ao_gagne_sans_fin_reelle_ni_complement(self):
+        # La phase AO s'achève avec le gain de l'AO, même sans date_fin_reelle (AO créé gagné, complément)
+        creer_appel_offre('AO-MAIL-SANS-FIN', self.agence, self.ca, statut='gagne',
+                          date_debut=date(2025, 1, 1), date_fin=date(2025, 2, 1))
+        parent = creer_appel_offre('AO-MAIL-PARENT', self.agence, self.ca, statut='gagne',
+                                   date_fin_reelle=date(2025, 2, 1), etape_terrain_france='termine',
+                                   etape_traitement_france='termine', etape_envoi_mada='termine',
+                                   date_reception_france=date(2025, 3, 1))
+        self.client.force_login(self.ca)
+        self.client.post(reverse('envoie_reprise', args=[parent.id]),
+                         json.dumps({'action': 'faire', 'commentaire': 'Manque des plans'}),
+                         content_type='application/json')
+        complement = AppelOffre.objects.get(parent=parent)
+        self.assertIsNone(complement.date_fin_reelle)
+
+        references = {retard['reference'] for destinataire in notifications.retards_par_destinataire().values()
+                      for retard in destinataire['retards']}
+        self.assertEqual(references, {'AO-MAIL-1', 'AO-MAIL-2'})
+
+
+class StatutsAppelsTests(TestCase):
+    """Le passage automatique en cours se fait en masse, hors du rendu des pages."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test')
+        cls.utilisateur = creer_utilisateur()
+
+    def test_commande_demarre_les_appels_echus(self):
+        echu = creer_appel_offre('AO-STAT-ECHU', self.agence, self.utilisateur, statut='en_attente')
+        futur = creer_appel_offre('AO-STAT-FUTUR', self.agence, self.utilisateur, statut='en_attente',
+                                  date_debut=date.today() + timedelta(days=1))
+        gagne = creer_appel_offre('AO-STAT-GAGNE', self.agence, self.utilisateur, statut='gagne')
+
+        call_command('update_statuts_appels', stdout=StringIO())
+
+        statuts = dict(AppelOffre.objects.values_list('pk', 'statut'))
+        self.assertEqual(statuts, {echu.pk: 'en_cours', futur.pk: 'en_attente', gagne.pk: 'gagne'})
+
+
+class AgencesViewTests(TestCase):
+    """La page des agences doit garder un nombre de requêtes constant."""
+
+    @classmethod
+    def setUpTestData(cls):
+        postes = [Poste.objects.create(nom=nom) for nom, _ in Poste.POSTE_CHOICES]
+        for i in range(4):
+            agence = Agence.objects.create(nom=f'Agence {i}')
+            for j, poste in enumerate(postes * 2):
+                creer_utilisateur(f'membre{i}-{j}@test.fr', agence=agence, poste=poste)
+        cls.utilisateur = creer_utilisateur('ca@test.fr', poste=postes[1])
+
+    def test_nombre_de_requetes_constant(self):
+        self.client.force_login(self.utilisateur)
+        # session, utilisateur (poste joint), agences, répartition, membres, total utilisateurs
+        with self.assertNumQueries(6):
+            reponse = self.client.get(reverse('agences'))
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(reponse.context['total_membres_meme_poste'], 8)
+        self.assertEqual(reponse.context['repartition_poste']['Agence 0'], {'Commercial': 2, 'CA': 2, 'Prod': 2})
+        self.assertEqual(len(reponse.context['agences'][0]['membres_meme_poste']), 2)
+
+    def test_poste_hors_choix(self):
+        creer_utilisateur('stagiaire@test.fr', agence=Agence.objects.get(nom='Agence 0'),
+                          poste=Poste.objects.create(nom='STAGIAIRE'))
+        self.client.force_login(self.utilisateur)
+        reponse = self.client.get(reverse('agences'))
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(reponse.context['repartition_poste']['Agence 0']['STAGIAIRE'], 1)
+
+
+class ProjetPhaseTests(TestCase):
+    """Les phases datées suivent les colonnes d'AppelOffre et se lisent par période."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test')
+        cls.agence_terrain = Agence.objects.create(nom='Agence terrain')
+        cls.utilisateur = creer_utilisateur()
+
+    def test_synchronisation_et_chevauchement(self):
+        appel = creer_appel_offre(
+            'AO-PHASE', self.agence, self.utilisateur, statut='gagne',
+            date_debut_terrain=date(2025, 3, 1), date_fin_prevue_terrain=date(2025, 3, 20),
+            agence_terrain=self.agence_terrain,
+            date_debut_reprise=date(2025, 5, 2), date_fin_prevue_reprise=date(2025, 5, 10),
+        )
+        phases = {p.phase: p for p in appel.phases.all()}
+        self.assertEqual(set(phases), {'ao', 'terrain', 'reprise'})
+        self.assertEqual(phases['terrain'].agence, self.agence_terrain)
+        self.assertEqual(phases['reprise'].agence, self.agence)
+
+        appel.date_fin_terrain_reelle = date(2025, 4, 5)
+        appel.date_debut_reprise = None
+        appel.save()
+        self.assertEqual(list(appel.phases.exclude(phase='ao').values_list('phase', 'date_fin_reelle')),
+                         [('terrain', date(2025, 4, 5))])
+
+        avril = ProjetPhase.objects.chevauchant(date(2025, 4, 1), date(2025, 4, 30))
+        self.assertEqual(list(avril.values_list('phase', flat=True)), ['terrain'])
+        self.assertFalse(ProjetPhase.objects.chevauchant(date(2025, 4, 6), date(2025, 4, 30)).exists())
+
+
+class VersionTransitionsTests(TestCase):
+    """Les actions n'écrivent que leurs colonnes, et refusent (409) un projet modifié entre-temps."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test')
+        cls.utilisateur = creer_utilisateur()
+
+    def setUp(self):
+        self.client.force_login(self.utilisateur)
+        self.appel = creer_appel_offre('AO-VERSION', self.agence, self.utilisateur, statut='gagne',
+                                       etape_terrain_france='termine', etape_traitement_france='termine',
+                                       etape_envoi_mada='en_cours', description='long texte')
+
+    def test_update_limite_aux_colonnes_de_l_action(self):
+        with CaptureQueriesContext(connection) as requetes:
+            reponse = self.client.post(reverse('reception_donnees', args=[self.appel.id]),
+                                       json.dumps({'statut': 'ok', 'version': self.appel.version}),
+                                       content_type='application/json')
+        self.assertEqual(reponse.status_code, 200)
+        update, = [r['sql'] for r in requetes if r['sql'].startswith('UPDATE "Agences_appeloffre"')]
+        self.assertIn('"version" = 0', update.split('WHERE')[1])
+        self.assertNotIn('description', update)
+
+        self.appel.refresh_from_db()
+        self.assertEqual((self.appel.version, self.appel.etape_prod), (1, 'envoi_reprise'))
+
+    def test_version_perimee_refusee(self):
+        version_lue = self.appel.version
+        self.appel.description = 'modifié ailleurs'
+        self.appel.save()
+
+        reponse = self.client.post(reverse('reception_donnees', args=[self.appel.id]),
+                                   json.dumps({'statut': 'non', 'commentaire': 'Vide', 'version': version_lue}),
+                                   content_type='application/json')
+        self.assertEqual(reponse.status_code, 409)
+        self.appel.refresh_from_db()
+        self.assertEqual(self.appel.etape_ca, 'envoi_mada')
+        # L'événement d'historique est annulé avec la transition
+        self.assertFalse(self.appel.evenements.exists())
+
+        reponse = self.client.post(reverse('appliquer_transitions'), json.dumps([{
+            'projet_id': self.appel.id, 'action': 'reception_donnees', 'payload': {'statut': 'ok'},
+            'version': version_lue,
+        }]), content_type='application/json')
+        self.assertTrue(reponse.json()['resultats'][0]['conflit'])
+
+    def test_actions_admin_avancent_la_version(self):
+        admin = User.objects.create_superuser(email='admin@test.fr', prenoms='Admin', pseudo='admin',
+                                              password='motdepasse')
+        self.client.force_login(admin)
+        version_lue = self.appel.version
+        self.client.post(reverse('admin:Agences_appeloffre_changelist'),
+                         {'action': 'marquer_comme_gagne', '_selected_action': [self.appel.id]})
+        self.appel.refresh_from_db()
+        self.assertEqual(self.appel.version, version_lue + 1)
+
+        self.client.force_login(self.utilisateur)
+        reponse = self.client.post(reverse('reception_donnees', args=[self.appel.id]),
+                                   json.dumps({'statut': 'ok', 'version': version_lue}),
+                                   content_type='application/json')
+        self.assertEqual(reponse.status_code, 409)
+
+
+class IdempotenceTests(TestCase):
+    """Une requête renvoyée avec la même Idempotency-Key rejoue la réponse sans recréer de ligne."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test')
+        cls.utilisateur = creer_utilisateur()
+
+    def setUp(self):
+        self.client.force_login(self.utilisateur)
+
+    def creer(self, cle, **donnees):
+        donnees = {'agence_id': self.agence.id, 'responsable_ca_id': self.utilisateur.id,
+                   'date_debut': '2025-01-01', 'date_fin': '2025-02-01', **donnees}
+        return self.client.post(reverse('create_appel_offre'), json.dumps(donnees),
+                                content_type='application/json', headers={'Idempotency-Key': cle})
+
+    def test_rejeu_de_la_creation(self):
+        premiere, seconde = self.creer('cle-1'), self.creer('cle-1')
+        self.assertEqual(seconde.status_code, 200)
+        self.assertEqual(seconde.json(), premiere.json())
+        self.assertEqual(seconde['Idempotent-Replayed'], 'true')
+        self.assertEqual(AppelOffre.objects.count(), 1)
+
+        self.assertEqual(self.creer('cle-1', description='autre').status_code, 422)
+        self.assertEqual(self.creer('cle-2').status_code, 200)
+        self.assertEqual(AppelOffre.objects.count(), 2)
+
+    def test_erreur_non_conservee_et_purge(self):
+        self.assertEqual(self.creer('cle-1', date_fin='2024-01-01').status_code, 400)
+        self.assertEqual(self.creer('cle-1').status_code, 200)
+        self.assertEqual(AppelOffre.objects.count(), 1)
+
+        CleIdempotence.objects.update(created_at=timezone.now() - idempotence.DUREE_CONSERVATION - timedelta(minutes=1))
+        call_command('purger_idempotence', stdout=StringIO())
+        self.assertFalse(CleIdempotence.objects.exists())
+
+    def test_rejeu_de_la_reprise_avec_complement(self):
+        projet = creer_appel_offre('AO-REPRISE', self.agence, self.utilisateur, statut='gagne',
+                                   etape_terrain_france='termine', etape_traitement_france='termine',
+                                   etape_envoi_mada='termine', date_reception_france=date(2025, 3, 1))
+        url = reverse('envoie_reprise', args=[projet.id])
+        corps = json.dumps({'action': 'faire', 'commentaire': 'Manque des plans'})
+        reponses = [self.client.post(url, corps, content_type='application/json', headers={'Idempotency-Key': 'r-1'})
+                    for _ in range(2)]
+        self.assertEqual(reponses[0].json(), reponses[1].json())
+        self.assertEqual(AppelOffre.objects.filter(reference__endswith=' - Complément').count(), 1)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Nécessite des écritures concurrentes (PostgreSQL)")
+class IdempotenceConcurrenceTests(TransactionTestCase):
+    """Des envois simultanés avec la même clé ne créent qu'un seul appel d'offre."""
+
+    NB_ENVOIS = 8
+
+    def setUp(self):
+        self.agence = Agence.objects.create(nom='Agence test')
+        self.commercial = creer_utilisateur('commercial@test.fr')
+
+    def _creer(self, _):
+        client = Client()
+        client.force_login(self.commercial)
+        try:
+            return client.post(
+                reverse('create_appel_offre'),
+                json.dumps({'agence_id': self.agence.id, 'responsable_ca_id': self.commercial.id,
+                            'date_debut': '2025-01-01', 'date_fin': '2025-02-01'}),
+                content_type='application/json', headers={'Idempotency-Key': 'double-clic'},
+            ).json()
+        finally:
+            connections.close_all()
+
+    def test_envois_simultanes(self):
+        with ThreadPoolExecutor(max_workers=self.NB_ENVOIS) as executor:
+            reponses = list(executor.map(self._creer, range(self.NB_ENVOIS)))
+
+        self.assertEqual(AppelOffre.objects.count(), 1)
+        self.assertEqual({reponse['appel_offre']['id'] for reponse in reponses}, {AppelOffre.objects.get().id})
+
+    def _envoyer_en_parallele(self, url, donnees):
+        def envoyer(_):
+            client = Client()
+            client.force_login(self.commercial)
+            try:
+                reponse = client.post(url, json.dumps(donnees), content_type='application/json',
+                                      headers={'Idempotency-Key': 'reprise-1'})
+                return reponse.status_code, reponse.json()
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.NB_ENVOIS) as executor:
+            return list(executor.map(envoyer, range(self.NB_ENVOIS)))
+
+    def _projet_livre(self):
+        return creer_appel_offre('AO-REPRISE', self.agence, self.commercial, statut='gagne',
+                                 etape_terrain_france='termine', etape_traitement_france='termine',
+                                 etape_envoi_mada='termine', date_reception_france=date(2025, 3, 1))
+
+    def test_reprise_avec_complement_simultanee(self):
+        projet = self._projet_livre()
+        reponses = self._envoyer_en_parallele(reverse('envoie_reprise', args=[projet.id]),
+                                              {'action': 'faire', 'commentaire': 'Manque des plans'})
+
+        complement = AppelOffre.objects.get(parent=projet)
+        self.assertEqual({(statut, corps.get('complement_id')) for statut, corps in reponses}, {(200, complement.id)})
+        projet.refresh_from_db()
+        self.assertEqual(projet.version, 1)
+
+    def test_transition_simultanee(self):
+        projet = self._projet_livre()
+        reponses = self._envoyer_en_parallele(reverse('envoie_reprise', args=[projet.id]), {'action': 'pas'})
+
+        # Aucun 400 « transition impossible » ni 409 : toutes rejouent la première exécution
+        self.assertEqual({(statut, corps.get('success')) for statut, corps in reponses}, {(200, True)})
+        projet.refresh_from_db()
+        self.assertEqual((projet.etape_prod_mada, projet.version), ('en_attente', 1))
+
+
+class ComplementTests(TestCase):
+    """Un complément est relié à son projet d'origine par ``parent``, pas par sa référence."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test')
+        cls.utilisateur = creer_utilisateur()
+
+    def setUp(self):
+        self.client.force_login(self.utilisateur)
+
+    def test_reprise_puis_envoi_du_complement(self):
+        projet = creer_appel_offre('AO-ORIGINE', self.agence, self.utilisateur, statut='gagne',
+                                   etape_terrain_france='termine', etape_traitement_france='termine',
+                                   etape_envoi_mada='termine', date_reception_france=date(2025, 3, 1))
+        reponse = self.client.post(reverse('envoie_reprise', args=[projet.id]),
+                                   json.dumps({'action': 'faire', 'commentaire': 'Manque des plans'}),
+                                   content_type='application/json')
+        complement = AppelOffre.objects.get(pk=reponse.json()['complement_id'])
+        self.assertEqual((complement.parent, complement.is_complement), (projet, True))
+
+        # Le lien ne dépend plus de la référence
+        AppelOffre.objects.filter(pk=complement.pk).update(reference='AO-RENOMMEE')
+        reponse = self.client.post(reverse('gestion_complement', args=[complement.id]), json.dumps({
+            'action': 'envoyer', 'date_envoi': '2025-04-01', 'date_livraison': '2025-04-10',
+        }), content_type='application/json')
+        self.assertEqual(reponse.status_code, 200)
+        projet.refresh_from_db()
+        self.assertEqual(projet.version, 2)
+
+    def test_etape_complement_par_drapeau(self):
+        complement = creer_appel_offre('AO-X', self.agence, self.utilisateur, statut='gagne', is_complement=True)
+        homonyme = creer_appel_offre('AO-Y - Complément', self.agence, self.utilisateur, statut='gagne')
+        self.assertEqual((complement.etape_prod, homonyme.etape_prod), ('complement', 'non_pret'))
+
+
+class TransitionsLotTests(TestCase):
+    """/api/transitions/ : un lot d'actions validé élément par élément, écrit en UPDATE groupés."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test')
+        cls.utilisateur = creer_utilisateur()
+
+    def setUp(self):
+        self.client.force_login(self.utilisateur)
+
+    def envoyer(self, elements):
+        return self.client.post(reverse('appliquer_transitions'), json.dumps(elements),
+                                content_type='application/json')
+
+    def test_lot_groupe_et_resultats_par_element(self):
+        en_prod = [creer_appel_offre(f'AO-LOT-{i}', self.agence, self.utilisateur, statut='gagne',
+                                     etape_reprise_france='termine', etape_prod_mada='en_cours')
+                   for i in range(3)]
+        terrain = creer_appel_offre('AO-LOT-T', self.agence, self.utilisateur, statut='gagne')
+        fin_prod = {'date_fin_reelle_prod': '2025-06-30'}
+        elements = [{'projet_id': appel.id, 'action': 'fin_prod_mada', 'payload': fin_prod} for appel in en_prod] + [
+            {'projet_id': terrain.id, 'action': 'commencer_terrain_france', 'payload': {
+                'nom_affaire': 'Affaire', 'date_debut': '2025-03-01', 'date_fin_prevue': '2025-03-20',
+                'agence_id': self.agence.id, 'responsable_prod_id': self.utilisateur.id}},
+            {'projet_id': terrain.id, 'action': 'fin_prod_mada', 'payload': fin_prod},
+            {'projet_id': en_prod[0].id + 1000, 'action': 'fin_prod_mada', 'payload': fin_prod},
+            {'projet_id': en_prod[0].id, 'action': 'inexistante'},
+        ]
+
+        with CaptureQueriesContext(connection) as requetes:
+            reponse = self.envoyer(elements)
+        donnees = reponse.json()
+        self.assertEqual(donnees['appliquees'], 4)
+        self.assertEqual([r['success'] for r in donnees['resultats']], [True] * 4 + [False] * 3)
+        self.assertIn('plusieurs fois', donnees['resultats'][4]['error'])
+        self.assertEqual(donnees['resultats'][5]['error'], 'Projet non trouvé')
+        # Les trois fins de prod identiques partent dans la même requête UPDATE
+        updates = [r['sql'] for r in requetes if r['sql'].startswith('UPDATE "Agences_appeloffre" SET "date_fin_prod')]
+        self.assertEqual(len(updates), 1)
+
+        for appel in en_prod:
+            appel.refresh_from_db()
+            self.assertEqual((appel.etape_prod, appel.date_fin_prod_mada_reelle),
+                             ('production_terminee', date(2025, 6, 30)))
+        terrain.refresh_from_db()
+        self.assertEqual(terrain.etape_ca, 'terrain_france')
+        # Une seule version de plus, étape comprise, renvoyée au client
+        self.assertEqual(terrain.version, 1)
+        self.assertEqual([r.get('version') for r in donnees['resultats'][:4]], [1, 1, 1, 1])
+        self.assertTrue(terrain.phases.filter(phase='terrain', date_fin_prevue=date(2025, 3, 20)).exists())
+
+    def test_element_invalide_sans_effet(self):
+        appel = creer_appel_offre('AO-LOT-R', self.agence, self.utilisateur, statut='gagne',
+                                  etape_terrain_france='termine', etape_traitement_france='termine',
+                                  etape_envoi_mada='en_cours')
+        reponse = self.envoyer([
+            {'projet_id': appel.id, 'action': 'reception_donnees', 'payload': {'statut': 'non'}},
+        ])
+        self.assertIn('Commentaire obligatoire', reponse.json()['resultats'][0]['error'])
+
+        reponse = self.envoyer([
+            {'projet_id': appel.id, 'action': 'reception_donnees', 'payload': {'statut': 'non', 'commentaire': 'Vide'}},
+        ])
+        self.assertTrue(reponse.json()['resultats'][0]['success'])
+        appel.refresh_from_db()
+        self.assertEqual(appel.etape_ca, 'probleme_reception')
+        self.assertEqual(appel.evenements.get().auteur, self.utilisateur)
+
+        self.assertEqual(self.envoyer({'projet_id': appel.id}).status_code, 400)
+
+    def test_payloads_invalides_melanges_a_des_elements_valides(self):
+        appels = [creer_appel_offre(f'AO-LOT-V{i}', self.agence, self.utilisateur, statut='gagne') for i in range(5)]
+        valide = {'nom_affaire': 'Affaire', 'date_debut': '2025-03-01', 'date_fin_prevue': '2025-03-20',
+                  'agence_id': self.agence.id, 'responsable_prod_id': self.utilisateur.id}
+        reponse = self.envoyer([
+            {'projet_id': appels[0].id, 'action': 'commencer_terrain_france', 'payload': valide},
+            {'projet_id': appels[1].id, 'action': 'commencer_terrain_france',
+             'payload': {**valide, 'agence_id': self.agence.id + 1000}},
+            {'projet_id': appels[2].id, 'action': 'commencer_terrain_france', 'payload': {**valide, 'agence_id': [1]}},
+            {'projet_id': appels[3].id, 'action': 'commencer_terrain_france', 'payload': {**valide, 'nom_affaire': {}}},
+            {'projet_id': appels[4].id, 'action': 'commencer_terrain_france',
+             'payload': {**valide, 'agence_id': str(self.agence.id)}, 'version': str(appels[4].version)},
+        ])
+
+        resultats = reponse.json()['resultats']
+        self.assertEqual([r['success'] for r in resultats], [True, False, False, False, True])
+        self.assertEqual(resultats[1]['error'], f'Agence introuvable : {self.agence.id + 1000}')
+        self.assertIn('agence_id', resultats[2]['error'])
+        self.assertIn('nom_affaire', resultats[3]['error'])
+        self.assertEqual(set(AppelOffre.objects.filter(etape_ca='terrain_france').values_list('id', flat=True)),
+                         {appels[0].id, appels[4].id})
+
+        reponse = self.envoyer([{'projet_id': appels[0].id, 'action': 'fin_terrain_france',
+                                 'payload': {'commentaire': ['liste']}}])
+        self.assertIn('commentaire', reponse.json()['resultats'][0]['error'])
+
+
+class ChampsProjectionTests(TestCase):
+    """?fields= : seules les clés demandées sont renvoyées, et seules leurs colonnes lues."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test')
+        cls.utilisateur = creer_utilisateur()
+        creer_appel_offre('AO-CHAMPS', cls.agence, cls.utilisateur, statut='gagne', description='long texte')
+
+    def setUp(self):
+        self.client.force_login(self.utilisateur)
+
+    def test_projection_des_tableaux(self):
+        for nom_url in ['get_projets_ca', 'get_projets_prod', 'get_appels_offre_json']:
+            with self.subTest(nom_url), CaptureQueriesContext(connection) as requetes:
+                reponse = self.client.get(reverse(nom_url), {'fields': 'reference,agence,id'})
+            cle = 'appels_offre' if nom_url == 'get_appels_offre_json' else 'projets'
+            self.assertEqual(reponse.json()[cle], [{'id': AppelOffre.objects.get().id, 'reference': 'AO-CHAMPS',
+                                                    'agence': 'Agence test'}])
+            # Lecture des projets, plus d'éventuels préchargements (prestations, événements)
+            lectures = [requete['sql'] for requete in requetes
+                        if requete['sql'].startswith(('SELECT "Agences_appeloffre"."id"', 'SELECT "Agences_appeloffreevent"'))
+                        or '_prefetch_related_val' in requete['sql']]
+            self.assertEqual(len(lectures), 1, lectures)
+            self.assertNotIn('description', lectures[0])
+
+    def test_liste_sans_textes_longs(self):
+        projet = self.client.get(reverse('get_projets_ca')).json()['projets'][0]
+        self.assertEqual(list(projet), views.CLES_LISTE_CA)
+        self.assertNotIn('description', projet)
+
+        projet = self.client.get(reverse('get_projets_ca'), {'fields': 'id,description'}).json()['projets'][0]
+        self.assertEqual(projet['description'], 'long texte')
+
+    def test_detail_et_historique(self):
+        appel = AppelOffre.objects.get()
+        for numero in range(5):
+            appel.evenements.create(type='non_recu', payload={'commentaire': f'commentaire {numero}'})
+
+        projet = self.client.get(reverse('get_projet_ca', args=[appel.id])).json()['projet']
+        self.assertEqual(projet['description'], 'long texte')
+        self.assertNotIn('historique_commentaires', projet)
+
+        url = reverse('get_projet_historique', args=[appel.id])
+        page = self.client.get(url, {'limit': 3}).json()
+        self.assertEqual([e['commentaire'] for e in page['historique']],
+                         ['commentaire 4', 'commentaire 3', 'commentaire 2'])
+        page = self.client.get(url, {'limit': 3, 'cursor': page['next_cursor']}).json()
+        self.assertEqual([e['commentaire'] for e in page['historique']], ['commentaire 1', 'commentaire 0'])
+        self.assertIsNone(page['next_cursor'])
+
+        self.assertEqual(self.client.get(reverse('get_projet_ca', args=[appel.id + 1])).status_code, 404)
+
+    def test_champ_inconnu(self):
+        reponse = self.client.get(reverse('get_projets_ca'), {'fields': 'reference,inexistant'})
+        self.assertEqual(reponse.status_code, 400)
+        self.assertIn('inexistant', reponse.json()['error'])
+
+    def test_parametres_invalides_et_erreur_serveur(self):
+        for nom_url in ['get_projets_ca', 'get_projets_prod']:
+            with self.subTest(nom_url):
+                for parametres in [{'cursor': 'invalide'}, {'du': '2025-13-01'}, {'agence': 'x'}]:
+                    self.assertEqual(self.client.get(reverse(nom_url), parametres).status_code, 400)
+
+                client = Client(raise_request_exception=False)
+                client.force_login(self.utilisateur)
+                with mock.patch.object(views, 'donnees_tableau', side_effect=RuntimeError('panne')):
+                    self.assertEqual(client.get(reverse(nom_url)).status_code, 500)
+
+
+class SynchronisationTableauxTests(TestCase):
+    """?since= : delta avec les projets supprimés, refusé au-delà de la durée de conservation des traces."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test')
+        cls.utilisateur = creer_utilisateur()
+
+    def setUp(self):
+        self.client.force_login(self.utilisateur)
+
+    def test_suppressions_et_purge(self):
+        since = self.client.get(reverse('get_projets_ca')).json()['since']
+        projet = creer_appel_offre('AO-SUPPR', self.agence, self.utilisateur, statut='gagne')
+        AppelOffre.objects.filter(pk=projet.pk).update(updated_at=timezone.now() - timedelta(minutes=1))
+        projet_id = projet.id
+        projet.delete()
+        self.assertEqual(self.client.get(reverse('get_projets_ca'), {'since': since}).json()['supprimes'], [projet_id])
+
+        ancien = (AppelOffreSuppression.limite_conservation() - timedelta(minutes=1)).isoformat()
+        self.assertEqual(self.client.get(reverse('get_projets_ca'), {'since': ancien}).status_code, 400)
+
+        AppelOffreSuppression.objects.update(date_suppression=ancien)
+        call_command('purger_suppressions', stdout=StringIO())
+        self.assertFalse(AppelOffreSuppression.objects.exists())
+
+
+class GanttTests(TestCase):
+    """Le Gantt ne renvoie que les projets de la fenêtre, barres coupées à la fenêtre."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test', couleur='#123456')
+        cls.autre_agence = Agence.objects.create(nom='Autre agence')
+        cls.utilisateur = creer_utilisateur()
+        cls.appel = creer_appel_offre(
+            'AO-GANTT', cls.agence, cls.utilisateur, statut='gagne',
+            etape_terrain_france='en_cours',
+            date_debut_terrain=date(2025, 1, 20), date_fin_prevue_terrain=date(2025, 2, 10),
+        )
+        creer_appel_offre('AO-GANTT-AUTRE', cls.autre_agence, cls.utilisateur, statut='gagne')
+        creer_appel_offre('AO-GANTT-HORS', cls.agence, cls.utilisateur, statut='gagne',
+                          date_debut=date(2025, 6, 1), date_fin=date(2025, 7, 1))
+
+    def test_barres_de_la_fenetre(self):
+        self.client.force_login(self.utilisateur)
+        reponse = self.client.get(reverse('get_gantt'),
+                                  {'start': '2025-02-01', 'end': '2025-02-28', 'agence': self.agence.id})
+        projets = reponse.json()['projets']
+        self.assertEqual([projet['reference'] for projet in projets], ['AO-GANTT'])
+        barres = {barre['phase']: barre for barre in projets[0]['barres']}
+        self.assertEqual(barres['ao']['debut'], 0)
+        self.assertEqual(barres['ao']['duree'], 1)
+        self.assertEqual((barres['terrain']['debut'], barres['terrain']['duree']), (0, 10))
+        self.assertTrue(barres['terrain']['en_retard'])
+        self.assertEqual(barres['terrain']['couleur'], '#123456')
+
+    def test_projet_termine_sans_retard(self):
+        # Livraison et reprise sans date réelle saisie : l'étape du projet dit qu'elles sont finies
+        termine = creer_appel_offre(
+            'AO-GANTT-FINI', self.agence, self.utilisateur, statut='gagne', date_fin_reelle=date(2025, 2, 1),
+            etape_terrain_france='termine', etape_traitement_france='termine', etape_envoi_mada='termine',
+            etape_reprise_france='termine', etape_prod_mada='termine',
+            date_envoi_mada=date(2025, 2, 1), date_livraison_prevue_mada=date(2025, 2, 5),
+            date_reception_france=date(2025, 2, 7),
+            date_debut_reprise=date(2025, 2, 8), date_fin_prevue_reprise=date(2025, 2, 10),
+            date_debut_prod_mada=date(2025, 2, 11), date_fin_prevue_prod_mada=date(2025, 2, 20),
+            date_fin_prod_mada_reelle=date(2025, 2, 19),
+        )
+        self.assertEqual(termine.etape_ca, 'production_terminee')
+
+        self.client.force_login(self.utilisateur)
+        projets = self.client.get(reverse('get_gantt'), {'start': '2025-02-01', 'end': '2025-02-28'}).json()['projets']
+        barres = next(projet['barres'] for projet in projets if projet['reference'] == 'AO-GANTT-FINI')
+        self.assertEqual({barre['phase']: barre['en_retard'] for barre in barres},
+                         {'ao': False, 'envoi_mada': False, 'reprise': False, 'prod_mada': False})
+
+    def test_fenetre_invalide(self):
+        self.client.force_login(self.utilisateur)
+        self.assertEqual(self.client.get(reverse('get_gantt'), {'start': '2025-02-01'}).status_code, 400)
+
+
+class CalendrierTests(TestCase):
+    """Le calendrier CA renvoie les événements du mois, plafonnés par jour."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test')
+        cls.utilisateur = creer_utilisateur()
+        for i in range(5):
+            creer_appel_offre(f'AO-CAL-{i}', cls.agence, cls.utilisateur, statut='gagne',
+                              date_debut=date(2025, 3, 3), date_fin=date(2025, 4, 10))
+        creer_appel_offre('AO-CAL-RECU', cls.agence, cls.utilisateur, statut='gagne',
+                          date_debut=date(2025, 2, 1), date_fin=date(2025, 2, 20),
+                          date_reception_france=date(2025, 3, 12))
+
+    def test_evenements_plafonnes_par_jour(self):
+        self.client.force_login(self.utilisateur)
+        reponse = self.client.get(reverse('get_calendrier_ca'), {'mois': '2025-03', 'limite': 2})
+        jours = reponse.json()['jours']
+        self.assertEqual(set(jours), {'2025-03-03', '2025-03-12'})
+        self.assertEqual(len(jours['2025-03-03']['evenements']), 2)
+        self.assertEqual(jours['2025-03-03']['autres'], 3)
+        self.assertEqual([e['type'] for e in jours['2025-03-12']['evenements']], ['reception'])
+
+    def test_mois_invalide(self):
+        self.client.force_login(self.utilisateur)
+        self.assertEqual(self.client.get(reverse('get_calendrier_ca'), {'mois': '2025-13'}).status_code, 400)
+
+
+class ReferencesCacheTests(TestCase):
+    """Les données de référence sont servies depuis le cache jusqu'à modification d'une table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test', couleur='#000000')
+        cls.utilisateur = creer_utilisateur()
+
+    def setUp(self):
+        cache.clear()
+        references.vider_lru()
+
+    def test_cache_puis_invalidation(self):
+        self.assertEqual(settings.CACHES['default']['BACKEND'], 'django.core.cache.backends.db.DatabaseCache')
+        self.assertEqual(references.couleurs_agences(), {'Agence test': '#000000'})
+        with self.assertNumQueries(0):
+            self.assertEqual(references.couleurs_agences(), {'Agence test': '#000000'})
+
+        self.agence.couleur = '#ffffff'
+        self.agence.save()
+        self.assertEqual(references.couleurs_agences(), {'Agence test': '#ffffff'})
+
+    def test_modification_par_un_autre_processus(self):
+        self.assertEqual(references.couleurs_agences(), {'Agence test': '#000000'})
+        # Un autre worker modifie l'agence : seuls la base et le cache partagé sont à jour
+        Agence.objects.filter(pk=self.agence.pk).update(couleur='#ffffff')
+        VersionTable.incrementer('agence')
+        cache.delete('references:version:agence')
+        self.assertEqual(references.couleurs_agences(), {'Agence test': '#000000'})
+
+        plus_tard = time.monotonic() + references.DUREE_VERSION_LOCALE + 1
+        with mock.patch('Agences.references.time.monotonic', return_value=plus_tard):
+            self.assertEqual(references.couleurs_agences(), {'Agence test': '#ffffff'})
+
+    def test_m2m_invalide_les_responsables(self):
+        poste_ca = Poste.objects.create(nom='CA')
+        responsable = creer_utilisateur('ca@test.fr', poste=poste_ca)
+        self.assertEqual(references.responsables_ca()[0]['types_prestation'], [])
+
+        prestation = TypePrestation.objects.create(nom='Topographie')
+        responsable.types_prestation.add(prestation)
+        self.assertEqual(references.responsables_ca()[0]['types_prestation'],
+                         [{'id': prestation.id, 'nom': 'Topographie'}])
+
+
+class PosteSessionTests(TestCase):
+    """Le poste est lu avec l'utilisateur puis gardé en session, et suit ses changements."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.poste_ca = Poste.objects.create(nom='CA')
+        cls.poste_prod = Poste.objects.create(nom='PROD')
+        cls.utilisateur = creer_utilisateur(poste=cls.poste_ca)
+
+    def test_redirection_sans_requete_supplementaire(self):
+        self.client.force_login(self.utilisateur)
+        self.assertRedirects(self.client.get(reverse('home')), reverse('interface_ca'), fetch_redirect_response=False)
+        # session + utilisateur (poste et agence joints)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('home'))
+
+    def test_changement_de_poste(self):
+        self.client.force_login(self.utilisateur)
+        self.client.get(reverse('home'))
+        self.utilisateur.poste = self.poste_prod
+        self.utilisateur.save()
+        self.assertRedirects(self.client.get(reverse('home')), reverse('interface_prod'),
+                             fetch_redirect_response=False)
+
+
+class AmorceInterfacesTests(TestCase):
+    """Chaque interface embarque ses données de premier affichage (json_script)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.agence = Agence.objects.create(nom='Agence test', couleur='#123456')
+        cls.utilisateurs = {
+            nom: creer_utilisateur(f'{nom.lower()}@test.fr', poste=Poste.objects.create(nom=nom), agence=cls.agence)
+            for nom in ['COMMERCIAL', 'CA', 'PROD']
+        }
+        creer_appel_offre('AO-AMORCE', cls.agence, cls.utilisateurs['COMMERCIAL'], statut='gagne')
+        creer_appel_offre('AO-AMORCE-RETARD', cls.agence, cls.utilisateurs['COMMERCIAL'], statut='en_cours')
+
+    def setUp(self):
+        cache.clear()
+        references.vider_lru()
+
+    def amorce(self, poste, nom_url):
+        self.client.force_login(self.utilisateurs[poste])
+        reponse = self.client.get(reverse(nom_url))
+        self.assertContains(reponse, f'id="amorce-{poste.lower()}"')
+        return reponse.context['amorce']
+
+    def test_ca(self):
+        amorce = self.amorce('CA', 'interface_ca')
+        self.assertEqual([p['reference'] for p in amorce['projets']['projets']], ['AO-AMORCE'])
+        self.assertNotIn('description', amorce['projets']['projets'][0])
+        self.assertEqual(amorce['couleurs'], {'Agence test': '#123456'})
+        self.assertEqual([r['id'] for r in amorce['responsables_prod']], [self.utilisateurs['PROD'].id])
+
+    def test_prod(self):
+        amorce = self.amorce('PROD', 'interface_prod')
+        self.assertEqual([p['reference'] for p in amorce['projets']['projets']], ['AO-AMORCE'])
+        self.assertTrue(amorce['projets']['since'])
+
+    def test_commercial(self):
+        amorce = self.amorce('COMMERCIAL', 'interface_commercial')
+        self.assertEqual({a['reference'] for a in amorce['appels_offre']}, {'AO-AMORCE', 'AO-AMORCE-RETARD'})
+        self.assertEqual([a['reference'] for a in amorce['appels_retard']], ['AO-AMORCE-RETARD'])
+
+    def test_parametres_de_la_page_ignores(self):
+        # L'amorce reproduit le premier appel à l'API, sans paramètres
+        parametres = {'fields': 'x', 'since': 'garbage', 'cursor': 'bad'}
+        for poste, nom_url, cle in [('CA', 'interface_ca', 'projets'), ('PROD', 'interface_prod', 'projets'),
+                                    ('COMMERCIAL', 'interface_commercial', 'appels_offre')]:
+            with self.subTest(nom_url):
+                self.client.force_login(self.utilisateurs[poste])
+                reponse = self.client.get(reverse(nom_url), parametres)
+                self.assertEqual(reponse.status_code, 200)
+                amorce = reponse.context['amorce']
+                lignes = amorce['projets']['projets'] if cle == 'projets' else amorce['appels_offre']
+                self.assertIn('AO-AMORCE', {ligne['reference'] for ligne in lignes})
+
+    def test_donnees_de_reference_en_cache(self):
+        self.amorce('CA', 'interface_ca')
+        # session, utilisateur, projets et leurs prestations, prestations de l'utilisateur (gabarit de base) :
+        # agences, couleurs et responsables sont lus dans le cache
+        with self.assertNumQueries(5):
+            self.client.get(reverse('interface_ca'))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImportExcelTests(TestCase):
+    """Import Excel des utilisateurs : lecture en flux, écritures groupées, erreurs par ligne."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(email='admin@test.fr', prenoms='Admin', pseudo='admin',
+                                                  password='motdepasse')
+        cls.existant = creer_utilisateur('existant@test.fr')
+
+    def fichier(self, lignes):
+        classeur = openpyxl.Workbook()
+        feuille = classeur.active
+        for ligne in lignes:
+            feuille.append(ligne)
+        contenu = BytesIO()
+        classeur.save(contenu)
+        return SimpleUploadedFile('utilisateurs.xlsx', contenu.getvalue())
+
+    def test_import(self):
+        fichier = self.fichier([
+            ['Nom', 'Prénoms', 'Pseudo', 'Email', 'Prestation', 'Poste', 'Agence'],
+            ['Rakoto', 'Jean', 'jean', 'jean@test.fr', 'Topographie', 'ca', 'Agence A'],
+            ['Rabe', 'Paul', 'paul', 'existant@test.fr', 'Topographie', 'Production', 'Agence B'],
+            [None, 'Jean', 'jean', 'jean@test.fr', 'Foncier', None, None],
+            ['Sans', None, 'x', 'x@test.fr', None, None, None],
+            ['Email', 'Invalide', 'inv', 'pas-un-email', None, None, None],
+        ])
+        self.client.force_login(self.admin)
+        self.client.post(reverse('admin:import_excel'), {'excel_file': fichier})
+        self.assertFalse(User.objects.filter(email='jean@test.fr').exists())  # import différé
+
+        self.assertTrue(taches.executer_suivante())
+        tache = Tache.objects.get()
+        self.assertEqual((tache.statut, tache.progression, tache.created_by), ('terminee', 100, self.admin))
+
+        jean = User.objects.get(email='jean@test.fr')
+        self.assertEqual((jean.nom, jean.agence.nom, jean.poste.nom), ('Rakoto', 'Agence A', 'CA'))
+        self.assertEqual(set(jean.types_prestation.values_list('nom', flat=True)), {'Topographie', 'Foncier'})
+        self.assertTrue(jean.check_password(MOT_DE_PASSE_DEFAUT))
+
+        self.existant.refresh_from_db()
+        self.assertEqual((self.existant.nom, self.existant.agence.nom, self.existant.poste.nom),
+                         ('Rabe', 'Agence B', 'PROD'))
+        self.assertFalse(User.objects.filter(email__in=['x@test.fr', 'pas-un-email']).exists())
+
+        self.assertEqual((tache.resultat['created'], tache.resultat['updated']), (1, 2))
+        erreurs = tache.resultat['errors']
+        self.assertTrue(any(erreur.startswith('Ligne 5:') for erreur in erreurs), erreurs)
+        self.assertTrue(any(erreur.startswith('Ligne 6:') for erreur in erreurs), erreurs)
+
+    def test_references_invalides(self):
+        resultat = imports.importer_lignes([
+            ['Rakoto', 'Jean', 'jean', 'jean@test.fr', None, 'Stagiaire', 'Agence A'],
+            ['Rabe', 'Paul', 'paul', 'paul@test.fr', None, 'CA', 'A' * 101],
+            ['Rasoa', 'Marie', 'marie', 'marie@test.fr', 'Topographie', 'CA', 'Agence A'],
+        ])
+
+        self.assertEqual((resultat['created'], resultat['updated']), (1, 0))
+        self.assertEqual([erreur.split(':')[0] for erreur in resultat['errors']], ['Ligne 1', 'Ligne 2'])
+        self.assertIn('Poste « STAGIAIRE »', resultat['errors'][0])
+        self.assertEqual(list(User.objects.filter(email__in=['jean@test.fr', 'paul@test.fr', 'marie@test.fr'])
+                              .values_list('email', flat=True)), ['marie@test.fr'])
+        self.assertFalse(Poste.objects.filter(nom='STAGIAIRE').exists())
+        self.assertEqual(list(Agence.objects.values_list('nom', flat=True)), ['Agence A'])
+
+
+class TachesTests(TransactionTestCase):
+    """File des tâches de fond : exécution unique sous concurrence, relances, échec définitif."""
+
+    def enregistrer(self, nom, fonction):
+        taches.TACHES[nom] = fonction
+        self.addCleanup(taches.TACHES.pop, nom)
+
+    def test_workers_concurrents_executent_chaque_tache_une_fois(self):
+        executions = []
+        verrou = threading.Lock()
+
+        def noter(tache, numero):
+            with verrou:
+                executions.append(numero)
+            return {'numero': numero}
+
+        self.enregistrer('test_noter', noter)
+        for numero in range(40):
+            taches.planifier('test_noter', numero=numero)
+
+        call_command('run_workers', concurrency=4, once=True, stdout=StringIO())
+
+        self.assertEqual(sorted(executions), list(range(40)))
+        self.assertEqual(Tache.objects.filter(statut='terminee', tentatives=1).count(), 40)
+
+    def test_relance_puis_echec(self):
+        def echouer(tache):
+            raise RuntimeError("boum")
+
+        self.enregistrer('test_echec', echouer)
+        tache = taches.planifier('test_echec', max_tentatives=2)
+
+        with self.assertLogs('Agences.taches', 'ERROR'):
+            self.assertTrue(taches.executer_suivante())
+        tache.refresh_from_db()
+        self.assertEqual((tache.statut, tache.tentatives), ('en_attente', 1))
+        self.assertIn('boum', tache.erreur)
+        self.assertGreater(tache.executer_apres, timezone.now())
+        self.assertFalse(taches.executer_suivante())  # relance différée
+
+        Tache.objects.update(executer_apres=timezone.now())
+        with self.assertLogs('Agences.taches', 'ERROR'):
+            self.assertTrue(taches.executer_suivante())
+        tache.refresh_from_db()
+        self.assertEqual((tache.statut, tache.tentatives), ('echouee', 2))
+        self.assertIsNotNone(tache.finished_at)
+
+    def test_tache_inconnue(self):
+        with self.assertRaises(ValueError):
+            taches.planifier('inexistante')
+
+    def test_progression_visible_pendant_l_import(self):
+        tache = taches.planifier('import_utilisateurs', chemin='imports/utilisateurs.xlsx')
+        lues = []
+
+        def lire_depuis_une_autre_connexion():
+            try:
+                return Tache.objects.get(pk=tache.pk).progression, User.objects.count()
+            finally:
+                connection.close()
+
+        def progression(pourcentage):
+            taches.progresser(tache, pourcentage)
+            # Autre thread, donc autre connexion : ne voit que ce qui est validé
+            with ThreadPoolExecutor(1) as executeur:
+                lues.append(executeur.submit(lire_depuis_une_autre_connexion).result())
+
+        lignes = [[f'Nom {i}', 'Prénom', f'user{i}', f'user{i}@test.fr'] for i in range(6)]
+        with mock.patch.object(imports, 'TAILLE_LOT', 2):
+            imports.importer_lignes(lignes, progression, total=6)
+        self.assertEqual(lues, [(33, 2), (66, 4), (99, 6)])
@@ -0,0 +1,327 @@
+"""Application en lot des actions CA/PROD du workflow (``/api/transitions/``).
+
+Chaque élément du lot ``{projet_id, action, payload, version}`` est vérifié
+contre ``workflow.TRANSITIONS`` (et contre la version lue par le client, si
+elle est fournie) sur la ligne verrouillée du projet, puis traduit en
+colonnes à écrire, étapes stockées comprises (recalculées sur la ligne
+verrouillée). Les éléments qui écrivent les mêmes valeurs sont regroupés en une
+seule requête UPDATE : chaque projet modifié avance d'une seule version, comme
+avec les endpoints unitaires, et son résultat porte la nouvelle version. Les
+phases sont ensuite resynchronisées en masse. Le tout se fait dans une seule
+transaction, et chaque élément reçoit son propre résultat (les éléments
+invalides n'empêchent pas l'application des autres). Les valeurs du payload sont contrôlées élément par
+élément (types, longueurs, agences et utilisateurs existants) pour qu'une
+valeur invalide ne fasse pas échouer l'UPDATE de tout le lot.
+
+Les actions qui créent d'autres lignes que des événements (reprise « faire »,
+gestion du complément) restent réservées à leurs endpoints unitaires. Seules
+les colonnes d'``AppelOffre`` sont écrites : les attributs posés par les
+endpoints unitaires sans colonne correspondante (``date_debut_terrain_reelle``,
+``nom_affaire_prod``...) n'étaient déjà pas enregistrés.
+"""
+from collections import defaultdict, namedtuple
+from datetime import date, datetime
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import capfirst
+
+from . import workflow
+from .models import AppelOffre, AppelOffreEvent, ModificationConcurrente, ProjetPhase
+from .workflow import TransitionInvalide
+
+# Colonnes à écrire pour un élément, et événement d'historique éventuel (type, payload)
+Changement = namedtuple('Changement', ['champs', 'evenement'], defaults=[None])
+
+# Nombre maximum d'éléments par lot
+TAILLE_MAX_LOT = 500
+
+LONGUEUR_NOM_AFFAIRE = AppelOffre._meta.get_field('nom_affaire').max_length
+
+
+def _date(donnees, cle):
+    try:
+        return datetime.strptime(donnees[cle], '%Y-%m-%d').date()
+    except KeyError:
+        raise ValueError(f"Champ obligatoire manquant : {cle}")
+    except (TypeError, ValueError):
+        raise ValueError(f"Date invalide pour {cle} (format AAAA-MM-JJ attendu)")
+
+
+def _obligatoire(donnees, cle):
+    try:
+        return donnees[cle]
+    except KeyError:
+        raise ValueError(f"Champ obligatoire manquant : {cle}")
+
+
+def _entier(valeur, cle):
+    """Identifiant ou version : entier JSON, ou chaîne de chiffres (valeurs de formulaire)."""
+    if isinstance(valeur, str) and valeur.isdigit():
+        return int(valeur)
+    if not isinstance(valeur, int) or isinstance(valeur, bool):
+        raise ValueError(f"Entier attendu pour {cle}")
+    return valeur
+
+
+def _identifiant(donnees, cle):
+    return _entier(_obligatoire(donnees, cle), cle)
+
+
+def _texte(donnees, cle, obligatoire=False, longueur_max=None):
+    valeur = _obligatoire(donnees, cle) if obligatoire else donnees.get(cle)
+    if valeur is None and not obligatoire:
+        return ''
+    if not isinstance(valeur, str):
+        raise ValueError(f"Texte attendu pour {cle}")
+    if longueur_max and len(valeur) > longueur_max:
+        raise ValueError(f"{cle} : {longueur_max} caractères maximum")
+    return valeur
+
+
+def _periode(donnees, debut, fin, message):
+    date_debut, date_fin = _date(donnees, debut), _date(donnees, fin)
+    if date_debut >= date_fin:
+        raise ValueError(message)
+    return date_debut, date_fin
+
+
+def commencer_terrain_france(projet, donnees, aujourd_hui):
+    date_debut, date_fin_prevue = _periode(donnees, 'date_debut', 'date_fin_prevue',
+                                           'La date de fin doit être postérieure à la date de début')
+    return Changement({
+        'nom_affaire': _texte(donnees, 'nom_affaire', obligatoire=True, longueur_max=LONGUEUR_NOM_AFFAIRE),
+        'date_debut_terrain': date_debut,
+        'date_fin_prevue_terrain': date_fin_prevue,
+        'agence_terrain_id': _identifiant(donnees, 'agence_id'),
+        'responsable_prod_terrain_id': _identifiant(donnees, 'responsable_prod_id'),
+        'etape_terrain_france': 'en_cours',
+    })
+
+
+def fin_terrain_france(projet, donnees, aujourd_hui):
+    return Changement({
+        'etape_terrain_france': 'termine',
+        'etape_traitement_france': 'en_attente',
+        'date_fin_terrain_reelle': aujourd_hui,
+        'commentaire_fin_terrain': _texte(donnees, 'commentaire'),
+    })
+
+
+def commencer_traitement_france(projet, donnees, aujourd_hui):
+    date_debut, date_fin_prevue = _periode(donnees, 'date_debut', 'date_fin_prevue',
+                                           'La date de fin doit être postérieure à la date de début')
+    return Changement({
+        'nom_affaire_traitement': _texte(donnees, 'nom_affaire', obligatoire=True,
+                                         longueur_max=LONGUEUR_NOM_AFFAIRE),
+        'date_debut_traitement': date_debut,
+        'date_fin_prevue_traitement': date_fin_prevue,
+        'agence_traitement_id': _identifiant(donnees, 'agence_id'),
+        'responsable_prod_traitement_id': _identifiant(donnees, 'responsable_prod_id'),
+        'etape_traitement_france': 'en_cours',
+    })
+
+
+def fin_traitement_france(projet, donnees, aujourd_hui):
+    return Changement({
+        'etape_traitement_france': 'termine',
+        'etape_envoi_mada': 'en_attente',
+        'date_fin_traitement_reelle': aujourd_hui,
+        'commentaire_fin_traitement': _texte(donnees, 'commentaire'),
+    })
+
+
+def envoyer_donnees_mada(projet, donnees, aujourd_hui):
+    date_envoi, date_livraison = _periode(donnees, 'date_envoi', 'date_livraison',
+                                          "La date de livraison doit être postérieure à la date d'envoi")
+    evenement = None
+    if projet.commentaire_fin_reprise and projet.commentaire_fin_reprise.strip():
+        # L'ancien commentaire part dans l'historique avant le nouvel envoi
+        evenement = ('avant_reenvoi', {
+            'commentaire': projet.commentaire_fin_reprise,
+            'etape_envoi_mada': projet.etape_envoi_mada,
+        })
+    return Changement({
+        'date_envoi_mada': date_envoi,
+        'date_livraison_prevue_mada': date_livraison,
+        'info_supplementaire_mada': _texte(donnees, 'info_supplementaire'),
+        'etape_envoi_mada': 'en_cours',
+        'date_reception_france': None,
+        'etape_reprise_france': 'en_attente',
+        'commentaire_fin_reprise': '',
+        'probleme_confirme': False,
+    }, evenement)
+
+
+def confirmer_probleme_reception(projet, donnees, aujourd_hui):
+    return Changement({'probleme_confirme': True})
+
+
+def reception_donnees(projet, donnees, aujourd_hui):
+    if _obligatoire(donnees, 'statut') == 'ok':
+        return Changement({
+            'date_reception_france': aujourd_hui,
+            'etape_reprise_france': 'en_attente',
+            'etape_envoi_mada': 'termine',
+            'commentaire_fin_reprise': '',
+            'probleme_confirme': False,
+        })
+
+    commentaire = _texte(donnees, 'commentaire')
+    if not commentaire.strip():
+        raise ValueError('Commentaire obligatoire pour "Non reçu"')
+    return Changement({
+        'commentaire_fin_reprise': commentaire,
+        'date_reception_france': None,
+        'etape_envoi_mada': 'en_cours',
+        'probleme_confirme': False,
+    }, ('non_recu', {'commentaire': commentaire, 'etape_envoi_mada': projet.etape_envoi_mada}))
+
+
+def envoie_reprise(projet, donnees, aujourd_hui):
+    if _obligatoire(donnees, 'action') != 'pas':
+        raise TransitionInvalide("Reprise avec complément non disponible en lot : utiliser l'envoi unitaire")
+    return Changement({'etape_reprise_france': 'termine', 'etape_prod_mada': 'en_attente'})
+
+
+def commencer_prod_mada(projet, donnees, aujourd_hui):
+    date_debut, date_fin_prevue = _periode(donnees, 'date_debut_prod', 'date_fin_prevue_prod',
+                                           'Date fin postérieure à début')
+    return Changement({
+        'date_debut_prod_mada': date_debut,
+        'date_fin_prevue_prod_mada': date_fin_prevue,
+        'etape_prod_mada': 'en_cours',
+    })
+
+
+def fin_prod_mada(projet, donnees, aujourd_hui):
+    return Changement({
+        'date_fin_prod_mada_reelle': _date(donnees, 'date_fin_reelle_prod'),
+        'etape_prod_mada': 'termine',
+    })
+
+
+# Actions applicables en lot (sous-ensemble de workflow.TRANSITIONS)
+ACTIONS = {action.__name__: action for action in [
+    commencer_terrain_france, fin_terrain_france, commencer_traitement_france, fin_traitement_france,
+    envoyer_donnees_mada, confirmer_probleme_reception, reception_donnees, envoie_reprise,
+    commencer_prod_mada, fin_prod_mada,
+]}
+
+
+def _lire_element(element):
+    """Retourne ``(projet_id, action, payload, version)`` d'un élément du lot, ou lève ``ValueError``."""
+    if not isinstance(element, dict):
+        raise ValueError("Élément invalide : objet {projet_id, action, payload} attendu")
+    projet_id, action, donnees = element.get('projet_id'), element.get('action'), element.get('payload', {})
+    if not isinstance(projet_id, int) or isinstance(projet_id, bool):
+        raise ValueError("projet_id entier obligatoire")
+    if action not in workflow.TRANSITIONS:
+        raise ValueError(f"Action inconnue : {action}")
+    if action not in ACTIONS:
+        raise TransitionInvalide(f"Action non disponible en lot : {action}")
+    if not isinstance(donnees, dict):
+        raise ValueError("payload doit être un objet")
+    version = element.get('version')
+    return projet_id, action, donnees, None if version is None else _entier(version, 'version')
+
+
+def _cle_etrangere(champ, valeur):
+    """``(modèle, pk)`` si ``champ`` est une clé étrangère d'AppelOffre renseignée, sinon ``None``."""
+    modele = AppelOffre._meta.get_field(champ).related_model
+    return (modele, valeur) if modele and valeur is not None else None
+
+
+def _references_inconnues(changements):
+    """Clés étrangères ``(modèle, pk)`` écrites par le lot et absentes de la base (une requête par table)."""
+    demandes = defaultdict(set)
+    for changement in changements:
+        for champ, valeur in changement.champs.items():
+            cle = _cle_etrangere(champ, valeur)
+            if cle:
+                demandes[cle[0]].add(cle[1])
+    inconnues = set()
+    for modele, pks in demandes.items():
+        existants = set(modele.objects.filter(pk__in=pks).values_list('pk', flat=True))
+        inconnues.update((modele, pk) for pk in pks - existants)
+    return inconnues
+
+
+def appliquer(elements, utilisateur, aujourd_hui=None):
+    """Applique le lot dans une transaction ; retourne un résultat par élément, dans l'ordre."""
+    aujourd_hui = aujourd_hui or date.today()
+    resultats, lus = [], []
+    for element in elements:
+        try:
+            lus.append(_lire_element(element))
+            resultats.append(None)
+        except ValueError as e:
+            lus.append(None)
+            resultats.append({'projet_id': element.get('projet_id') if isinstance(element, dict) else None,
+                              'action': element.get('action') if isinstance(element, dict) else None,
+                              'success': False, 'error': str(e)})
+
+    with transaction.atomic():
+        ids = sorted({lu[0] for lu in lus if lu})
+        # Verrouillage dans l'ordre des clés : deux lots concurrents ne peuvent pas s'interbloquer
+        projets = {projet.pk: projet for projet in
+                   AppelOffre.objects.select_for_update().filter(pk__in=ids, statut='gagne').order_by('pk')}
+
+        valides, vus = [], set()
+        for index, lu in enumerate(lus):
+            if lu is None:
+                continue
+            projet_id, action, donnees, version = lu
+            resultat = {'projet_id': projet_id, 'action': action}
+            try:
+                if projet_id in vus:
+                    raise TransitionInvalide("Projet présent plusieurs fois dans le lot")
+                vus.add(projet_id)
+                projet = projets.get(projet_id)
+                if projet is None:
+                    raise ValueError('Projet non trouvé')
+                if version is not None and version != projet.version:
+                    raise ModificationConcurrente("Le projet a été modifié entre-temps : rechargez-le avant de recommencer")
+                workflow.verifier_transition(action, projet)
+                changement = ACTIONS[action](projet, donnees, aujourd_hui)
+            except (ValueError, ModificationConcurrente) as e:
+                resultats[index] = {**resultat, 'success': False, 'error': str(e),
+                                    'conflit': isinstance(e, ModificationConcurrente)}
+                continue
+            valides.append((index, resultat, projet, changement))
+
+        inconnues = _references_inconnues([changement for *_, changement in valides])
+        groupes, evenements = defaultdict(list), []
+        for index, resultat, projet, changement in valides:
+            cles = [_cle_etrangere(champ, valeur) for champ, valeur in changement.champs.items()]
+            erreurs = [f"{capfirst(modele._meta.verbose_name)} introuvable : {pk}"
+                       for modele, pk in filter(None, cles) if (modele, pk) in inconnues]
+            if erreurs:
+                resultats[index] = {**resultat, 'success': False, 'error': ' ; '.join(erreurs), 'conflit': False}
+                continue
+
+            # Étapes calculées sur l'état final, écrites dans le même UPDATE que les colonnes
+            for champ, valeur in changement.champs.items():
+                setattr(projet, champ, valeur)
+            champs = {**changement.champs, 'etape_ca': projet.calculer_etape_ca(),
+                      'etape_prod': projet.calculer_etape_prod()}
+            groupes[tuple(sorted(champs.items()))].append(projet.pk)
+            if changement.evenement:
+                type_evenement, payload = changement.evenement
+                evenements.append(AppelOffreEvent(projet=projet, type=type_evenement,
+                                                  auteur=utilisateur, payload=payload))
+            resultats[index] = {**resultat, 'success': True, 'version': projet.version + 1}
+
+        # Une requête UPDATE par jeu de valeurs identique
+        maintenant = timezone.now()
+        for champs, ids_groupe in groupes.items():
+            AppelOffre.objects.filter(pk__in=ids_groupe).update(**dict(champs), version=F('version') + 1,
+                                                                updated_at=maintenant)
+        AppelOffreEvent.objects.bulk_create(evenements)
+
+        if groupes:
+            # Les instances verrouillées portent déjà les nouvelles valeurs
+            ProjetPhase.synchroniser([projets[pk] for ids_groupe in groupes.values() for pk in ids_groupe])
+
+    return resultats
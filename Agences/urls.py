@@ -28,14 +28,18 @@ urlpatterns = [
     # ... CA ...
     path('interface-ca/', views.interface_ca, name='interface_ca'),
     path('api/projets-ca/', views.get_projets_ca, name='get_projets_ca'),
-    path('api/agences-couleurs/', views.get_agences_couleurs_ca, name='get_agences_couleurs_ca'),
+    path('api/projets/<int:projet_id>/', views.get_projet_ca, name='get_projet_ca'),
+    path('api/projets/<int:projet_id>/historique/', views.get_projet_historique, name='get_projet_historique'),
     path('api/responsables-prod/', views.get_responsables_prod, name='get_responsables_prod'),
     path('api/commencer-terrain-france/', views.commencer_terrain_france, name='commencer_terrain_france'),
     path('api/fin-terrain-france/<int:projet_id>/', views.fin_terrain_france, name='fin_terrain_france'),
     path('api/commencer-traitement-france/', views.commencer_traitement_france, name='commencer_traitement_france'),
     path('api/fin-traitement-france/<int:projet_id>/', views.fin_traitement_france, name='fin_traitement_france'),
     path('api/envoyer-donnees-mada/', views.envoyer_donnees_mada, name='envoyer_donnees_mada'),
+    path('api/transitions/', views.appliquer_transitions, name='appliquer_transitions'),
     path('api/projets-retard-ca/', views.get_projets_en_retard_ca, name='get_projets_en_retard_ca'),
+    path('api/gantt/', views.get_gantt, name='get_gantt'),
+    path('api/calendrier-ca/', views.get_calendrier_ca, name='get_calendrier_ca'),
 
 
     # ... PROD ...
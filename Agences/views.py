@@ -1,31 +1,100 @@
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 
 from django.contrib.auth.forms import PasswordChangeForm
-from django.http import JsonResponse
+from django.http import JsonResponse, QueryDict
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate, logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 
 from .forms import CustomUserCreationForm, LoginForm, CustomUserChangeForm
-from .models import User, Agence, Poste, TypePrestation, AppelOffre
-from django.db import models
+from .models import User, Agence, Poste, AppelOffre, AppelOffreEvent, AppelOffreSuppression, \
+    CompteurReference, JoursEcoules, ModificationConcurrente, ProjetPhase
+from . import calendrier, pagination, projection, references, transitions, workflow
+from .idempotence import idempotent
+from .projection import Champ, iso, nom_complet
+from django.db import models, transaction
+from django.db.models import Count, DateField, F, Max, Prefetch, Value, Window
+from django.db.models.functions import RowNumber
+import copy
+import hashlib
+import itertools
 import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Recouvrement appliqué au curseur ?since= des tableaux (transactions non encore visibles)
+DELTA_CHEVAUCHEMENT = timedelta(seconds=5)
+
+# Taille par défaut d'une page d'historique de projet
+LIMITE_HISTORIQUE = 20
+
+
+def calculer_etag(request, *parties):
+    """ETag d'une réponse JSON : dépend des données, de l'utilisateur et des paramètres GET"""
+    brut = '|'.join(str(partie) for partie in (request.user.pk, request.GET.urlencode(), *parties))
+    return hashlib.md5(brut.encode()).hexdigest()
+
+
+def etag_tables(request, *tables):
+    """ETag des endpoints de référence, à partir des versions des tables lues"""
+    return calculer_etag(request, references.versions(*tables))
+
+
+def etag_appels_offre(request, **filtres):
+    """ETag des endpoints d'AO : max(updated_at) et nombre d'AO, plus les tables de référence affichées"""
+    etat = AppelOffre.objects.filter(**filtres).aggregate(dernier=Max('updated_at'), nombre=Count('id'))
+    return calculer_etag(request, etat['dernier'], etat['nombre'],
+                         references.versions('agence', 'user', 'typeprestation'))
+
+
+def requete_amorce(request):
+    """Copie de ``request`` sans paramètres GET, pour construire l'amorce d'une page.
+
+    L'amorce remplace le premier appel de la page à l'API, qui se fait sans
+    paramètres : la query string de la page (``?fields=``, ``?since=``...) ne
+    doit ni la modifier ni la faire échouer.
+    """
+    amorce = copy.copy(request)
+    amorce.GET = QueryDict()
+    return amorce
+
+
+# Interface d'accueil de chaque poste
+INTERFACES_POSTE = {
+    'COMMERCIAL': 'interface_commercial',
+    'CA': 'interface_ca',
+    'PROD': 'interface_prod',
+}
+
+
+def poste_utilisateur(request):
+    """Code du poste de l'utilisateur connecté (``None`` sans poste), mis en cache dans la session.
+
+    Le cache est associé à ``poste_id`` : il est recalculé dès que le poste de
+    l'utilisateur change.
+    """
+    user = request.user
+    if not user.is_authenticated or user.poste_id is None:
+        return None
+    en_cache = request.session.get('poste')
+    if en_cache and en_cache[0] == user.poste_id:
+        return en_cache[1]
+    code = user.poste.nom
+    request.session['poste'] = [user.poste_id, code]
+    return code
 
 
 def home_view(request):
     """Vue pour la page d'accueil"""
     if request.user.is_authenticated:
         # Rediriger vers l'interface appropriée selon le poste
-        if request.user.poste:
-            if request.user.poste.nom == 'COMMERCIAL':
-                return redirect('interface_commercial')
-            elif request.user.poste.nom == 'CA':
-                return redirect('interface_ca')
-            elif request.user.poste.nom == 'PROD':
-                return redirect('interface_prod')
-        return redirect('profil')
+        return redirect(INTERFACES_POSTE.get(poste_utilisateur(request), 'profil'))
     else:
         return redirect('login')
 
@@ -43,14 +112,7 @@ def login_view(request):
                 login(request, user)
                 messages.success(request, f'Bienvenue {user.prenoms} !')
                 # Redirection selon le poste
-                if user.poste:
-                    if user.poste.nom == 'COMMERCIAL':
-                        return redirect('interface_commercial')
-                    elif user.poste.nom == 'CA':
-                        return redirect('interface_ca')
-                    elif user.poste.nom == 'PROD':
-                        return redirect('interface_prod')
-                return redirect('profil')
+                return redirect(INTERFACES_POSTE.get(poste_utilisateur(request), 'profil'))
             else:
                 messages.error(request, 'Email ou mot de passe incorrect.')
         else:
@@ -75,15 +137,10 @@ def register_view(request):
         form = CustomUserCreationForm()
 
     # Récupérer les données pour les listes déroulantes
-    agences = Agence.objects.all()
-    postes = Poste.objects.all()
-    prestations = TypePrestation.objects.all()
-
+    # Listes déroulantes : données de référence en cache
     return render(request, 'Agences/register.html', {
         'form': form,
-        'agences': agences,
-        'postes': postes,
-        'prestations': prestations
+        **references.listes_formulaire()
     })
 
 
@@ -112,15 +169,10 @@ def modifier_profil_view(request):
     else:
         form = CustomUserChangeForm(instance=request.user)
 
-    agences = Agence.objects.all()
-    postes = Poste.objects.all()
-    prestations = TypePrestation.objects.all()
-
+    # Listes déroulantes : données de référence en cache
     return render(request, 'Agences/modifier_profil.html', {
         'form': form,
-        'agences': agences,
-        'postes': postes,
-        'prestations': prestations
+        **references.listes_formulaire()
     })
 
 
@@ -143,49 +195,45 @@ def changer_password_view(request):
 
 @login_required
 def agences_view(request):
-    # Récupérer toutes les agences
-    agences = Agence.objects.all()
-
-    # Préparer les données pour chaque agence
-    agences_avec_membres = []
-    total_membres_meme_poste = 0
-    repartition_poste = {}
-
-    for agence in agences:
-        # Récupérer tous les membres de l'agence
-        membres_agence = agence.user_set.all()
-
-        # Filtrer par poste de l'utilisateur connecté
-        if request.user.poste:
-            membres_meme_poste = membres_agence.filter(poste=request.user.poste)
-        else:
-            membres_meme_poste = membres_agence.none()
-
-        # Compter les membres du même poste
-        membres_meme_poste_count = membres_meme_poste.count()
-        total_membres_meme_poste += membres_meme_poste_count
-
-        # Récupérer la liste des membres du même poste (limité à 10 pour l'affichage)
-        membres_meme_poste_list = membres_meme_poste[:10]
-
-        # Statistiques de répartition par poste pour cette agence
-        postes_agence = {}
-        for poste in Poste.objects.all():
-            count = membres_agence.filter(poste=poste).count()
-            if count > 0:
-                postes_agence[poste.get_nom_display()] = count
-
-        repartition_poste[agence.nom] = postes_agence
-
-        # Ajouter l'agence avec ses données
-        agences_avec_membres.append({
-            'agence': agence,
-            'membres_count': membres_agence.count(),
-            'membres_meme_poste_count': membres_meme_poste_count,
-            'membres_meme_poste': membres_meme_poste_list,
-            'date_creation': agence.date_creation,
-            'created_by': agence.created_by
-        })
+    poste = request.user.poste
+
+    # Effectifs de chaque agence (total et même poste) en une seule requête GROUP BY
+    agences = list(Agence.objects.select_related('created_by').annotate(
+        membres_count=Count('user'),
+        membres_meme_poste_count=Count('user', filter=models.Q(user__poste=poste)) if poste else Value(0),
+    ).order_by('id'))
+
+    # Répartition par poste dans chaque agence
+    libelles_postes = dict(Poste.POSTE_CHOICES)
+    repartition_poste = {agence.nom: {} for agence in agences}
+    noms_agences = {agence.id: agence.nom for agence in agences}
+    repartition = User.objects.filter(agence__isnull=False, poste__isnull=False).values(
+        'agence_id', 'poste__nom'
+    ).annotate(nombre=Count('id')).order_by('agence_id', 'poste_id')
+    for ligne in repartition:
+        # Un poste hors POSTE_CHOICES (créé directement en base) s'affiche sous son nom, comme get_nom_display()
+        libelle = libelles_postes.get(ligne['poste__nom'], ligne['poste__nom'])
+        repartition_poste[noms_agences[ligne['agence_id']]][libelle] = ligne['nombre']
+
+    # Membres du même poste (limité à 10 par agence pour l'affichage), via une fonction de fenêtrage
+    membres_par_agence = {agence.id: [] for agence in agences}
+    if poste:
+        membres = User.objects.filter(agence__isnull=False, poste=poste).annotate(
+            rang=Window(RowNumber(), partition_by=F('agence_id'), order_by=F('id').asc())
+        ).filter(rang__lte=10).order_by('agence_id', 'id')
+        for membre in membres:
+            membres_par_agence[membre.agence_id].append(membre)
+
+    agences_avec_membres = [{
+        'agence': agence,
+        'membres_count': agence.membres_count,
+        'membres_meme_poste_count': agence.membres_meme_poste_count,
+        'membres_meme_poste': membres_par_agence[agence.id],
+        'date_creation': agence.date_creation,
+        'created_by': agence.created_by
+    } for agence in agences]
+    total_membres_meme_poste = sum(agence.membres_meme_poste_count for agence in agences)
+    total_membres = User.objects.count()
 
     # Trouver l'agence avec le plus de membres du même poste
     agence_plus_membres = None
@@ -201,11 +249,11 @@ def agences_view(request):
     context = {
         'agences': agences_avec_membres,
         'total_agences': len(agences),
-        'total_membres': User.objects.count(),
+        'total_membres': total_membres,
         'total_membres_meme_poste': total_membres_meme_poste,
-        'moyenne_membres': User.objects.count() / len(agences) if agences else 0,
+        'moyenne_membres': total_membres / len(agences) if agences else 0,
         'moyenne_membres_meme_poste': moyenne_membres_meme_poste,
-        'derniere_agence': agences.order_by('-date_creation').first(),
+        'derniere_agence': max(agences, key=lambda agence: agence.date_creation, default=None),
         'agence_plus_membres': agence_plus_membres,
         'repartition_poste': repartition_poste,
     }
@@ -219,47 +267,28 @@ def agences_view(request):
 
 @login_required
 def interface_commercial(request):
-    if not request.user.poste or request.user.poste.nom != 'COMMERCIAL':
+    if poste_utilisateur(request) != 'COMMERCIAL':
         messages.error(request, "Vous n'avez pas accès à cette interface.")
         return redirect('profil')
 
-    # Récupérer les données pour le formulaire
-    agences = Agence.objects.all()
-    prestations = TypePrestation.objects.all()
-
-    # Récupérer les appels d'offre de l'utilisateur connecté
-    appels_offre = AppelOffre.objects.filter(commercial=request.user).select_related(
-        'agence', 'responsable_ca', 'commercial'
-    ).prefetch_related('prestations')
-
-    # Mettre à jour les statuts automatiquement
-    update_appels_statuts(appels_offre)
+    # Données du premier affichage, intégrées à la page (json_script) : aucun appel API au chargement
+    listes = references.listes_formulaire()
+    amorce = {
+        'appels_offre': donnees_appels_offre(requete_amorce(request))['appels_offre'],
+        'appels_retard': donnees_appels_en_retard(request.user)['appels_retard'],
+        'couleurs': references.couleurs_agences(),
+    }
 
     return render(request, 'Agences/interfaces/commercial.html', {
-        'agences': agences,
-        'prestations': prestations,
-        'appels_offre': appels_offre
+        'agences': listes['agences'],
+        'prestations': listes['prestations'],
+        'amorce': amorce,
     })
 
 
-def update_appels_statuts(appels_offre):
-    """Met à jour les statuts des appels d'offre automatiquement"""
-    today = date.today()
-
-    for appel in appels_offre:
-        if appel.statut in ['gagne', 'perdu']:
-            continue
-
-        if today >= appel.date_debut and appel.statut == 'en_attente':
-            appel.statut = 'en_cours'
-            appel.save()
-        elif today > appel.date_fin and appel.statut == 'en_cours' and not appel.date_fin_reelle:
-            # Appel en retard - on pourrait notifier ici
-            pass
-
-
 @csrf_exempt
 @login_required
+@idempotent
 def create_appel_offre(request):
     """Crée un nouvel appel d'offre"""
     if request.method == 'POST':
@@ -273,36 +302,25 @@ def create_appel_offre(request):
             if date_debut >= date_fin:
                 return JsonResponse({'error': 'La date de fin doit être postérieure à la date de début'}, status=400)
 
-            # Génération de la référence
-            last_ao = AppelOffre.objects.filter(
-                created_at__year=date.today().year
-            ).order_by('-id').first()
-
-            next_number = 1
-            if last_ao:
-                try:
-                    last_number = int(last_ao.reference.split('-')[-1])
-                    next_number = last_number + 1
-                except:
-                    next_number = 1
-
-            reference = f"AO-{date.today().year}-{str(next_number).zfill(3)}"
-
-            # Création de l'appel d'offre
-            appel_offre = AppelOffre.objects.create(
-                reference=reference,
-                agence_id=data['agence_id'],
-                date_debut=date_debut,
-                date_fin=date_fin,
-                responsable_ca_id=data['responsable_ca_id'],
-                commercial=request.user,
-                description=data.get('description', ''),
-                couleur=data.get('couleur', '#007bff')
-            )
-
-            # Ajout des prestations
-            prestations_ids = data.get('prestations_ids', [])
-            appel_offre.prestations.set(prestations_ids)
+            with transaction.atomic():
+                # Génération de la référence (compteur annuel verrouillé jusqu'au commit)
+                reference = CompteurReference.prochaine_reference(date.today().year)
+
+                # Création de l'appel d'offre
+                appel_offre = AppelOffre.objects.create(
+                    reference=reference,
+                    agence_id=data['agence_id'],
+                    date_debut=date_debut,
+                    date_fin=date_fin,
+                    responsable_ca_id=data['responsable_ca_id'],
+                    commercial=request.user,
+                    description=data.get('description', ''),
+                    couleur=data.get('couleur', '#007bff')
+                )
+
+                # Ajout des prestations
+                prestations_ids = data.get('prestations_ids', [])
+                appel_offre.prestations.set(prestations_ids)
 
             return JsonResponse({
                 'success': True,
@@ -354,63 +372,71 @@ def update_appel_offre_statut(request, appel_id):
     return JsonResponse({'error': 'Méthode non autorisée'}, status=405)
 
 
+# Clés des AO du commercial (?fields=) : colonnes lues et sérialisation de chaque clé
+CHAMPS_APPEL_OFFRE = {
+    'id': Champ(['id'], lambda a: a.id),
+    'reference': Champ(['reference'], lambda a: a.reference),
+    'agence': Champ(['agence__nom'], lambda a: a.agence.nom),
+    'prestations': Champ([], lambda a: [p.nom for p in a.prestations.all()], ['prestations']),
+    'date_debut': Champ(['date_debut'], lambda a: a.date_debut.isoformat()),
+    'date_fin': Champ(['date_fin'], lambda a: a.date_fin.isoformat()),
+    'date_fin_reelle': Champ(['date_fin_reelle'], lambda a: iso(a.date_fin_reelle)),
+    'responsable': Champ(['responsable_ca__prenoms', 'responsable_ca__nom'], lambda a: nom_complet(a.responsable_ca)),
+    'statut': Champ(['statut'], lambda a: a.get_statut_display()),
+    'description': Champ(['description'], lambda a: a.description),
+    'commentaire_arret': Champ(['commentaire_arret'], lambda a: a.commentaire_arret),
+    'couleur': Champ(['couleur'], lambda a: a.couleur),
+    'created': Champ(['created_at'], lambda a: a.created_at.isoformat()),
+}
+
+
 @login_required
+@condition(etag_func=lambda request: etag_appels_offre(request, commercial=request.user))
 def get_appels_offre_json(request):
-    """Retourne les appels d'offre au format JSON pour le frontend"""
-    appels_offre = AppelOffre.objects.filter(commercial=request.user).select_related(
-        'agence', 'responsable_ca'
-    ).prefetch_related('prestations')
-
-    appels_data = []
-    for appel in appels_offre:
-        appels_data.append({
-            'id': appel.id,
-            'reference': appel.reference,
-            'agence': appel.agence.nom,
-            'prestations': [p.nom for p in appel.prestations.all()],
-            'date_debut': appel.date_debut.isoformat(),
-            'date_fin': appel.date_fin.isoformat(),
-            'date_fin_reelle': appel.date_fin_reelle.isoformat() if appel.date_fin_reelle else None,
-            'responsable': f"{appel.responsable_ca.prenoms} {appel.responsable_ca.nom}",
-            'statut': appel.get_statut_display(),
-            'description': appel.description,
-            'commentaire_arret': appel.commentaire_arret,
-            'couleur': appel.couleur,
-            'created': appel.created_at.isoformat()
-        })
+    """Retourne les appels d'offre au format JSON pour le frontend (``?fields=`` : clés de ``CHAMPS_APPEL_OFFRE``)"""
+    try:
+        return JsonResponse(donnees_appels_offre(request))
+    except projection.ChampsInvalides as e:
+        return JsonResponse({'error': str(e)}, status=400)
 
-    return JsonResponse({'appels_offre': appels_data})
+
+def donnees_appels_offre(request):
+    cles = projection.champs_demandes(request, CHAMPS_APPEL_OFFRE)
+    appels_offre = projection.projeter(AppelOffre.objects.filter(commercial=request.user), CHAMPS_APPEL_OFFRE, cles)
+    return {'appels_offre': [projection.serialiser(appel, CHAMPS_APPEL_OFFRE, cles) for appel in appels_offre]}
 
 
 @login_required
 def get_appels_en_retard(request):
     """Retourne les appels d'offre en retard"""
-    today = date.today()
+    return JsonResponse(donnees_appels_en_retard(request.user))
+
+
+def donnees_appels_en_retard(commercial):
+    today = timezone.localdate()
     appels_retard = AppelOffre.objects.filter(
-        commercial=request.user,
+        commercial=commercial,
         statut='en_cours',
         date_fin__lt=today,
         date_fin_reelle__isnull=True
-    )
+    ).annotate(
+        jours_retard=JoursEcoules(Value(today, output_field=DateField()), F('date_fin'))
+    ).values('reference', 'agence__nom', 'jours_retard')
 
-    appels_data = []
-    for appel in appels_retard:
-        jours_retard = (today - appel.date_fin).days
-        appels_data.append({
-            'reference': appel.reference,
-            'agence': appel.agence.nom,
-            'jours_retard': jours_retard
-        })
+    appels_data = [{
+        'reference': appel['reference'],
+        'agence': appel['agence__nom'],
+        'jours_retard': appel['jours_retard']
+    } for appel in appels_retard]
 
-    return JsonResponse({'appels_retard': appels_data})
+    return {'appels_retard': appels_data}
 
 
 @login_required
+@condition(etag_func=lambda request: etag_tables(request, 'agence'))
 def get_agences_couleurs(request):
     """Retourne les couleurs des agences depuis la base de données"""
-    agences = Agence.objects.all().values('nom', 'couleur')
-    couleurs = {agence['nom']: agence['couleur'] for agence in agences}
-    return JsonResponse({'couleurs': couleurs})
+    return JsonResponse({'couleurs': references.couleurs_agences()})
 
 
 ##############################################
@@ -419,181 +445,262 @@ def get_agences_couleurs(request):
 
 @login_required
 def interface_ca(request):
-    if not request.user.poste or request.user.poste.nom != 'CA':
+    if poste_utilisateur(request) != 'CA':
         messages.error(request, "Vous n'avez pas accès à cette interface.")
         return redirect('profil')
 
-    # Récupérer les agences pour les filtres
-    agences = Agence.objects.all()
+    # Données du premier affichage, intégrées à la page (json_script) : aucun appel API au chargement
+    amorce = {
+        'projets': donnees_tableau(requete_amorce(request), CHAMPS_PROJET_CA, CLES_LISTE_CA, 'etape_ca'),
+        'couleurs': references.couleurs_agences(),
+        'responsables_prod': references.responsables_prod(),
+    }
 
     return render(request, 'Agences/interfaces/ca.html', {
-        'agences': agences
+        'agences': references.listes_formulaire()['agences'],
+        'amorce': amorce,
     })
 
 
 @login_required
+@condition(etag_func=lambda request: etag_appels_offre(request))
 def get_projets_ca(request):
-    """Retourne tous les projets pour l'interface CA avec TOUTES les données de l'AO original"""
+    """Retourne les projets pour l'interface CA, sans les textes longs (voir ``get_projet_ca``).
+
+    ``?fields=id,reference,etape,...`` restreint la réponse (et les colonnes lues)
+    aux clés de ``CHAMPS_PROJET_CA``, textes longs compris s'ils sont demandés.
+    """
     try:
-        # Récupérer les appels d'offre gagnés qui sont devenus des projets CA
-        projets = AppelOffre.objects.filter(
-            statut='gagne'
-        ).select_related('agence', 'responsable_ca', 'commercial', 'agence_terrain', 'agence_traitement',
-                         'responsable_prod_terrain', 'responsable_prod_traitement').prefetch_related('prestations')
-
-        projets_data = []
-        for projet in projets:
-            # Utiliser la méthode du modèle pour déterminer l'étape
-            etape = get_etape_projet(projet)
-
-            # Déterminer le responsable prod selon l'étape avec vérification
-            responsable_prod_display = 'Non assigné'
-            responsable_prod_terrain_display = 'Non assigné'
-            responsable_prod_traitement_display = 'Non assigné'
-
-            # Afficher les responsables selon leur assignation
-            if projet.responsable_prod_terrain:
-                responsable_prod_terrain_display = f"{projet.responsable_prod_terrain.prenoms} {projet.responsable_prod_terrain.nom}"
-            if projet.responsable_prod_traitement:
-                responsable_prod_traitement_display = f"{projet.responsable_prod_traitement.prenoms} {projet.responsable_prod_traitement.nom}"
-
-            # Déterminer le responsable à afficher selon l'étape
-            if etape in ['AO Gagné', 'Terrain France', 'Terrain France terminé']:
-                responsable_prod_display = responsable_prod_terrain_display
-            elif etape in ['Traitement France', 'Prêt pour envoi Mada']:
-                responsable_prod_display = responsable_prod_traitement_display or responsable_prod_terrain_display
-            else:
-                responsable_prod_display = responsable_prod_traitement_display or responsable_prod_terrain_display
-
-            # Récupérer les prestations originales
-            prestations = [prestation.nom for prestation in projet.prestations.all()]
-
-            projets_data.append({
-                'id': projet.id,
-                'reference': projet.reference,
-                'nom_affaire': projet.nom_affaire or projet.reference,
-                'agence': projet.agence.nom,
-
-                # AJOUT: Inclure le champ probleme_confirme
-                'probleme_confirme': getattr(projet, 'probleme_confirme', False),
-
-                # Période AO Gagné
-                'date_debut_ao': projet.date_debut.isoformat() if projet.date_debut else None,
-                'date_fin_ao': projet.date_fin.isoformat() if projet.date_fin else None,
-                'date_fin_reelle_ao': projet.date_fin_reelle.isoformat() if projet.date_fin_reelle else None,
-
-                # Période Terrain France (si existante)
-                'date_debut_terrain': projet.date_debut_terrain.isoformat() if projet.date_debut_terrain else None,
-                'date_fin_prevue_terrain': projet.date_fin_prevue_terrain.isoformat() if projet.date_fin_prevue_terrain else None,
-                'date_fin_terrain_reelle': projet.date_fin_terrain_reelle.isoformat() if projet.date_fin_terrain_reelle else None,
-
-                # Agence Terrain
-                'agence_terrain': {
-                    'id': projet.agence_terrain.id if projet.agence_terrain else None,
-                    'nom': projet.agence_terrain.nom if projet.agence_terrain else None
-                },
-
-                # Période Traitement France (si existante)
-                'date_debut_traitement': projet.date_debut_traitement.isoformat() if projet.date_debut_traitement else None,
-                'date_fin_prevue_traitement': projet.date_fin_prevue_traitement.isoformat() if projet.date_fin_prevue_traitement else None,
-                'date_fin_traitement_reelle': projet.date_fin_traitement_reelle.isoformat() if projet.date_fin_traitement_reelle else None,
-
-                # Agence Traitement
-                'agence_traitement': {
-                    'id': projet.agence_traitement.id if projet.agence_traitement else None,
-                    'nom': projet.agence_traitement.nom if projet.agence_traitement else None
-                },
-
-                # Envoi Mada
-                'date_envoi_mada': projet.date_envoi_mada.isoformat() if projet.date_envoi_mada else None,
-                'date_livraison_prevue_mada': projet.date_livraison_prevue_mada.isoformat() if projet.date_livraison_prevue_mada else None,
-                'date_livraison_reelle_mada': projet.date_livraison_reelle_mada.isoformat() if projet.date_livraison_reelle_mada else None,
-                'info_supplementaire_mada': projet.info_supplementaire_mada,
-
-                'prestations': prestations,
-                'description': projet.description,
-                'commentaire_arret': projet.commentaire_arret,
-                'commentaire_fin_terrain': projet.commentaire_fin_terrain,
-                'commentaire_fin_traitement': projet.commentaire_fin_traitement,
-                'commentaire_fin_reprise': projet.commentaire_fin_reprise,
-                'commentaire_fin_prod_mada': projet.commentaire_fin_prod_mada,
-
-                'historique_commentaires': getattr(projet, 'historique_commentaires', []),
-
-                'responsable_prod': responsable_prod_display,
-                'responsable_prod_terrain': responsable_prod_terrain_display,
-                'responsable_prod_traitement': responsable_prod_traitement_display,
-                'etape': etape,
-                'couleur': projet.couleur,
-                'commercial': f"{projet.commercial.prenoms} {projet.commercial.nom}",
-                'responsable_ca': f"{projet.responsable_ca.prenoms} {projet.responsable_ca.nom}",
-                'date_creation': projet.created_at.isoformat(),
-            })
+        return JsonResponse(donnees_tableau(request, CHAMPS_PROJET_CA, CLES_LISTE_CA, 'etape_ca'))
+    except ValueError as e:
+        # Paramètres invalides (fields, cursor, limit, since, dates) ; le reste est une erreur serveur
+        return JsonResponse({'error': str(e)}, status=400)
 
-        return JsonResponse({'projets': projets_data})
 
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=400)
+def responsable_prod_ca(projet):
+    """Responsable prod affiché selon l'étape : terrain au début, traitement ensuite"""
+    if projet.etape_ca in ['ao_gagne', 'terrain_france']:
+        return nom_complet(projet.responsable_prod_terrain, 'Non assigné')
+    return nom_complet(projet.responsable_prod_traitement, 'Non assigné')
+
+
+# Clés du tableau CA (?fields=) : colonnes lues et sérialisation de chaque clé
+CHAMPS_PROJET_CA = {
+    'id': Champ(['id'], lambda p: p.id),
+    'reference': Champ(['reference'], lambda p: p.reference),
+    'nom_affaire': Champ(['nom_affaire', 'reference'], lambda p: p.nom_affaire or p.reference),
+    'agence': Champ(['agence__nom'], lambda p: p.agence.nom),
+    'probleme_confirme': Champ(['probleme_confirme'], lambda p: p.probleme_confirme),
+
+    # Période AO Gagné
+    'date_debut_ao': Champ(['date_debut'], lambda p: iso(p.date_debut)),
+    'date_fin_ao': Champ(['date_fin'], lambda p: iso(p.date_fin)),
+    'date_fin_reelle_ao': Champ(['date_fin_reelle'], lambda p: iso(p.date_fin_reelle)),
+
+    # Terrain France
+    'date_debut_terrain': Champ(['date_debut_terrain'], lambda p: iso(p.date_debut_terrain)),
+    'date_fin_prevue_terrain': Champ(['date_fin_prevue_terrain'], lambda p: iso(p.date_fin_prevue_terrain)),
+    'date_fin_terrain_reelle': Champ(['date_fin_terrain_reelle'], lambda p: iso(p.date_fin_terrain_reelle)),
+    'agence_terrain': Champ(['agence_terrain__nom'], lambda p: {
+        'id': p.agence_terrain.id if p.agence_terrain else None,
+        'nom': p.agence_terrain.nom if p.agence_terrain else None
+    }),
+
+    # Traitement France
+    'date_debut_traitement': Champ(['date_debut_traitement'], lambda p: iso(p.date_debut_traitement)),
+    'date_fin_prevue_traitement': Champ(['date_fin_prevue_traitement'],
+                                        lambda p: iso(p.date_fin_prevue_traitement)),
+    'date_fin_traitement_reelle': Champ(['date_fin_traitement_reelle'],
+                                        lambda p: iso(p.date_fin_traitement_reelle)),
+    'agence_traitement': Champ(['agence_traitement__nom'], lambda p: {
+        'id': p.agence_traitement.id if p.agence_traitement else None,
+        'nom': p.agence_traitement.nom if p.agence_traitement else None
+    }),
+
+    # Envoi Mada
+    'date_envoi_mada': Champ(['date_envoi_mada'], lambda p: iso(p.date_envoi_mada)),
+    'date_livraison_prevue_mada': Champ(['date_livraison_prevue_mada'],
+                                        lambda p: iso(p.date_livraison_prevue_mada)),
+    'date_livraison_reelle_mada': Champ(['date_livraison_reelle_mada'],
+                                        lambda p: iso(p.date_livraison_reelle_mada)),
+    'info_supplementaire_mada': Champ(['info_supplementaire_mada'], lambda p: p.info_supplementaire_mada),
+
+    'prestations': Champ([], lambda p: [prestation.nom for prestation in p.prestations.all()], ['prestations']),
+    'description': Champ(['description'], lambda p: p.description),
+    'commentaire_arret': Champ(['commentaire_arret'], lambda p: p.commentaire_arret),
+    'commentaire_fin_terrain': Champ(['commentaire_fin_terrain'], lambda p: p.commentaire_fin_terrain),
+    'commentaire_fin_traitement': Champ(['commentaire_fin_traitement'], lambda p: p.commentaire_fin_traitement),
+    'commentaire_fin_reprise': Champ(['commentaire_fin_reprise'], lambda p: p.commentaire_fin_reprise),
+    'commentaire_fin_prod_mada': Champ(['commentaire_fin_prod_mada'], lambda p: p.commentaire_fin_prod_mada),
+
+    'historique_commentaires': Champ([], lambda p: [serialiser_evenement(e) for e in p.evenements.all()], [
+        Prefetch('evenements', queryset=AppelOffreEvent.objects.select_related('auteur'))
+    ]),
+
+    'responsable_prod': Champ(['etape_ca', 'responsable_prod_terrain__prenoms', 'responsable_prod_terrain__nom',
+                               'responsable_prod_traitement__prenoms', 'responsable_prod_traitement__nom'],
+                              responsable_prod_ca),
+    'responsable_prod_terrain': Champ(['responsable_prod_terrain__prenoms', 'responsable_prod_terrain__nom'],
+                                      lambda p: nom_complet(p.responsable_prod_terrain, 'Non assigné')),
+    'responsable_prod_traitement': Champ(['responsable_prod_traitement__prenoms', 'responsable_prod_traitement__nom'],
+                                         lambda p: nom_complet(p.responsable_prod_traitement, 'Non assigné')),
+    # Étape stockée, maintenue à jour par AppelOffre.save()
+    'etape': Champ(['etape_ca'], lambda p: p.get_etape_ca_display()),
+    'couleur': Champ(['couleur'], lambda p: p.couleur),
+    'commercial': Champ(['commercial__prenoms', 'commercial__nom'], lambda p: nom_complet(p.commercial)),
+    'responsable_ca': Champ(['responsable_ca__prenoms', 'responsable_ca__nom'],
+                            lambda p: nom_complet(p.responsable_ca)),
+    'date_creation': Champ(['created_at'], lambda p: p.created_at.isoformat()),
+    # À renvoyer avec les actions du workflow (verrou optimiste, 409 si le projet a changé)
+    'version': Champ(['version'], lambda p: p.version),
+}
+
+# Textes longs et historique : affichés seulement dans la fenêtre de détail d'un projet
+CLES_DETAIL_CA = ['description', 'commentaire_arret', 'commentaire_fin_terrain', 'commentaire_fin_traitement',
+                  'commentaire_fin_reprise', 'commentaire_fin_prod_mada', 'info_supplementaire_mada',
+                  'historique_commentaires']
+CLES_LISTE_CA = [cle for cle in CHAMPS_PROJET_CA if cle not in CLES_DETAIL_CA]
 
 
-def get_etape_projet(projet):
-    """Détermine l'étape actuelle d'un projet"""
-    if projet.statut != 'gagne':
-        return 'Non gagné'
-
-    # Récupérer les étapes avec getattr pour éviter les erreurs
-    etape_terrain = getattr(projet, 'etape_terrain_france', 'en_attente')
-    etape_traitement = getattr(projet, 'etape_traitement_france', 'en_attente')
-    etape_envoi_mada = getattr(projet, 'etape_envoi_mada', 'en_attente')
-    date_reception_france = getattr(projet, 'date_reception_france', None)
-    etape_reprise = getattr(projet, 'etape_reprise_france', 'en_attente')
-    etape_prod = getattr(projet, 'etape_prod_mada', 'en_attente')
-    commentaire_fin_reprise = getattr(projet, 'commentaire_fin_reprise', '')
-    probleme_confirme = getattr(projet, 'probleme_confirme', False)
-
-    print(f"Debug CA {projet.reference}: envoi={etape_envoi_mada}, date_reception={date_reception_france}, probleme_confirme={probleme_confirme}")
-
-    if etape_terrain == 'en_attente':
-        return 'AO Gagné'
-    elif etape_terrain == 'en_cours':
-        return 'Terrain France'
-    elif etape_terrain == 'termine' and etape_traitement == 'en_attente':
-        return 'Traitement France'
-    elif etape_traitement == 'en_cours':
-        return 'Traitement France en cours'
-    elif etape_traitement == 'termine' and etape_envoi_mada == 'en_attente':
-        return 'Prêt pour envoi Mada'
-
-    # CORRECTION : Logique simplifiée pour l'envoi Mada
-    elif etape_envoi_mada == 'en_cours' and not date_reception_france:
-        if commentaire_fin_reprise:
-            return 'Problème de réception'  # Non reçu, prêt pour ré-envoi
-        else:
-            return 'Envoi des données à Mada'  # En cours d'envoi initial
-
-    elif etape_envoi_mada == 'termine' and date_reception_france and etape_reprise in [None, 'en_attente']:
-        return 'Reprise des données France'
-    elif date_reception_france and etape_reprise in [None, 'en_attente']:
-        return 'Reprise des données France'
-    elif etape_reprise == 'en_cours':
-        return 'Reprise des données France'
-    elif etape_reprise == 'termine' and etape_prod in [None, 'en_attente']:
-        return 'Prod en cours Mada'
-    elif etape_prod == 'en_cours':
-        return 'Prod en cours Mada'
-    elif etape_prod == 'termine':
-        return 'Production terminée'
-    else:
-        return 'En attente'
+@login_required
+@condition(etag_func=lambda request, projet_id: etag_appels_offre(request, pk=projet_id))
+def get_projet_ca(request, projet_id):
+    """Fiche complète d'un projet CA, historique excepté (voir ``get_projet_historique``)"""
+    try:
+        cles = projection.champs_demandes(
+            request, CHAMPS_PROJET_CA, [cle for cle in CHAMPS_PROJET_CA if cle != 'historique_commentaires']
+        )
+    except projection.ChampsInvalides as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    projet = projection.projeter(AppelOffre.objects.filter(statut='gagne'), CHAMPS_PROJET_CA, cles).filter(
+        pk=projet_id
+    ).first()
+    if projet is None:
+        return JsonResponse({'error': 'Projet non trouvé'}, status=404)
+    return JsonResponse({'projet': projection.serialiser(projet, CHAMPS_PROJET_CA, cles)})
 
 
 @login_required
-def get_agences_couleurs_ca(request):
-    """Retourne les couleurs des agences pour l'interface CA"""
-    agences = Agence.objects.all().values('nom', 'couleur')
-    couleurs = {agence['nom']: agence['couleur'] for agence in agences}
-    return JsonResponse({'couleurs': couleurs})
+@condition(etag_func=lambda request, projet_id: etag_appels_offre(request, pk=projet_id))
+def get_projet_historique(request, projet_id):
+    """Historique d'un projet, du plus récent au plus ancien, paginé par ``?limit=&cursor=``"""
+    if not AppelOffre.objects.filter(pk=projet_id, statut='gagne').exists():
+        return JsonResponse({'error': 'Projet non trouvé'}, status=404)
+
+    evenements = AppelOffreEvent.objects.filter(projet_id=projet_id).select_related('auteur')
+    try:
+        evenements, next_cursor = pagination.paginer(evenements, request, champ='date',
+                                                     limite_defaut=LIMITE_HISTORIQUE)
+    except pagination.CurseurInvalide as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'historique': [serialiser_evenement(evenement) for evenement in evenements],
+        'next_cursor': next_cursor,
+    })
+
 
+def filtrer_projets(projets, request, champ_etape):
+    """Applique les filtres serveur communs aux tableaux CA et PROD.
+
+    Paramètres GET acceptés : agence, agence_terrain, etape (répétable, codes
+    de ``champ_etape``), responsable_ca, responsable_prod, et la fenêtre
+    du/au (AAAA-MM-JJ) sur la date de début de l'AO.
+    """
+    params = request.GET
+    if params.get('agence'):
+        projets = projets.filter(agence_id=int(params['agence']))
+    if params.get('agence_terrain'):
+        projets = projets.filter(agence_terrain_id=int(params['agence_terrain']))
+    etapes = params.getlist('etape')
+    if etapes:
+        projets = projets.filter(**{f'{champ_etape}__in': etapes})
+    if params.get('responsable_ca'):
+        projets = projets.filter(responsable_ca_id=int(params['responsable_ca']))
+    if params.get('responsable_prod'):
+        responsable_id = int(params['responsable_prod'])
+        projets = projets.filter(
+            models.Q(responsable_prod_terrain_id=responsable_id) | models.Q(responsable_prod_traitement_id=responsable_id)
+        )
+    if params.get('du'):
+        projets = projets.filter(date_debut__gte=datetime.strptime(params['du'], '%Y-%m-%d').date())
+    if params.get('au'):
+        projets = projets.filter(date_debut__lte=datetime.strptime(params['au'], '%Y-%m-%d').date())
+    return projets
+
+
+def donnees_tableau(request, champs, defaut, champ_etape):
+    """Réponse des tableaux CA/PROD : projets gagnés projetés sur ``?fields=`` (``defaut`` sinon),
+    filtrés, éventuellement paginés, ou seulement le delta si ``?since=`` est fourni.
+    """
+    cles = projection.champs_demandes(request, champs, defaut)
+    # Récupérer les appels d'offre gagnés qui sont devenus des projets
+    projets = projection.projeter(AppelOffre.objects.filter(statut='gagne'), champs, cles)
+
+    def serialiser(projet):
+        return projection.serialiser(projet, champs, cles)
+
+    if request.GET.get('since'):
+        return delta_projets(projets, request, champ_etape, serialiser)
+
+    since = horodatage_synchronisation()
+    projets = filtrer_projets(projets, request, champ_etape)
+
+    next_cursor = None
+    if pagination.pagination_demandee(request):
+        projets, next_cursor = pagination.paginer(projets, request)
+
+    return {'projets': [serialiser(projet) for projet in projets], 'next_cursor': next_cursor, 'since': since}
+
+
+def delta_projets(projets, request, champ_etape, serialiser):
+    """Mode ?since= des tableaux : projets modifiés depuis l'horodatage donné.
+
+    ``projets`` contient les projets modifiés toujours présents sur le tableau
+    (filtres compris), ``supprimes`` les identifiants à retirer côté client :
+    projets sortis du tableau ou supprimés. ``since`` est la valeur à renvoyer
+    au prochain appel (légèrement antérieure à maintenant pour ne pas rater
+    une transaction encore en cours) ; les réponses complètes la fournissent
+    aussi pour amorcer la synchronisation.
+    """
+    since = parse_datetime(request.GET['since'].replace(' ', '+'))  # '+' non encodé dans l'URL
+    if since is None:
+        raise ValueError("Paramètre since invalide (format ISO 8601 attendu)")
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    if since < AppelOffreSuppression.limite_conservation():
+        # Les traces de suppression antérieures ont pu être purgées : le delta serait incomplet
+        raise ValueError("Paramètre since trop ancien : rechargez le tableau complet")
+    prochain_since = horodatage_synchronisation()
+
+    modifies_ids = set(AppelOffre.objects.filter(updated_at__gt=since).values_list('id', flat=True))
+    presents = list(filtrer_projets(projets.filter(id__in=modifies_ids), request, champ_etape))
+    supprimes = modifies_ids - {projet.id for projet in presents}
+    supprimes.update(
+        AppelOffreSuppression.objects.filter(date_suppression__gt=since).values_list('projet_id', flat=True)
+    )
+
+    return {
+        'projets': [serialiser(projet) for projet in presents],
+        'supprimes': sorted(supprimes),
+        'since': prochain_since,
+    }
+
+
+def horodatage_synchronisation():
+    """Valeur ``since`` à utiliser pour le prochain appel incrémental d'un tableau"""
+    return (timezone.now() - DELTA_CHEVAUCHEMENT).isoformat()
+
+
+def serialiser_evenement(evenement):
+    """Format historique (date, commentaire, type) attendu par le tableau CA"""
+    return {
+        'date': evenement.date.date().isoformat(),
+        'type': evenement.type,
+        'auteur': str(evenement.auteur) if evenement.auteur_id else None,
+        **evenement.payload
+    }
 
 
 @csrf_exempt
@@ -607,6 +714,7 @@ def commencer_terrain_france(request):
 
             # Récupérer l'appel d'offre/projet
             projet = AppelOffre.objects.get(id=projet_id, statut='gagne')
+            workflow.verifier_transition('commencer_terrain_france', projet)
 
             # Validation des dates
             date_debut = datetime.strptime(data['date_debut'], '%Y-%m-%d').date()
@@ -623,10 +731,15 @@ def commencer_terrain_france(request):
             projet.responsable_prod_terrain_id = data['responsable_prod_id']  # CORRECTION ICI
             projet.etape_terrain_france = 'en_cours'
             projet.date_debut_terrain_reelle = date.today()
-            projet.save()
+            projet.enregistrer_transition([
+                'nom_affaire', 'date_debut_terrain', 'date_fin_prevue_terrain', 'agence_terrain',
+                'responsable_prod_terrain', 'etape_terrain_france',
+            ], data.get('version'))
 
             return JsonResponse({'success': True})
 
+        except ModificationConcurrente as e:
+            return JsonResponse({'error': str(e)}, status=409)
         except AppelOffre.DoesNotExist:
             return JsonResponse({'error': 'Projet non trouvé'}, status=404)
         except Exception as e:
@@ -645,16 +758,21 @@ def fin_terrain_france(request, projet_id):
             commentaire = data.get('commentaire', '')
 
             projet = AppelOffre.objects.get(id=projet_id, statut='gagne')
+            workflow.verifier_transition('fin_terrain_france', projet)
 
             # Marquer le terrain France comme terminé et passer à Traitement France
             projet.etape_terrain_france = 'termine'
             projet.etape_traitement_france = 'en_attente'  # Nouvelle étape
             projet.date_fin_terrain_reelle = date.today()
             projet.commentaire_fin_terrain = commentaire
-            projet.save()
+            projet.enregistrer_transition([
+                'etape_terrain_france', 'etape_traitement_france', 'date_fin_terrain_reelle', 'commentaire_fin_terrain',
+            ], data.get('version'))
 
             return JsonResponse({'success': True})
 
+        except ModificationConcurrente as e:
+            return JsonResponse({'error': str(e)}, status=409)
         except AppelOffre.DoesNotExist:
             return JsonResponse({'error': 'Projet non trouvé'}, status=404)
         except Exception as e:
@@ -673,6 +791,7 @@ def commencer_traitement_france(request):
             projet_id = data['projet_id']
 
             projet = AppelOffre.objects.get(id=projet_id, statut='gagne')
+            workflow.verifier_transition('commencer_traitement_france', projet)
 
             # Validation des dates
             date_debut = datetime.strptime(data['date_debut'], '%Y-%m-%d').date()
@@ -689,10 +808,15 @@ def commencer_traitement_france(request):
             projet.responsable_prod_traitement_id = data['responsable_prod_id']  # Déjà correct
             projet.etape_traitement_france = 'en_cours'
             projet.date_debut_traitement_reelle = date.today()
-            projet.save()
+            projet.enregistrer_transition([
+                'nom_affaire_traitement', 'date_debut_traitement', 'date_fin_prevue_traitement', 'agence_traitement',
+                'responsable_prod_traitement', 'etape_traitement_france',
+            ], data.get('version'))
 
             return JsonResponse({'success': True})
 
+        except ModificationConcurrente as e:
+            return JsonResponse({'error': str(e)}, status=409)
         except AppelOffre.DoesNotExist:
             return JsonResponse({'error': 'Projet non trouvé'}, status=404)
         except Exception as e:
@@ -711,16 +835,22 @@ def fin_traitement_france(request, projet_id):
             commentaire = data.get('commentaire', '')
 
             projet = AppelOffre.objects.get(id=projet_id, statut='gagne')
+            workflow.verifier_transition('fin_traitement_france', projet)
 
             # Marquer le traitement France comme terminé ET préparer Envoi Mada
             projet.etape_traitement_france = 'termine'
             projet.etape_envoi_mada = 'en_attente'  # ← AJOUT : Prépare la phase suivante
             projet.date_fin_traitement_reelle = date.today()
             projet.commentaire_fin_traitement = commentaire
-            projet.save()
+            projet.enregistrer_transition([
+                'etape_traitement_france', 'etape_envoi_mada', 'date_fin_traitement_reelle',
+                'commentaire_fin_traitement',
+            ], data.get('version'))
 
             return JsonResponse({'success': True})
 
+        except ModificationConcurrente as e:
+            return JsonResponse({'error': str(e)}, status=409)
         except AppelOffre.DoesNotExist:
             return JsonResponse({'error': 'Projet non trouvé'}, status=404)
         except Exception as e:
@@ -739,6 +869,7 @@ def envoyer_donnees_mada(request):
             projet_id = data['projet_id']
 
             projet = AppelOffre.objects.get(id=projet_id, statut='gagne')
+            workflow.verifier_transition('envoyer_donnees_mada', projet)
 
             # Validation des dates
             date_envoi = datetime.strptime(data['date_envoi'], '%Y-%m-%d').date()
@@ -748,34 +879,38 @@ def envoyer_donnees_mada(request):
                 return JsonResponse({'error': 'La date de livraison doit être postérieure à la date d\'envoi'},
                                     status=400)
 
-            # SAUVEGARDER L'ANCIEN COMMENTAIRE DANS L'HISTORIQUE SI EXISTANT
-            if projet.commentaire_fin_reprise and projet.commentaire_fin_reprise.strip():
-                if not hasattr(projet, 'historique_commentaires'):
-                    projet.historique_commentaires = []
-
-                historique_entry = {
-                    'date': date.today().isoformat(),
-                    'commentaire': projet.commentaire_fin_reprise,
-                    'type': 'avant_reenvoi',
-                    'etape_envoi_mada': projet.etape_envoi_mada
-                }
-                projet.historique_commentaires.append(historique_entry)
-
-            # Réinitialiser pour nouvel envoi
-            projet.date_envoi_mada = date_envoi
-            projet.date_livraison_prevue_mada = date_livraison
-            projet.info_supplementaire_mada = data.get('info_supplementaire', '')
-            projet.etape_envoi_mada = 'en_cours'
-            projet.date_reception_france = None
-            projet.etape_reprise_france = 'en_attente'
-            projet.commentaire_fin_reprise = ''  # Vider pour nouvel envoi
-            projet.probleme_confirme = False
-            projet.save()
+            with transaction.atomic():
+                # SAUVEGARDER L'ANCIEN COMMENTAIRE DANS L'HISTORIQUE SI EXISTANT
+                if projet.commentaire_fin_reprise and projet.commentaire_fin_reprise.strip():
+                    projet.evenements.create(
+                        type='avant_reenvoi',
+                        auteur=request.user,
+                        payload={
+                            'commentaire': projet.commentaire_fin_reprise,
+                            'etape_envoi_mada': projet.etape_envoi_mada
+                        }
+                    )
+
+                # Réinitialiser pour nouvel envoi
+                projet.date_envoi_mada = date_envoi
+                projet.date_livraison_prevue_mada = date_livraison
+                projet.info_supplementaire_mada = data.get('info_supplementaire', '')
+                projet.etape_envoi_mada = 'en_cours'
+                projet.date_reception_france = None
+                projet.etape_reprise_france = 'en_attente'
+                projet.commentaire_fin_reprise = ''  # Vider pour nouvel envoi
+                projet.probleme_confirme = False
+                projet.enregistrer_transition([
+                    'date_envoi_mada', 'date_livraison_prevue_mada', 'info_supplementaire_mada', 'etape_envoi_mada',
+                    'date_reception_france', 'etape_reprise_france', 'commentaire_fin_reprise', 'probleme_confirme',
+                ], data.get('version'))
 
-            print(f"Envoi Mada - Projet {projet.reference} : nouvel envoi, historique préservé")
+            logger.info("Envoi Mada - Projet %s : nouvel envoi, historique préservé", projet.reference)
 
             return JsonResponse({'success': True})
 
+        except ModificationConcurrente as e:
+            return JsonResponse({'error': str(e)}, status=409)
         except AppelOffre.DoesNotExist:
             return JsonResponse({'error': 'Projet non trouvé'}, status=404)
         except Exception as e:
@@ -784,68 +919,144 @@ def envoyer_donnees_mada(request):
     return JsonResponse({'error': 'Méthode non autorisée'}, status=405)
 
 
+@csrf_exempt
+@login_required
+def appliquer_transitions(request):
+    """Applique un lot d'actions CA/PROD en une transaction, avec un résultat par élément"""
+    if request.method == 'POST':
+        try:
+            elements = json.loads(request.body)
+            if not isinstance(elements, list):
+                return JsonResponse({'error': 'Liste de transitions attendue'}, status=400)
+            if len(elements) > transitions.TAILLE_MAX_LOT:
+                return JsonResponse({'error': f'Lot limité à {transitions.TAILLE_MAX_LOT} transitions'}, status=400)
+
+            resultats = transitions.appliquer(elements, request.user)
+            return JsonResponse({
+                'success': True,
+                'appliquees': sum(resultat['success'] for resultat in resultats),
+                'resultats': resultats,
+            })
+
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({'error': 'Méthode non autorisée'}, status=405)
+
+
 @login_required
 def get_projets_en_retard_ca(request):
     """Retourne les projets en retard pour l'interface CA"""
-    today = date.today()
-
-    projets_retard = AppelOffre.objects.filter(
-        statut='gagne'
-    ).select_related('agence')
-
-    projets_retard_data = []
-
-    for projet in projets_retard:
-        retard = False
-        jours_retard = 0
-
-        # Vérifier selon l'étape
-        if projet.etape_terrain_france == 'en_cours' and projet.date_fin_prevue_terrain and projet.date_fin_prevue_terrain < today:
-            retard = True
-            jours_retard = (today - projet.date_fin_prevue_terrain).days
-        elif projet.etape_traitement_france == 'en_cours' and projet.date_fin_prevue_traitement and projet.date_fin_prevue_traitement < today:
-            retard = True
-            jours_retard = (today - projet.date_fin_prevue_traitement).days
-        elif projet.etape_envoi_mada == 'en_cours' and projet.date_livraison_prevue_mada and projet.date_livraison_prevue_mada < today:
-            retard = True
-            jours_retard = (today - projet.date_livraison_prevue_mada).days
-
-        if retard:
-            projets_retard_data.append({
-                'reference': projet.reference,
-                'nom_affaire': getattr(projet, 'nom_affaire', projet.reference),
-                'agence': projet.agence.nom,
-                'etape': get_etape_projet(projet),
-                'jours_retard': jours_retard
-            })
+    libelles = dict(workflow.ETAPE_CA_CHOICES)
+    projets_retard = AppelOffre.objects.en_retard().order_by('-jours_retard', 'id').values(
+        'reference', 'nom_affaire', 'agence__nom', 'etape_ca', 'jours_retard'
+    )
+
+    projets_retard_data = [{
+        'reference': projet['reference'],
+        'nom_affaire': projet['nom_affaire'],
+        'agence': projet['agence__nom'],
+        'etape': libelles[projet['etape_ca']],
+        'jours_retard': projet['jours_retard']
+    } for projet in projets_retard]
 
     return JsonResponse({'projets_retard': projets_retard_data})
 
 
 
+@login_required
+@condition(etag_func=lambda request: calculer_etag(request, etag_appels_offre(request), timezone.localdate()))
+def get_gantt(request):
+    """Barres du Gantt CA pour la fenêtre ?start=&end= (AAAA-MM-JJ), filtrable par ?agence=<id>.
+
+    Seules les phases qui chevauchent la fenêtre sont lues (index GiST de
+    ProjetPhase). Chaque barre est déjà coupée à la fenêtre : ``debut`` est son
+    décalage en jours depuis ``start`` et ``duree`` sa longueur en jours.
+    """
+    try:
+        debut = datetime.strptime(request.GET['start'], '%Y-%m-%d').date()
+        fin = datetime.strptime(request.GET['end'], '%Y-%m-%d').date()
+        agence_id = int(request.GET['agence']) if request.GET.get('agence') else None
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Paramètres start et end requis (AAAA-MM-JJ)'}, status=400)
+    if fin < debut:
+        return JsonResponse({'error': 'La fin de la fenêtre précède son début'}, status=400)
+
+    phases = ProjetPhase.objects.chevauchant(debut, fin).avec_terminee().filter(projet__statut='gagne')
+    if agence_id:
+        phases = phases.filter(projet__agence_id=agence_id)
+    phases = phases.order_by('projet__date_debut', 'projet_id', 'date_debut', 'id').values(
+        'projet_id', 'projet__reference', 'projet__nom_affaire', 'projet__etape_ca',
+        'projet__agence__nom', 'projet__agence__couleur',
+        'phase', 'date_debut', 'date_fin_prevue', 'date_fin_reelle', 'terminee',
+    )
+
+    aujourd_hui = timezone.localdate()
+    libelles_etapes = dict(workflow.ETAPE_CA_CHOICES)
+    libelles_phases = dict(workflow.PHASE_CHOICES)
+    projets = []
+    for projet_id, lignes in itertools.groupby(phases, key=lambda ligne: ligne['projet_id']):
+        lignes = list(lignes)
+        projet = lignes[0]
+        barres = []
+        for ligne in lignes:
+            fin_phase = ligne['date_fin_reelle'] or ligne['date_fin_prevue'] or ligne['date_debut']
+            fin_phase = max(fin_phase, ligne['date_debut'])  # même règle que PeriodePhase
+            debut_visible, fin_visible = max(ligne['date_debut'], debut), min(fin_phase, fin)
+            barres.append({
+                'phase': ligne['phase'],
+                'libelle': libelles_phases[ligne['phase']],
+                'date_debut': ligne['date_debut'].isoformat(),
+                'date_fin': fin_phase.isoformat(),
+                'debut': (debut_visible - debut).days,
+                'duree': (fin_visible - debut_visible).days + 1,
+                # Même règle que ProjetPhase.objects.en_retard() (récapitulatif des retards)
+                'en_retard': bool(not ligne['terminee'] and ligne['date_fin_prevue']
+                                  and ligne['date_fin_prevue'] < aujourd_hui),
+                'couleur': projet['projet__agence__couleur'],
+            })
+        projets.append({
+            'id': projet_id,
+            'reference': projet['projet__reference'],
+            'nom_affaire': projet['projet__nom_affaire'],
+            'agence': projet['projet__agence__nom'],
+            'etape': libelles_etapes[projet['projet__etape_ca']],
+            'barres': barres,
+        })
+
+    return JsonResponse({'start': debut.isoformat(), 'end': fin.isoformat(), 'projets': projets})
+
+
+
+@login_required
+@condition(etag_func=lambda request: etag_appels_offre(request))
+def get_calendrier_ca(request):
+    """Événements du calendrier CA pour ?mois=AAAA-MM, regroupés et plafonnés par jour.
+
+    Paramètres optionnels : limite (événements détaillés par jour) et agence (id).
+    """
+    try:
+        annee, mois = (int(partie) for partie in request.GET['mois'].split('-'))
+        limite = min(max(int(request.GET.get('limite', calendrier.LIMITE_DEFAUT)), 1), calendrier.LIMITE_MAX)
+        agence_id = int(request.GET['agence']) if request.GET.get('agence') else None
+        jours = calendrier.evenements_du_mois(annee, mois, limite, agence_id)
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Paramètre mois requis (AAAA-MM)'}, status=400)
+
+    return JsonResponse({'mois': f'{annee:04d}-{mois:02d}', 'limite': limite, 'jours': jours})
+
+
+
 ##############################################
 #####################PROD#####################
 ##############################################
 
 @login_required
+@condition(etag_func=lambda request: etag_tables(request, 'user', 'agence', 'poste'))
 def get_responsables_prod(request):
     """Retourne la liste des responsables production"""
     try:
-        responsables = User.objects.filter(
-            poste__nom='PROD'
-        ).select_related('agence', 'poste')
-
-        responsables_data = []
-        for responsable in responsables:
-            responsables_data.append({
-                'id': responsable.id,
-                'prenoms': responsable.prenoms,
-                'nom': responsable.nom,
-                'pseudo': responsable.pseudo,
-                'agence': responsable.agence.nom if responsable.agence else 'Non assigné'
-            })
-
-        return JsonResponse({'responsables': responsables_data})
+        return JsonResponse({'responsables': references.responsables_prod()})
 
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=400)
@@ -853,18 +1064,25 @@ def get_responsables_prod(request):
 
 @login_required
 def interface_prod(request):
-    if not request.user.poste or request.user.poste.nom != 'PROD':
+    if poste_utilisateur(request) != 'PROD':
         messages.error(request, "Vous n'avez pas accès à cette interface.")
         return redirect('profil')
 
-    agences = Agence.objects.all()  # Pour filtres
+    # Données du premier affichage, intégrées à la page (json_script) : aucun appel API au chargement
+    amorce = {
+        'projets': donnees_tableau(requete_amorce(request), CHAMPS_PROJET_PROD, list(CHAMPS_PROJET_PROD),
+                                   'etape_prod'),
+        'couleurs': references.couleurs_agences(),
+    }
 
     return render(request, 'Agences/interfaces/prod.html', {
-        'agences': agences
+        'agences': references.listes_formulaire()['agences'],  # Pour filtres
+        'amorce': amorce,
     })
 
 
 @csrf_exempt
+@condition(etag_func=lambda request: etag_tables(request, 'user', 'agence', 'poste', 'typeprestation'))
 def get_responsables_ca(request):
     if request.method == 'GET':
         try:
@@ -877,39 +1095,16 @@ def get_responsables_ca(request):
             if prestation_ids:
                 prestation_ids_list = [int(pid) for pid in prestation_ids.split(',') if pid.isdigit()]
 
-            # Filtrer les responsables CA
-            responsables_query = User.objects.filter(
-                poste__nom='CA'
-            ).select_related('agence', 'poste').prefetch_related('types_prestation')
+            # Filtrer les responsables CA (liste complète en cache)
+            responsables_data = references.responsables_ca()
 
             # Appliquer les filtres si des paramètres sont fournis
             if agence_id and agence_id.isdigit():
-                responsables_query = responsables_query.filter(agence_id=int(agence_id))
+                responsables_data = [r for r in responsables_data if r['agence']['id'] == int(agence_id)]
 
             if prestation_ids_list:
-                responsables_query = responsables_query.filter(types_prestation__id__in=prestation_ids_list).distinct()
-
-            responsables_data = []
-            for responsable in responsables_query:
-                prestations = [{
-                    'id': p.id,
-                    'nom': p.nom
-                } for p in responsable.types_prestation.all()]
-
-                responsables_data.append({
-                    'id': responsable.id,
-                    'prenoms': responsable.prenoms,
-                    'nom': responsable.nom,
-                    'pseudo': responsable.pseudo,
-                    'agence': {
-                        'id': responsable.agence.id if responsable.agence else None,
-                        'nom': responsable.agence.nom if responsable.agence else 'Non assigné'
-                    },
-                    'poste': {
-                        'nom': responsable.poste.get_nom_display() if responsable.poste else ''
-                    },
-                    'types_prestation': prestations
-                })
+                responsables_data = [r for r in responsables_data
+                                     if any(p['id'] in prestation_ids_list for p in r['types_prestation'])]
 
             return JsonResponse({'responsables': responsables_data})
 
@@ -919,137 +1114,45 @@ def get_responsables_ca(request):
     return JsonResponse({'error': 'Méthode non autorisée'}, status=405)
 
 
+# Clés du tableau PROD (?fields=) : colonnes lues et sérialisation de chaque clé
+CHAMPS_PROJET_PROD = {
+    'id': Champ(['id'], lambda p: p.id),
+    'reference': Champ(['reference'], lambda p: p.reference),
+    'nom_affaire': Champ(['nom_affaire'], lambda p: p.nom_affaire),
+    'agence': Champ(['agence__nom'], lambda p: p.agence.nom if p.agence else 'Agence inconnue'),
+    'date_envoi_mada': Champ(['date_envoi_mada'], lambda p: p.date_envoi_mada),
+    'date_livraison_prevue_mada': Champ(['date_livraison_prevue_mada'], lambda p: p.date_livraison_prevue_mada),
+    'info_supplementaire_mada': Champ(['info_supplementaire_mada'], lambda p: p.info_supplementaire_mada),
+    'commentaire_fin_reprise': Champ(['commentaire_fin_reprise'], lambda p: p.commentaire_fin_reprise),
+    'date_reception_france': Champ(['date_reception_france'], lambda p: p.date_reception_france),
+    'date_debut_reprise': Champ(['date_debut_reprise'], lambda p: p.date_debut_reprise),
+    'date_fin_prevue_reprise': Champ(['date_fin_prevue_reprise'], lambda p: p.date_fin_prevue_reprise),
+    'date_debut_prod_mada': Champ(['date_debut_prod_mada'], lambda p: p.date_debut_prod_mada),
+    'date_fin_prevue_prod_mada': Champ(['date_fin_prevue_prod_mada'], lambda p: p.date_fin_prevue_prod_mada),
+    'date_fin_prod_mada_reelle': Champ(['date_fin_prod_mada_reelle'], lambda p: p.date_fin_prod_mada_reelle),
+    'etape': Champ(['etape_prod'], lambda p: p.get_etape_prod_display()),
+    'couleur': Champ(['couleur'], lambda p: p.couleur),
+    'commercial': Champ(['commercial__prenoms', 'commercial__nom'],
+                        lambda p: nom_complet(p.commercial, 'Commercial inconnu')),
+    'responsable_ca': Champ(['responsable_ca__prenoms', 'responsable_ca__nom'],
+                            lambda p: nom_complet(p.responsable_ca, 'CA inconnu')),
+    'date_creation': Champ(['created_at'], lambda p: iso(p.created_at)),
+    'is_complement': Champ(['is_complement'], lambda p: p.is_complement),
+    'version': Champ(['version'], lambda p: p.version),
+}
+
+
 @login_required
+@condition(etag_func=lambda request: etag_appels_offre(request))
 def get_projets_prod(request):
-    """Retourne les projets pour l'interface PROD"""
+    """Retourne les projets pour l'interface PROD (``?fields=`` : clés de ``CHAMPS_PROJET_PROD``)"""
     try:
-        print("=== DEBUT get_projets_prod ===")
-
-        # Récupérer tous les projets gagnés pour PROD
-        projets = AppelOffre.objects.filter(
-            statut='gagne'
-        ).select_related('agence', 'responsable_ca', 'commercial').prefetch_related('prestations')
-
-        print(f"Nombre de projets trouvés: {projets.count()}")
-
-        projets_data = []
-        for projet in projets:
-            print(f"Traitement du projet: {projet.reference}")
-
-            try:
-                etape = get_etape_prod(projet)
-                print(f"Étape déterminée: {etape}")
-
-                projets_data.append({
-                    'id': projet.id,
-                    'reference': projet.reference,
-                    'nom_affaire': getattr(projet, 'nom_affaire', projet.reference),
-                    'agence': projet.agence.nom if projet.agence else 'Agence inconnue',
-                    'date_envoi_mada': getattr(projet, 'date_envoi_mada', None),
-                    'date_livraison_prevue_mada': getattr(projet, 'date_livraison_prevue_mada', None),
-                    'info_supplementaire_mada': getattr(projet, 'info_supplementaire_mada', ''),
-                    'commentaire_fin_reprise': getattr(projet, 'commentaire_fin_reprise', ''),
-                    'date_reception_france': getattr(projet, 'date_reception_france', None),
-                    'date_debut_reprise': getattr(projet, 'date_debut_reprise', None),
-                    'date_fin_prevue_reprise': getattr(projet, 'date_fin_prevue_reprise', None),
-                    'date_debut_prod_mada': getattr(projet, 'date_debut_prod_mada', None),
-                    'date_fin_prevue_prod_mada': getattr(projet, 'date_fin_prevue_prod_mada', None),
-                    'date_fin_prod_mada_reelle': getattr(projet, 'date_fin_prod_mada_reelle', None),
-                    'etape': etape,
-                    'couleur': getattr(projet, 'couleur', '#007bff'),
-                    'commercial': f"{projet.commercial.prenoms} {projet.commercial.nom}" if projet.commercial else 'Commercial inconnu',
-                    'responsable_ca': f"{projet.responsable_ca.prenoms} {projet.responsable_ca.nom}" if projet.responsable_ca else 'CA inconnu',
-                    'date_creation': projet.created_at.isoformat() if projet.created_at else None,
-                    'is_complement': False
-                })
-
-            except Exception as e:
-                print(f"Erreur sur le projet {projet.reference}: {str(e)}")
-                # Ajouter quand même le projet avec les données basiques
-                projets_data.append({
-                    'id': projet.id,
-                    'reference': projet.reference,
-                    'nom_affaire': getattr(projet, 'nom_affaire', projet.reference),
-                    'agence': projet.agence.nom if projet.agence else 'Agence inconnue',
-                    'etape': 'Erreur',
-                    'couleur': getattr(projet, 'couleur', '#007bff'),
-                    'commercial': f"{projet.commercial.prenoms} {projet.commercial.nom}" if projet.commercial else 'Commercial inconnu',
-                    'responsable_ca': f"{projet.responsable_ca.prenoms} {projet.responsable_ca.nom}" if projet.responsable_ca else 'CA inconnu',
-                })
-                continue
-
-        print(f"Projets traités avec succès: {len(projets_data)}")
-        print("=== FIN get_projets_prod ===")
-
-        return JsonResponse({'projets': projets_data})
-
-    except Exception as e:
-        print(f"ERREUR GLOBALE dans get_projets_prod: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
+        return JsonResponse(donnees_tableau(request, CHAMPS_PROJET_PROD, list(CHAMPS_PROJET_PROD), 'etape_prod'))
+    except ValueError as e:
+        # Paramètres invalides (fields, cursor, limit, since, dates) ; le reste est une erreur serveur
         return JsonResponse({'error': str(e)}, status=400)
 
 
-def get_etape_prod(projet):
-    """Détermine l'étape actuelle pour PROD"""
-    try:
-        etape_envoi_mada = getattr(projet, 'etape_envoi_mada', None)
-        etape_reprise_france = getattr(projet, 'etape_reprise_france', None)
-        etape_prod_mada = getattr(projet, 'etape_prod_mada', None)
-        date_reception_france = getattr(projet, 'date_reception_france', None)
-        commentaire_fin_reprise = getattr(projet, 'commentaire_fin_reprise', '')
-
-        print(f"Debug PROD {projet.reference}: envoi_mada={etape_envoi_mada}, date_reception={date_reception_france}, reprise={etape_reprise_france}, commentaire={commentaire_fin_reprise}")
-
-        # CORRECTION : Ajouter le cas etape_envoi_mada = 'en_cours'
-        # Étape 1: Réception des données en France (envoi en cours)
-        if etape_envoi_mada == 'en_cours' and not date_reception_france and not commentaire_fin_reprise:
-            return 'Réception des données en France'
-
-        # Étape 1b: Problème de réception (envoi en cours mais non reçu avec commentaire)
-        elif etape_envoi_mada == 'en_cours' and not date_reception_france and commentaire_fin_reprise:
-            return 'Problème de réception'
-
-        # Étape 1c: Ancienne logique (pour compatibilité)
-        elif etape_envoi_mada == 'termine' and not date_reception_france and not commentaire_fin_reprise:
-            return 'Réception des données en France'
-
-        # Étape 1d: Ancienne logique (pour compatibilité)
-        elif etape_envoi_mada == 'termine' and not date_reception_france and commentaire_fin_reprise:
-            return 'Problème de réception'
-
-        # Étape 2: Après réception OK → Envoie de reprise en France
-        elif date_reception_france and etape_reprise_france in [None, 'en_attente']:
-            return 'Envoie de reprise en France'
-
-        # Étape 3: Reprise en cours
-        elif etape_reprise_france == 'en_cours':
-            return 'Reprise en cours'
-
-        # Étape 4: Après reprise terminée → Prod Mada
-        elif etape_reprise_france == 'termine' and etape_prod_mada in [None, 'en_attente']:
-            return 'Prod en cours Mada'
-
-        # Étape 5: Prod Mada en cours
-        elif etape_prod_mada == 'en_cours':
-            return 'Prod en cours Mada'
-
-        # Étape 6: Production terminée
-        elif etape_prod_mada == 'termine':
-            return 'Production terminée'
-
-        # Complément
-        reference = getattr(projet, 'reference', '')
-        if reference and 'Complément' in reference:
-            return 'Complément'
-
-        return 'Non prêt pour PROD'
-
-    except Exception as e:
-        print(f"Erreur dans get_etape_prod: {str(e)}")
-        return 'Erreur'
-
-
 @csrf_exempt
 @login_required
 def reception_donnees(request, projet_id):
@@ -1061,6 +1164,7 @@ def reception_donnees(request, projet_id):
             commentaire = data.get('commentaire', '')
 
             projet = AppelOffre.objects.get(id=projet_id, statut='gagne')
+            workflow.verifier_transition('reception_donnees', projet)
 
             if statut == 'ok':
                 # Marquer comme reçu ET terminé
@@ -1069,34 +1173,39 @@ def reception_donnees(request, projet_id):
                 projet.etape_envoi_mada = 'termine'
                 projet.commentaire_fin_reprise = ''
                 projet.probleme_confirme = False  # Reset le flag
-                projet.save()
+                projet.enregistrer_transition([
+                    'date_reception_france', 'etape_reprise_france', 'etape_envoi_mada', 'commentaire_fin_reprise',
+                    'probleme_confirme',
+                ], data.get('version'))
             else:
                 if not commentaire.strip():
                     return JsonResponse({'error': 'Commentaire obligatoire pour "Non reçu"'}, status=400)
 
-                # SAUVEGARDER DANS L'HISTORIQUE AVANT D'ÉCRASER
-                if not hasattr(projet, 'historique_commentaires'):
-                    projet.historique_commentaires = []
-
-                # Ajouter le commentaire à l'historique avec timestamp
-                historique_entry = {
-                    'date': date.today().isoformat(),
-                    'commentaire': commentaire,
-                    'type': 'non_recu',
-                    'etape_envoi_mada': projet.etape_envoi_mada
-                }
-                projet.historique_commentaires.append(historique_entry)
-
-                # Mettre à jour le commentaire actuel
-                projet.commentaire_fin_reprise = commentaire
-                projet.date_reception_france = None
-                # IMPORTANT: Garder etape_envoi_mada à 'en_cours' pour permettre le ré-envoi
-                projet.etape_envoi_mada = 'en_cours'
-                projet.probleme_confirme = False  # Reset pour nouveau cycle
-                projet.save()
+                with transaction.atomic():
+                    # SAUVEGARDER DANS L'HISTORIQUE AVANT D'ÉCRASER
+                    projet.evenements.create(
+                        type='non_recu',
+                        auteur=request.user,
+                        payload={
+                            'commentaire': commentaire,
+                            'etape_envoi_mada': projet.etape_envoi_mada
+                        }
+                    )
+
+                    # Mettre à jour le commentaire actuel
+                    projet.commentaire_fin_reprise = commentaire
+                    projet.date_reception_france = None
+                    # IMPORTANT: Garder etape_envoi_mada à 'en_cours' pour permettre le ré-envoi
+                    projet.etape_envoi_mada = 'en_cours'
+                    projet.probleme_confirme = False  # Reset pour nouveau cycle
+                    projet.enregistrer_transition([
+                        'commentaire_fin_reprise', 'date_reception_france', 'etape_envoi_mada', 'probleme_confirme',
+                    ], data.get('version'))
 
             return JsonResponse({'success': True})
 
+        except ModificationConcurrente as e:
+            return JsonResponse({'error': str(e)}, status=409)
         except AppelOffre.DoesNotExist:
             return JsonResponse({'error': 'Projet non trouvé'}, status=404)
         except Exception as e:
@@ -1107,6 +1216,7 @@ def reception_donnees(request, projet_id):
 
 @csrf_exempt
 @login_required
+@idempotent
 def envoie_reprise(request, projet_id):
     """Gère l'envoi de reprise en France"""
     if request.method == 'POST':
@@ -1116,36 +1226,45 @@ def envoie_reprise(request, projet_id):
             commentaire = data.get('commentaire', '')
 
             projet = AppelOffre.objects.get(id=projet_id, statut='gagne')
+            workflow.verifier_transition('envoie_reprise', projet)
 
             if action == 'pas':
                 # Pas de reprise → Migre à Prod Mada en CA
                 projet.etape_reprise_france = 'termine'  # Skip
                 projet.etape_prod_mada = 'en_attente'
+                projet.enregistrer_transition(['etape_reprise_france', 'etape_prod_mada'], data.get('version'))
             else:  # 'faire'
                 if not commentaire.strip():
                     return JsonResponse({'error': 'Commentaire obligatoire pour reprise'}, status=400)
                 # Créer AO complément
                 complement_ref = f"{projet.reference} - Complément"
-                complement = AppelOffre.objects.create(
-                    reference=complement_ref,
-                    nom_affaire=projet.nom_affaire,
-                    agence=projet.agence,
-                    commercial=projet.commercial,
-                    responsable_ca=projet.responsable_ca,
-                    description=f"Complément pour {projet.reference}: {commentaire}",
-                    couleur=projet.couleur,
-                    statut='gagne',
-                    etape_reprise_france='en_cours',  # Démarre reprise complément
-                    date_debut_reprise=date.today()
-                )
-                complement.prestations.set(projet.prestations.all())
-                # Original passe à prod après complément
-                projet.etape_reprise_france = 'termine'  # Temporaire
-                projet.commentaire_reprise = commentaire
+                with transaction.atomic():
+                    complement = AppelOffre.objects.create(
+                        reference=complement_ref,
+                        parent=projet,
+                        is_complement=True,
+                        nom_affaire=projet.nom_affaire,
+                        agence=projet.agence,
+                        commercial=projet.commercial,
+                        responsable_ca=projet.responsable_ca,
+                        date_debut=projet.date_debut,  # Période AO obligatoire : celle du projet d'origine
+                        date_fin=projet.date_fin,
+                        description=f"Complément pour {projet.reference}: {commentaire}",
+                        couleur=projet.couleur,
+                        statut='gagne',
+                        etape_reprise_france='en_cours',  # Démarre reprise complément
+                        date_debut_reprise=date.today()
+                    )
+                    complement.prestations.set(projet.prestations.all())
+                    # Original passe à prod après complément
+                    projet.etape_reprise_france = 'termine'  # Temporaire
+                    projet.commentaire_reprise = commentaire
+                    projet.enregistrer_transition(['etape_reprise_france'], data.get('version'))
 
-            projet.save()
             return JsonResponse({'success': True, 'complement_id': complement.id if action == 'faire' else None})
 
+        except ModificationConcurrente as e:
+            return JsonResponse({'error': str(e)}, status=409)
         except AppelOffre.DoesNotExist:
             return JsonResponse({'error': 'Projet non trouvé'}, status=404)
         except Exception as e:
@@ -1160,17 +1279,21 @@ def confirmer_probleme_reception(request, projet_id):
     """Confirme la prise de connaissance d'un problème de réception"""
     if request.method == 'POST':
         try:
+            data = json.loads(request.body or b'{}')
             projet = AppelOffre.objects.get(id=projet_id, statut='gagne')
+            workflow.verifier_transition('confirmer_probleme_reception', projet)
 
             # Marquer que le problème est confirmé
             projet.probleme_confirme = True  # Ajoutez ce champ au modèle si nécessaire
             # OU utiliser un champ existant comme flag
             # projet.etape_envoi_mada = 'confirme'  # Alternative
 
-            projet.save()
+            projet.enregistrer_transition(['probleme_confirme'], data.get('version'))
 
             return JsonResponse({'success': True})
 
+        except ModificationConcurrente as e:
+            return JsonResponse({'error': str(e)}, status=409)
         except AppelOffre.DoesNotExist:
             return JsonResponse({'error': 'Projet non trouvé'}, status=404)
         except Exception as e:
@@ -1188,6 +1311,7 @@ def commencer_prod_mada(request):
             projet_id = data['projet_id']
 
             projet = AppelOffre.objects.get(id=projet_id, statut='gagne')
+            workflow.verifier_transition('commencer_prod_mada', projet)
 
             # Validation dates
             date_debut = datetime.strptime(data['date_debut_prod'], '%Y-%m-%d').date()
@@ -1201,10 +1325,14 @@ def commencer_prod_mada(request):
             projet.date_fin_prevue_prod_mada = date_fin_prevue
             projet.date_debut_prod_mada_reelle = date.today()
             projet.etape_prod_mada = 'en_cours'
-            projet.save()
+            projet.enregistrer_transition([
+                'date_debut_prod_mada', 'date_fin_prevue_prod_mada', 'etape_prod_mada',
+            ], data.get('version'))
 
             return JsonResponse({'success': True})
 
+        except ModificationConcurrente as e:
+            return JsonResponse({'error': str(e)}, status=409)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
 
@@ -1221,12 +1349,15 @@ def fin_prod_mada(request, projet_id):
             date_fin_reelle = datetime.strptime(data['date_fin_reelle_prod'], '%Y-%m-%d').date()
 
             projet = AppelOffre.objects.get(id=projet_id, statut='gagne')
+            workflow.verifier_transition('fin_prod_mada', projet)
             projet.date_fin_prod_mada_reelle = date_fin_reelle
             projet.etape_prod_mada = 'termine'
-            projet.save()
+            projet.enregistrer_transition(['date_fin_prod_mada_reelle', 'etape_prod_mada'], data.get('version'))
 
             return JsonResponse({'success': True})
 
+        except ModificationConcurrente as e:
+            return JsonResponse({'error': str(e)}, status=409)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
 
@@ -1242,11 +1373,13 @@ def gestion_complement(request, projet_id):
             data = json.loads(request.body)
             action = data['action']
 
-            complement = AppelOffre.objects.get(id=projet_id, reference__endswith=' - Complément')
+            complement = AppelOffre.objects.select_related('parent').get(id=projet_id, is_complement=True)
+            workflow.verifier_transition('gestion_complement', complement)
 
             if action == 'fin':
                 complement.etape_reprise_france = 'termine'
                 complement.date_fin_reprise = date.today()
+                complement.enregistrer_transition(['etape_reprise_france'], data.get('version'))
             else:  # 'envoyer'
                 # Similaire à envoyer_donnees_mada
                 date_envoi = datetime.strptime(data['date_envoi'], '%Y-%m-%d').date()
@@ -1256,13 +1389,20 @@ def gestion_complement(request, projet_id):
                 complement.info_supplementaire_mada = data.get('info_supplementaire', '')
                 complement.etape_envoi_mada = 'termine'
                 # Migre original à prod si complément fini
-                original = AppelOffre.objects.get(reference=complement.reference.replace(' - Complément', ''))
+                original = complement.parent
+                if original is None:
+                    return JsonResponse({'error': "Projet d'origine du complément introuvable"}, status=400)
                 original.etape_prod_mada = 'en_attente'
 
-            complement.save()
-            original.save() if action == 'envoyer' else None
+                with transaction.atomic():
+                    complement.enregistrer_transition([
+                        'date_envoi_mada', 'date_livraison_prevue_mada', 'info_supplementaire_mada', 'etape_envoi_mada',
+                    ], data.get('version'))
+                    original.enregistrer_transition(['etape_prod_mada'])
             return JsonResponse({'success': True})
 
+        except ModificationConcurrente as e:
+            return JsonResponse({'error': str(e)}, status=409)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
 
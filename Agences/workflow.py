@@ -0,0 +1,184 @@
+"""Définition déclarative du workflow des appels d'offre.
+
+Chaque étape est décrite une seule fois par une condition ``Q`` sur les champs
+d'``AppelOffre``. La même définition sert :
+
+- en Python, pour calculer l'étape d'une instance (``resoudre_etape``) ;
+- en SQL, pour annoter ou mettre à jour un queryset (``expression_etape``).
+
+Les étapes sont testées dans l'ordre : la première condition vraie l'emporte.
+"""
+from collections import namedtuple
+
+from django.db.models import Case, CharField, Q, Value, When
+
+Etape = namedtuple('Etape', ['code', 'libelle', 'condition'])
+Transition = namedtuple('Transition', ['action', 'tableau', 'sources'])
+Phase = namedtuple('Phase', ['code', 'libelle', 'debut', 'fin_prevue', 'fin_reelle', 'agence', 'responsable', 'terminee'])
+
+_ENVOI_NON_RECU = Q(date_reception_france__isnull=True)
+_PROBLEME_SIGNALE = ~Q(commentaire_fin_reprise='')
+_PROD_MADA = Q(etape_reprise_france='termine', etape_prod_mada='en_attente') | Q(etape_prod_mada='en_cours')
+
+# Étapes du tableau CA
+ETAPES_CA = [
+    Etape('non_gagne', 'Non gagné', ~Q(statut='gagne')),
+    Etape('ao_gagne', 'AO Gagné', Q(etape_terrain_france='en_attente')),
+    Etape('terrain_france', 'Terrain France', Q(etape_terrain_france='en_cours')),
+    Etape('traitement_france', 'Traitement France',
+          Q(etape_terrain_france='termine', etape_traitement_france='en_attente')),
+    Etape('traitement_france_en_cours', 'Traitement France en cours', Q(etape_traitement_france='en_cours')),
+    Etape('pret_envoi_mada', 'Prêt pour envoi Mada',
+          Q(etape_traitement_france='termine', etape_envoi_mada='en_attente')),
+    Etape('probleme_reception', 'Problème de réception',
+          Q(etape_envoi_mada='en_cours') & _ENVOI_NON_RECU & _PROBLEME_SIGNALE),
+    Etape('envoi_mada', 'Envoi des données à Mada', Q(etape_envoi_mada='en_cours') & _ENVOI_NON_RECU),
+    Etape('reprise_france', 'Reprise des données France',
+          Q(date_reception_france__isnull=False, etape_reprise_france='en_attente')
+          | Q(etape_reprise_france='en_cours')),
+    Etape('prod_mada', 'Prod en cours Mada', _PROD_MADA),
+    Etape('production_terminee', 'Production terminée', Q(etape_prod_mada='termine')),
+]
+ETAPE_CA_DEFAUT = Etape('en_attente', 'En attente', None)
+
+# Étapes du tableau PROD ('termine' sur l'envoi : ancienne logique conservée)
+ETAPES_PROD = [
+    Etape('probleme_reception', 'Problème de réception',
+          Q(etape_envoi_mada__in=['en_cours', 'termine']) & _ENVOI_NON_RECU & _PROBLEME_SIGNALE),
+    Etape('reception_france', 'Réception des données en France',
+          Q(etape_envoi_mada__in=['en_cours', 'termine']) & _ENVOI_NON_RECU),
+    Etape('envoi_reprise', 'Envoie de reprise en France',
+          Q(date_reception_france__isnull=False, etape_reprise_france='en_attente')),
+    Etape('reprise_en_cours', 'Reprise en cours', Q(etape_reprise_france='en_cours')),
+    Etape('prod_mada', 'Prod en cours Mada', _PROD_MADA),
+    Etape('production_terminee', 'Production terminée', Q(etape_prod_mada='termine')),
+    Etape('complement', 'Complément', Q(is_complement=True)),
+]
+ETAPE_PROD_DEFAUT = Etape('non_pret', 'Non prêt pour PROD', None)
+
+ETAPE_CA_CHOICES = [(e.code, e.libelle) for e in ETAPES_CA + [ETAPE_CA_DEFAUT]]
+ETAPE_PROD_CHOICES = [(e.code, e.libelle) for e in ETAPES_PROD + [ETAPE_PROD_DEFAUT]]
+
+# Échéance prévue surveillée pour chaque étape CA (retards). Un problème de réception
+# reste dans la phase d'envoi Mada : même échéance que l'envoi.
+ECHEANCES_CA = {
+    'terrain_france': 'date_fin_prevue_terrain',
+    'traitement_france_en_cours': 'date_fin_prevue_traitement',
+    'probleme_reception': 'date_livraison_prevue_mada',
+    'envoi_mada': 'date_livraison_prevue_mada',
+    'reprise_france': 'date_fin_prevue_reprise',
+    'prod_mada': 'date_fin_prevue_prod_mada',
+}
+
+# Phases datées d'un projet et colonnes d'AppelOffre qui les décrivent (table ProjetPhase).
+# Sans agence propre à la phase, c'est l'agence du projet qui est retenue. Une phase est
+# terminée quand sa fin réelle est saisie ou que la colonne de la dernière valeur
+# ``(colonne, valeur)`` l'atteint : la phase AO s'achève quand l'AO est gagné, et la
+# livraison Mada comme la fin de reprise n'ont pas de date réelle saisie par le workflow.
+PHASES = [
+    Phase('ao', 'AO Gagné', 'date_debut', 'date_fin', 'date_fin_reelle', None, 'responsable_ca',
+          ('statut', 'gagne')),
+    Phase('terrain', 'Terrain France', 'date_debut_terrain', 'date_fin_prevue_terrain',
+          'date_fin_terrain_reelle', 'agence_terrain', 'responsable_prod_terrain',
+          ('etape_terrain_france', 'termine')),
+    Phase('traitement', 'Traitement France', 'date_debut_traitement', 'date_fin_prevue_traitement',
+          'date_fin_traitement_reelle', 'agence_traitement', 'responsable_prod_traitement',
+          ('etape_traitement_france', 'termine')),
+    Phase('envoi_mada', 'Envoi Mada', 'date_envoi_mada', 'date_livraison_prevue_mada',
+          'date_livraison_reelle_mada', None, None, ('etape_envoi_mada', 'termine')),
+    Phase('reprise', 'Reprise France', 'date_debut_reprise', 'date_fin_prevue_reprise',
+          'date_fin_reprise_reelle', None, None, ('etape_reprise_france', 'termine')),
+    Phase('prod_mada', 'Prod Mada', 'date_debut_prod_mada', 'date_fin_prevue_prod_mada',
+          'date_fin_prod_mada_reelle', None, None, ('etape_prod_mada', 'termine')),
+]
+PHASE_CHOICES = [(p.code, p.libelle) for p in PHASES]
+# Colonnes d'AppelOffre lues pour construire les phases (l'agence du projet sert de repli)
+COLONNES_PHASES = {colonne for p in PHASES for colonne in (p.debut, p.fin_prevue, p.fin_reelle, p.agence,
+                                                             p.responsable) if colonne} | {'agence'}
+
+# Actions du workflow et étapes depuis lesquelles elles sont autorisées
+TRANSITIONS = {t.action: t for t in [
+    Transition('commencer_terrain_france', 'ca', {'ao_gagne'}),
+    Transition('fin_terrain_france', 'ca', {'terrain_france'}),
+    Transition('commencer_traitement_france', 'ca', {'traitement_france'}),
+    Transition('fin_traitement_france', 'ca', {'traitement_france_en_cours'}),
+    Transition('envoyer_donnees_mada', 'ca', {'pret_envoi_mada', 'probleme_reception'}),
+    Transition('confirmer_probleme_reception', 'ca', {'probleme_reception'}),
+    Transition('reception_donnees', 'prod', {'reception_france'}),
+    Transition('envoie_reprise', 'prod', {'envoi_reprise'}),
+    Transition('commencer_prod_mada', 'prod', {'prod_mada'}),
+    Transition('fin_prod_mada', 'prod', {'prod_mada'}),
+    Transition('gestion_complement', 'prod', {'complement', 'reprise_en_cours'}),
+]}
+
+
+class TransitionInvalide(ValueError):
+    """Action du workflow demandée depuis une étape qui ne l'autorise pas."""
+
+
+def _evaluer_lookup(instance, lookup, valeur):
+    champ, _, operateur = lookup.partition('__')
+    actuel = getattr(instance, champ)
+    if operateur in ('', 'exact'):
+        return actuel == valeur
+    if operateur == 'in':
+        return actuel in valeur
+    if operateur == 'isnull':
+        return (actuel is None) == valeur
+    if operateur == 'contains':
+        return actuel is not None and valeur in actuel
+    raise ValueError(f"Lookup non supporté par le workflow : {lookup}")
+
+
+def evaluer_condition(condition, instance):
+    """Évalue en Python une condition ``Q`` du workflow sur une instance."""
+    resultats = (
+        evaluer_condition(enfant, instance) if isinstance(enfant, Q) else _evaluer_lookup(instance, *enfant)
+        for enfant in condition.children
+    )
+    resultat = all(resultats) if condition.connector == Q.AND else any(resultats)
+    return not resultat if condition.negated else resultat
+
+
+def resoudre_etape(etapes, defaut, instance):
+    """Retourne le code de la première étape dont la condition est vraie."""
+    for etape in etapes:
+        if evaluer_condition(etape.condition, instance):
+            return etape.code
+    return defaut.code
+
+
+def expression_etape(etapes, defaut):
+    """Traduit les étapes en expression ``Case/When`` pour annoter ou mettre à jour en SQL."""
+    return Case(
+        *[When(etape.condition, then=Value(etape.code)) for etape in etapes],
+        default=Value(defaut.code),
+        output_field=CharField(),
+    )
+
+
+def etape_ca(instance):
+    return resoudre_etape(ETAPES_CA, ETAPE_CA_DEFAUT, instance)
+
+
+def etape_prod(instance):
+    return resoudre_etape(ETAPES_PROD, ETAPE_PROD_DEFAUT, instance)
+
+
+def expression_etape_ca():
+    return expression_etape(ETAPES_CA, ETAPE_CA_DEFAUT)
+
+
+def expression_etape_prod():
+    return expression_etape(ETAPES_PROD, ETAPE_PROD_DEFAUT)
+
+
+def verifier_transition(action, instance):
+    """Lève ``TransitionInvalide`` si l'action n'est pas permise à l'étape actuelle."""
+    transition = TRANSITIONS[action]
+    if transition.tableau == 'ca':
+        etape, choix = etape_ca(instance), dict(ETAPE_CA_CHOICES)
+    else:
+        etape, choix = etape_prod(instance), dict(ETAPE_PROD_CHOICES)
+    if etape not in transition.sources:
+        raise TransitionInvalide(f"Action impossible à l'étape « {choix[etape]} »")